@@ -0,0 +1,118 @@
+import random
+from typing import List
+
+from pypgx.common import get_stardb, get_target_genes
+
+GT_HEADER = [
+    "gene", "name", "status", "hap1_main", "hap2_main", "hap1_cand",
+    "hap2_cand", "hap1_score", "hap2_score", "dip_score", "dip_sv",
+    "hap1_sv", "hap2_sv", "ssr", "dip_cand", "hap1_main_core",
+    "hap2_main_core", "hap1_main_tag", "hap2_main_tag",
+    "hap1_af_mean_gene", "hap2_af_mean_gene", "hap1_af_mean_main",
+    "hap2_af_mean_main",
+]
+
+def pick_genes(n: int) -> List[str]:
+    """Return the first n target genes (CYP2D6 always included)."""
+    genes = ["cyp2d6"] + [x for x in get_target_genes() if x != "cyp2d6"]
+    return genes[:n]
+
+def _genotype_row(rng, gene, name, stardb):
+    names = list(stardb)
+    stars = [stardb[rng.choice(names)], stardb[rng.choice(names)]]
+    mains = [x.name for x in stars]
+
+    if rng.random() < 0.05:
+        mains[0] += "x2"
+        scores = [stars[0].score * 2, stars[1].score]
+    else:
+        scores = [stars[0].score, stars[1].score]
+
+    svs = [x.sv or "no_sv" for x in stars]
+    cores = [",".join([f"{y.pos}:{y.wt}>{y.var}" for y in x.core]) or "."
+        for x in stars]
+
+    return [
+        gene, name, "g", mains[0], mains[1], mains[0], mains[1],
+        str(scores[0]), str(scores[1]), str(sum(scores)), ",".join(svs),
+        svs[0], svs[1], "0.0", ".", cores[0], cores[1], ".", ".",
+        "0.5", "0.5", "0.5", "0.5",
+    ]
+
+def make_genotype_file(
+        fn: str,
+        genes: List[str],
+        samples: int,
+        seed: int = 0
+    ) -> None:
+    """Write a Stargazer genotype file with one row per gene per sample."""
+    rng = random.Random(seed)
+    stardbs = {x: get_stardb(x, "hg19") for x in genes}
+
+    with open(fn, "w") as f:
+        f.write("\t".join(GT_HEADER) + "\n")
+        for gene in genes:
+            for i in range(samples):
+                row = _genotype_row(rng, gene, f"S{i + 1}", stardbs[gene])
+                f.write("\t".join(row) + "\n")
+
+def make_sdf_file(
+        fn: str,
+        samples: int,
+        loci: int,
+        seed: int = 0
+    ) -> None:
+    """Write a SDF file (i.e. ``samtools depth -a`` output)."""
+    rng = random.Random(seed)
+
+    with open(fn, "w") as f:
+        for i in range(loci):
+            depth = [str(rng.randint(0, 60)) for x in range(samples)]
+            f.write("\t".join(["22", str(42512500 + i)] + depth) + "\n")
+
+def make_vcf_file(
+        fn: str,
+        samples: int,
+        records: int,
+        seed: int = 0,
+        target_gene: str = "cyp2d6",
+        genome_build: str = "hg19"
+    ) -> None:
+    """Write a phased Stargazer-style VCF file (i.e. ``finalized.vcf``)."""
+    rng = random.Random(seed)
+    bases = "ACGT"
+
+    with open(fn, "w") as f:
+        f.write(
+            "##fileformat=VCFv4.2\n"
+            f"##target_gene={target_gene}\n"
+            f"##genome_build={genome_build}\n"
+        )
+        header = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+            "INFO", "FORMAT"] + [f"S{i + 1}" for i in range(samples)]
+        f.write("\t".join(header) + "\n")
+
+        for i in range(records):
+            ref = rng.choice(bases)
+            alt = [x for x in bases if x != ref][:rng.randint(1, 2)]
+            n = len(alt)
+            info = ";".join([
+                "VI=" + ",".join(["low_impact"] * n),
+                "SO=" + ",".join(["missense_variant"] * n),
+                "FE=" + ",".join(["."] * n),
+                "RV=" + ",".join(["."] * n),
+                "PS=D",
+            ])
+            fields = ["22", str(42522500 + i * 10), f"rs{i + 1}", ref,
+                ",".join(alt), "100", "PASS", info, "GT:AD"]
+            for j in range(samples):
+                gt = [rng.randint(0, n), rng.randint(0, n)]
+                ad = [str(rng.randint(0, 40)) for x in range(n + 1)]
+                fields.append(f"{gt[0]}|{gt[1]}:{','.join(ad)}")
+            f.write("\t".join(fields) + "\n")
+
+def make_sample_map(fn: str, samples: int) -> None:
+    """Write a sample map pairing each sample with itself."""
+    with open(fn, "w") as f:
+        for i in range(samples):
+            f.write(f"S{i + 1}\tS{i + 1}\n")
@@ -0,0 +1,217 @@
+"""
+Micro- and macro-benchmarks for the pure-Python hot paths of PyPGx.
+
+All input data is generated synthetically, so the suite runs offline.
+Scale is controlled with the number of samples, VCF records/SDF loci and
+genes. For each benchmark the best wall time of several runs, the
+throughput and the peak memory (measured with ``tracemalloc`` in a
+separate run) are reported as a tab-delimited table, which can be
+appended to a history file to track regressions between releases::
+
+    $ python -m benchmarks.run --samples 100 --records 200 --genes 5
+    $ python -m benchmarks.run --history bench_history.tsv
+"""
+
+import os
+import gc
+import sys
+import time
+import argparse
+import datetime
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+from pypgx.version import __version__
+from pypgx.common import clear_cache, get_stardb, _resource_path
+from pypgx.sglib import (
+    read_gene_table,
+    read_snp_table,
+    read_star_table,
+    build_snpdb,
+    build_stardb,
+    vcf2biosamples,
+)
+from pypgx.phenotyper import phenotyper, phenotyper_batch
+from pypgx.sdf2gdf import sdf2gdf
+from pypgx.summary import summary
+from pypgx.meta import meta
+from pypgx.compgt import compgt
+from pypgx.compvcf import compvcf
+from pypgx.gt2html import gt2html
+from vcfgo.VCFFile import VCFFile
+
+from .generators import (
+    pick_genes,
+    make_genotype_file,
+    make_sdf_file,
+    make_vcf_file,
+    make_sample_map,
+)
+
+HEADER = ["benchmark", "items", "seconds", "items_per_sec", "peak_mb"]
+
+def _get_stardb_cold(genes):
+    for gene in genes:
+        clear_cache()
+        get_stardb(gene, "hg19")
+
+def _build_stardb(genes):
+    gene_table = read_gene_table(_resource_path("gene_table.txt"))
+    snp_table = read_snp_table(_resource_path("snp_table.txt"), gene_table)
+    star_table = read_star_table(_resource_path("star_table.txt"))
+    for gene in genes:
+        snpdb = build_snpdb(gene, "hg19", snp_table)
+        build_stardb(gene, "hg19", star_table, snpdb)
+
+def _read_diplotypes(fn):
+    with open(fn) as f:
+        next(f)
+        rows = [x.strip().split("\t") for x in f]
+    return [x[0] for x in rows], [x[3] for x in rows], [x[4] for x in rows]
+
+def _phenotyper(genes, hap1s, hap2s):
+    for x in zip(genes, hap1s, hap2s):
+        phenotyper(*x)
+
+def _vcf2biosamples(fn):
+    vcf = VCFFile(fn)
+    vcf.read()
+    vcf2biosamples(vcf)
+
+def _gt2html(files):
+    for fn in files:
+        gt2html(fn)
+
+def get_benchmarks(d, samples, records, genes):
+    """
+    Generate the input data in d and return the benchmarks to run.
+
+    Returns:
+        list[tuple]: (name, number of items, function, args) tuples.
+    """
+    gene_list = pick_genes(genes)
+
+    gt_file = f"{d}/genotype.txt"
+    make_genotype_file(gt_file, gene_list, samples)
+    diplotypes = _read_diplotypes(gt_file)
+
+    truth_file = f"{d}/truth.txt"
+    test_file = f"{d}/test.txt"
+    make_genotype_file(truth_file, gene_list[:1], samples, seed=1)
+    make_genotype_file(test_file, gene_list[:1], samples, seed=2)
+
+    summary_files = []
+    for i, gene in enumerate(gene_list):
+        fn = f"{d}/{gene}.txt"
+        make_genotype_file(fn, [gene], samples, seed=i)
+        summary_file = f"{d}/{gene}.summary.txt"
+        with open(summary_file, "w") as f:
+            f.write(summary(fn))
+        summary_files.append(summary_file)
+
+    reports = min(samples, 20)
+    report_files = []
+    for i in range(reports):
+        fn = f"{d}/report{i}.txt"
+        make_genotype_file(fn, gene_list, 1, seed=i)
+        report_files.append(fn)
+
+    sdf_file = f"{d}/depth.sdf"
+    make_sdf_file(sdf_file, samples, records)
+    ids = [f"S{i + 1}" for i in range(samples)]
+
+    vcf_file1 = f"{d}/truth.vcf"
+    vcf_file2 = f"{d}/test.vcf"
+    make_vcf_file(vcf_file1, samples, records, seed=1)
+    make_vcf_file(vcf_file2, samples, records, seed=2)
+
+    sample_map = f"{d}/sample_map.txt"
+    make_sample_map(sample_map, samples)
+
+    n = len(diplotypes[0])
+
+    return [
+        ("get_stardb", genes, _get_stardb_cold, [gene_list]),
+        ("build_stardb", genes, _build_stardb, [gene_list]),
+        ("phenotyper", n, _phenotyper, diplotypes),
+        ("phenotyper_batch", n, phenotyper_batch, diplotypes),
+        ("vcf2biosamples", samples * records, _vcf2biosamples, [vcf_file1]),
+        ("sdf2gdf", records, sdf2gdf, [sdf_file, ids]),
+        ("summary", n, summary, [gt_file]),
+        ("meta", len(summary_files), meta, [summary_files]),
+        ("compvcf", samples * records, compvcf,
+            [vcf_file1, vcf_file2, sample_map]),
+        ("compgt", samples, compgt, [truth_file, test_file, sample_map]),
+        ("gt2html", reports, _gt2html, [report_files]),
+    ]
+
+def run_benchmark(func, args, repeat):
+    """
+    Run a benchmark.
+
+    Returns:
+        tuple[float, float]: Best wall time (seconds) and peak memory (MB).
+    """
+    times = []
+
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times), peak / 1024 ** 2
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="run the PyPGx benchmark suite")
+    parser.add_argument("--samples", metavar="INT", type=int, default=100,
+        help="number of samples [100]")
+    parser.add_argument("--records", metavar="INT", type=int, default=200,
+        help="number of VCF records and SDF loci [200]")
+    parser.add_argument("--genes", metavar="INT", type=int, default=5,
+        help="number of target genes [5]")
+    parser.add_argument("--repeat", metavar="INT", type=int, default=3,
+        help="number of timed runs per benchmark [3]")
+    parser.add_argument("--select", metavar="STR", nargs="+",
+        help="only run these benchmarks")
+    parser.add_argument("--history", metavar="FILE",
+        help="append the results to FILE with the version and date")
+    return parser
+
+def main():
+    args = get_parser().parse_args()
+    rows = []
+
+    with TemporaryDirectory() as d:
+        benchmarks = get_benchmarks(d, args.samples, args.records, args.genes)
+        sys.stdout.write("\t".join(HEADER) + "\n")
+
+        for name, items, func, func_args in benchmarks:
+            if args.select and name not in args.select:
+                continue
+            seconds, peak = run_benchmark(func, func_args, args.repeat)
+            row = [name, items, f"{seconds:.4f}", f"{items / seconds:.1f}",
+                f"{peak:.2f}"]
+            sys.stdout.write("\t".join([str(x) for x in row]) + "\n")
+            sys.stdout.flush()
+            rows.append(row)
+
+    if args.history:
+        new = not os.path.exists(args.history)
+        scale = f"{args.samples}x{args.records}x{args.genes}"
+        with open(args.history, "a") as f:
+            if new:
+                f.write("\t".join(["version", "date", "scale"] + HEADER) + "\n")
+            for row in rows:
+                fields = [__version__, datetime.date.today(), scale] + row
+                f.write("\t".join([str(x) for x in fields]) + "\n")
+
+if __name__ == "__main__":
+    main()
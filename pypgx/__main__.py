@@ -22,6 +22,7 @@ from .fq2bam import fq2bam
 from .bam2bam import bam2bam
 from .bam2sdf import bam2sdf
 from .sdf2gdf import sdf2gdf
+from .dm2gdf import dm2gdf
 from .pgkb import pgkb
 from .minivcf import minivcf
 from .mergevcf import mergevcf
@@ -35,6 +36,7 @@ from .viewsnp import viewsnp
 from .compgt import compgt
 from .compvcf import compvcf
 from .unicov import unicov
+from .gtcache import gtcache
 
 PYPGX_TOOLS = {
     "bam2gt": bam2gt,
@@ -49,6 +51,7 @@ PYPGX_TOOLS = {
     "bam2bam": bam2bam,
     "bam2sdf": bam2sdf,
     "sdf2gdf": sdf2gdf,
+    "dm2gdf": dm2gdf,
     "pgkb": pgkb,
     "minivcf": minivcf,
     "mergevcf": mergevcf,
@@ -62,6 +65,7 @@ PYPGX_TOOLS = {
     "compgt": compgt,
     "compvcf": compvcf,
     "unicov": unicov,
+    "gtcache": gtcache,
 }
 
 def get_parser():
@@ -87,12 +91,28 @@ def get_parser():
     bam_getter_parser.add_argument(
         "--bam_dir",
         metavar="DIR",
-        help="treat any BAM files in DIR as input"
+        help="treat any BAM/CRAM files in DIR as input"
     )
     bam_getter_parser.add_argument(
         "--bam_list",
         metavar="FILE",
-        help="read BAM files from FILE, one file path per line"
+        help="read BAM/CRAM files from FILE, one file path per line"
+    )
+
+    fasta_parser = argparse.ArgumentParser(add_help=False)
+    fasta_parser.add_argument(
+        "--fasta_file",
+        metavar="FILE",
+        help="reference FASTA file used to decode CRAM files"
+    )
+
+    threads_parser = argparse.ArgumentParser(add_help=False)
+    threads_parser.add_argument(
+        "--threads",
+        metavar="INT",
+        type=int,
+        default=1,
+        help="number of parallel worker processes [1]"
     )
 
     subparsers = parser.add_subparsers(
@@ -134,7 +154,7 @@ def get_parser():
     bam2gt_parser.add_argument(
         "bam_file",
         nargs="*",
-        help="input BAM files"
+        help="input BAM/CRAM files"
     )
     bam2gt_parser.add_argument(
         "--control_gene",
@@ -157,6 +177,11 @@ def get_parser():
         action="store_true",
         help="output copy number plots",
     )
+    bam2gt_parser.add_argument(
+        "--cache_dir",
+        metavar="DIR",
+        help="reuse VCF, GDF and Stargazer results stored in DIR"
+    )
 
     bam2gt2_parser = subparsers.add_parser(
         "bam2gt2",
@@ -170,18 +195,30 @@ def get_parser():
 
     gt2pt_parser = subparsers.add_parser(
         "gt2pt",
-        help="convert a genotype file to phenotypes",
-        parents=[output_parser]
+        help="convert genotype files to phenotypes",
+        parents=[output_parser, threads_parser]
     )
     gt2pt_parser.add_argument(
         "gt_file",
-        help="genotype file from Stargazer ('genotype.txt')",
+        nargs="*",
+        help="genotype files from Stargazer ('genotype.txt') or "
+            + "directories containing them",
+    )
+    gt2pt_parser.add_argument(
+        "--gt_dir",
+        metavar="DIR",
+        help="treat any genotype files in DIR as input"
+    )
+    gt2pt_parser.add_argument(
+        "--gt_list",
+        metavar="FILE",
+        help="read genotype files from FILE, one file path per line"
     )
 
     bam2vcf_parser = subparsers.add_parser(
         "bam2vcf",
         help="convert BAM files to a VCF file",
-        parents=[bam_getter_parser]
+        parents=[bam_getter_parser, threads_parser]
     )
     bam2vcf_parser.add_argument(
         "snp_caller",
@@ -194,11 +231,12 @@ def get_parser():
     bam2vcf_parser.add_argument(
         "target_gene",
         help="name or region of target gene (e.g. ‘cyp2d6’, "
-            + "‘chr22:42512500-42551883’)"
+            + "‘chr22:42512500-42551883’), comma-separated names of "
+            + "target genes or 'ALL'"
     )
     bam2vcf_parser.add_argument(
         "output_file",
-        help="write output to this file"
+        help="write output to this file (directory for several genes)"
     )
     bam2vcf_parser.add_argument(
         "genome_build",
@@ -207,7 +245,7 @@ def get_parser():
     bam2vcf_parser.add_argument(
         "bam_file",
         nargs="*",
-        help="input BAM files"
+        help="input BAM/CRAM files"
     )
     bam2vcf_parser.add_argument(
         "--dbsnp_file",
@@ -224,6 +262,11 @@ def get_parser():
         metavar="DIR",
         help="temporary files will be written to this directory"
     )
+    bam2vcf_parser.add_argument(
+        "--gvcf_cache",
+        metavar="DIR",
+        help="reuse gVCF files and GenomicsDB workspaces in DIR (GATK only)"
+    )
 
     bam2vcf2_parser = subparsers.add_parser(
         "bam2vcf2",
@@ -238,7 +281,7 @@ def get_parser():
     bam2gdf_parser = subparsers.add_parser(
         "bam2gdf",
         help="convert BAM files to a GDF file",
-        parents=[bam_getter_parser]
+        parents=[bam_getter_parser, threads_parser, fasta_parser]
     )
     bam2gdf_parser.add_argument(
         "genome_build",
@@ -246,7 +289,8 @@ def get_parser():
     )
     bam2gdf_parser.add_argument(
         "target_gene",
-        help="name of target gene (e.g. 'cyp2d6')",
+        help="name of target gene (e.g. 'cyp2d6'), comma-separated names "
+            + "or 'ALL'",
     )
     bam2gdf_parser.add_argument(
         "control_gene",
@@ -255,12 +299,35 @@ def get_parser():
     )
     bam2gdf_parser.add_argument(
         "output_file",
-        help="write output to this file"
+        help="write output to this file (directory for several genes)"
     )
     bam2gdf_parser.add_argument(
         "bam_file",
         nargs="*",
-        help="input BAM files"
+        help="input BAM/CRAM files"
+    )
+    bam2gdf_parser.add_argument(
+        "--matrix_file",
+        metavar="FILE",
+        help="also write read depth to a DM (depth matrix) file"
+    )
+    bam2gdf_parser.add_argument(
+        "--bin_size",
+        metavar="INT",
+        type=int,
+        help="output depth of windows of this size"
+    )
+    bam2gdf_parser.add_argument(
+        "--exon_bins",
+        action="store_true",
+        help="output depth of exons of the target and control genes"
+    )
+    bam2gdf_parser.add_argument(
+        "--bin_stat",
+        metavar="STR",
+        default="mean",
+        choices=["mean", "median"],
+        help="statistic of binned depth ('mean' or 'median') ['mean']"
     )
 
     gt2html_parser = subparsers.add_parser(
@@ -306,7 +373,7 @@ def get_parser():
     bam2sdf_parser = subparsers.add_parser(
         "bam2sdf",
         help="convert BAM files to a SDF file",
-        parents=[output_parser]
+        parents=[output_parser, threads_parser, fasta_parser]
     )
     bam2sdf_parser.add_argument(
         "genome_build",
@@ -323,7 +390,12 @@ def get_parser():
     bam2sdf_parser.add_argument(
         "bam_file",
         nargs="+",
-        help="BAM file",
+        help="BAM or CRAM file",
+    )
+    bam2sdf_parser.add_argument(
+        "--matrix_file",
+        metavar="FILE",
+        help="also write read depth to a DM (depth matrix) file"
     )
 
     sdf2gdf_parser = subparsers.add_parser(
@@ -341,6 +413,21 @@ def get_parser():
         help="sample ID",
     )
 
+    dm2gdf_parser = subparsers.add_parser(
+        "dm2gdf",
+        help="convert a DM file to a GDF file",
+        parents=[output_parser]
+    )
+    dm2gdf_parser.add_argument(
+        "dm_file",
+        help="DM (depth matrix) file",
+    )
+    dm2gdf_parser.add_argument(
+        "--region",
+        metavar="STR",
+        help="only convert this region (e.g. 'chr22:42522500-42523000')"
+    )
+
     pgkb_parser = subparsers.add_parser(
         "pgkb",
         help="extract CPIC guidelines using PharmGKB API",
@@ -513,7 +600,7 @@ def get_parser():
     unicov_parser = subparsers.add_parser(
         "unicov",
         help="compute the uniformity of sequencing coverage",
-        parents=[output_parser, bam_getter_parser]
+        parents=[output_parser, bam_getter_parser, threads_parser, fasta_parser]
     )
     unicov_parser.add_argument(
         "bed_file",
@@ -522,7 +609,53 @@ def get_parser():
     unicov_parser.add_argument(
         "bam_file",
         nargs="*",
-        help="input BAM files"
+        help="input BAM/CRAM files"
+    )
+    unicov_parser.add_argument(
+        "--coverages",
+        metavar="INT",
+        type=int,
+        nargs="+",
+        help="coverages to compute [1 10 20 30 40 50 100 200 300 400 500 1000]"
+    )
+    unicov_parser.add_argument(
+        "--region_file",
+        metavar="FILE",
+        help="write per-region uniformity to FILE"
+    )
+    unicov_parser.add_argument(
+        "--gene_file",
+        metavar="FILE",
+        help="write per-gene uniformity of target genes to FILE"
+    )
+    unicov_parser.add_argument(
+        "--genome_build",
+        metavar="STR",
+        default="hg19",
+        help="genome build of the BED file, used with --gene_file ['hg19']"
+    )
+
+    gtcache_parser = subparsers.add_parser(
+        "gtcache",
+        help="report and evict the result cache of bam2gt",
+        parents=[output_parser]
+    )
+    gtcache_parser.add_argument(
+        "cache_dir",
+        help="cache directory (--cache_dir of bam2gt)"
+    )
+    gtcache_parser.add_argument(
+        "--max_size",
+        metavar="FLOAT",
+        type=float,
+        help="remove least recently used entries until the cache is at "
+            + "most FLOAT GB"
+    )
+    gtcache_parser.add_argument(
+        "--max_age",
+        metavar="FLOAT",
+        type=float,
+        help="remove entries not used for more than FLOAT days"
     )
 
     return parser
@@ -1,10 +1,121 @@
 import os
-from io import StringIO
-from typing import List, Optional
+import shutil
+from tempfile import TemporaryDirectory, TemporaryFile
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from .bam2sdf import bam2sdf
-from .sdf2gdf import sdf2gdf
-from .common import sm_tag, bam_getter
+import numpy as np
+
+from .bam2sdf import get_gene_regions
+from .coverage import (
+    depth_file,
+    merge_intervals,
+    window_bins,
+    bin_depth,
+)
+from .depthmatrix import write_depth_chunks
+from .sdf2gdf import CHUNK_SIZE, write_gdf_header, write_gdf_block
+from .common import (
+    bam_headers,
+    bam_getter,
+    get_target_genes,
+    get_gene_table,
+    setup_ref_cache,
+)
+from .sglib import parse_region
+
+# Maximum number of depth values (positions x samples) in memory at a time,
+# i.e. 256 MB of uint32 depth regardless of the number of BAM files.
+MAX_DEPTH_CELLS = 1 << 26
+
+def _exon_bins(gene: str, genome_build: str) -> List[Tuple[int, int]]:
+    gene_table = get_gene_table()
+    starts = gene_table[gene][f"{genome_build}_exon_starts"].strip(",")
+    ends = gene_table[gene][f"{genome_build}_exon_ends"].strip(",")
+    # Exon starts are 0-based as in the UCSC tables.
+    return sorted([(int(x) + 1, int(y))
+        for x, y in zip(starts.split(","), ends.split(","))])
+
+def _region_bins(
+        region: str,
+        genes: List[str],
+        genome_build: str,
+        bin_size: Optional[int],
+        exon_bins: bool
+    ) -> Optional[List[Tuple[int, int]]]:
+    """Get the bins of a region (None for per-base output)."""
+    contig, start, end = parse_region(region)
+
+    if exon_bins:
+        gene_table = get_gene_table()
+        for gene in genes:
+            if gene not in gene_table:
+                continue
+            r = parse_region(gene_table[gene][f"{genome_build}_region"], omit=True)
+            if r == (contig.replace("chr", ""), start, end):
+                return [(max(x, start), min(y, end))
+                    for x, y in _exon_bins(gene, genome_build)
+                    if x <= end and start <= y]
+        # A custom control region is one bin.
+        return [(start, end)]
+
+    if bin_size:
+        return window_bins(start, end, bin_size)
+
+    return None
+
+def _plan_pieces(
+        intervals: List[Tuple[str, int, int]],
+        bins: Dict[str, Optional[List[Tuple[int, int]]]],
+        max_rows: int
+    ) -> List[Tuple[str, int, int]]:
+    """Split intervals into pieces of about max_rows positions that do not
+    cut any bin."""
+    pieces = []
+
+    for contig, start, end in intervals:
+        spans = np.array([x for region, y in bins.items()
+            if y and parse_region(region)[0] == contig for x in y],
+            dtype=np.int64).reshape(-1, 2)
+        pos = start
+        while pos <= end:
+            cut = pos + max_rows
+            while cut <= end:
+                inside = (spans[:, 0] < cut) & (cut <= spans[:, 1])
+                if not inside.any():
+                    break
+                cut = int(spans[inside, 1].max()) + 1
+            cut = min(cut, end + 1)
+            pieces.append((contig, pos, cut - 1))
+            pos = cut
+
+    return pieces
+
+def _write_piece(files, spans, bins, contig, positions, depth, bin_stat):
+    """Write the depth of a piece to the GDF data of overlapping regions."""
+    start = int(positions[0])
+    end = int(positions[-1])
+
+    for region, f in files.items():
+        c, s, e = spans[region]
+        if c != contig or e < start or end < s:
+            continue
+        i = max(s, start) - start
+        j = min(e, end) - start + 1
+        if bins[region] is None:
+            for k in range(i, j, CHUNK_SIZE):
+                l = min(k + CHUNK_SIZE, j)
+                write_gdf_block(f, contig, positions[k:l], depth[k:l])
+            continue
+        # Bins are never split between pieces.
+        selected = [x for x in bins[region] if start <= x[0] and x[1] <= end]
+        if selected:
+            write_gdf_block(f, contig, [x[0] for x in selected],
+                bin_depth(positions, depth, selected, bin_stat))
+
+def _read_rows(matrix: np.ndarray) -> Iterator[np.ndarray]:
+    """Yield the depth matrix (samples x positions) in chunks of rows."""
+    for i in range(0, matrix.shape[1], CHUNK_SIZE):
+        yield np.ascontiguousarray(matrix[:, i:i + CHUNK_SIZE].T)
 
 @bam_getter
 def bam2gdf(
@@ -15,6 +126,12 @@ def bam2gdf(
         bam_file: List[str],
         bam_dir: Optional[str] = None,
         bam_list: Optional[str] = None,
+        threads: int = 1,
+        matrix_file: Optional[str] = None,
+        bin_size: Optional[int] = None,
+        exon_bins: bool = False,
+        bin_stat: str = "mean",
+        fasta_file: Optional[str] = None,
         **kwargs
     ) -> None:
     """Convert BAM files to a GDF file.
@@ -25,6 +142,7 @@ def bam2gdf(
     could still be used to make GDF files, we recommend that you use this 
     command because the former is too heavy (i.e. requires too much memory) 
     for such a simple task (i.e. counting reads). The latter uses 
+    an in-process read depth engine with the same settings as
     ``samtools depth`` under the hood, which is way faster and requires 
     way less memory. Another nice about using ``bam2gdf`` instead of 
     ``samtools depth`` is that everything is already parametrized for 
@@ -33,28 +151,128 @@ def bam2gdf(
     .. note::
         You do NOT need to install ``samtools`` to run this command.
 
+    Several target genes can be given at once as a comma-separated list
+    (or 'ALL' for all target genes), in which case ``output_file`` is a
+    directory and one GDF file is written for each gene (e.g.
+    ``cyp2d6.gdf``). The regions of all genes and the control gene are
+    merged, and each BAM file is opened once and read in a single pass
+    over the whole panel. The depth is written to a temporary file and
+    formatted in pieces of at most about MAX_DEPTH_CELLS values (positions
+    x BAM files), so memory usage is bounded.
+
+    For high-depth or WGS data, depth can be aggregated into fixed-size
+    windows (``bin_size``) or exons of the target and control genes
+    (``exon_bins``; a control region given as coordinates is one bin).
+    The output has the same layout as a GDF file, but each line is a bin
+    (Locus is its first position) and depth is the mean or median of the
+    bin (``bin_stat``), which makes the file orders of magnitude smaller.
+
+    Input files can also be CRAM files. Their reference sequences are read
+    from the shared reference cache (see
+    :func:`pypgx.common.setup_ref_cache`), which is populated from
+    ``fasta_file`` on first use.
+
     Args:
         genome_build (str):
             Genome build ('hg19' or 'hg38').
         target_gene (str):
-            Name of target gene (e.g. 'cyp2d6').
+            Name of target gene (e.g. 'cyp2d6'), comma-separated names
+            of target genes or 'ALL'.
         control_gene (str):
             Name or region of control gene (e.g. ‘vdr’, 
             ‘chr12:48232319-48301814’)
         output_file (str):
-            Write output to this file.
+            Write output to this file (directory if there are several
+            target genes).
         bam_file (list[str]):
-            Input BAM files.
+            Input BAM/CRAM files.
         bam_dir (str, optional):
-            Use all BAM files in this directory as input.
+            Use all BAM/CRAM files in this directory as input.
         bam_list (str, optional):
             List of input BAM files, one file per line.
+        threads (int):
+            Number of worker processes. BAM files are processed in
+            parallel, one file per worker at a time (the pool is shared
+            by all pieces).
+        matrix_file (str, optional):
+            Also write the read depth to this DM (depth matrix) file
+            (one combined matrix for all target genes).
+        bin_size (int, optional):
+            Output mean (or median) depth of windows of this size.
+        exon_bins (bool):
+            Output mean (or median) depth of exons.
+        bin_stat (str):
+            Statistic of binned depth ('mean' or 'median').
+        fasta_file (str, optional):
+            Reference FASTA file used to decode CRAM files.
     """
     # Parse keyward arguments from the decorator.
     input_files = kwargs["input_files"]
+    setup_ref_cache(input_files, fasta_file)
+
+    if target_gene == "ALL":
+        target_genes = get_target_genes()
+    else:
+        target_genes = [x.strip() for x in target_gene.split(",")]
+
+    gene_regions = get_gene_regions(
+        genome_build, target_genes, control_gene, input_files)
+    sm = [x.sample for x in bam_headers(input_files)]
+
+    if len(target_genes) == 1:
+        output_files = {target_genes[0]: output_file}
+    else:
+        os.makedirs(output_file, exist_ok=True)
+        output_files = {x: f"{output_file}/{x}.gdf" for x in target_genes}
+
+    bins = {}
+
+    for gene, regions in gene_regions.items():
+        for region in regions:
+            bins[region] = _region_bins(region, [gene, control_gene],
+                genome_build, bin_size, exon_bins)
+
+    # Each BAM file is read once for the merged regions of all genes into
+    # a row of a temporary depth file, which is then formatted in pieces
+    # of at most MAX_DEPTH_CELLS depth values. Each region (e.g. the
+    # control gene, which is shared by all genes) is formatted once into a
+    # temporary file, which is then copied to the GDF file of each gene.
+    intervals = merge_intervals([parse_region(x)
+        for regions in gene_regions.values() for x in regions])
+    max_rows = max(1, MAX_DEPTH_CELLS // len(input_files))
+    pieces = _plan_pieces(intervals, bins, max_rows)
+    spans = {x: parse_region(x) for x in bins}
+    files = {}
+    maximum = 0
+
+    with TemporaryDirectory() as temp_dir:
+        try:
+            for region in bins:
+                files[region] = TemporaryFile("w+")
+
+            matrix = depth_file(input_files,
+                [f"{x[0]}:{x[1]}-{x[2]}" for x in pieces],
+                f"{temp_dir}/depth.u4", threads, fasta_file)
+            row = 0
+
+            for contig, start, end in pieces:
+                depth = np.ascontiguousarray(
+                    matrix[:, row:row + end - start + 1].T)
+                row += end - start + 1
+                _write_piece(files, spans, bins, contig,
+                    np.arange(start, end + 1), depth, bin_stat)
+                maximum = max(maximum, int(depth.max()))
+
+            for gene, regions in gene_regions.items():
+                with open(output_files[gene], "w") as f:
+                    write_gdf_header(f, sm)
+                    for region in regions:
+                        files[region].seek(0)
+                        shutil.copyfileobj(files[region], f)
 
-    sdf = bam2sdf(genome_build, target_gene, control_gene, input_files)
-    sm = [sm_tag(x) for x in input_files]
-    result = sdf2gdf(None, sm, f=StringIO(sdf))
-    with open(output_file, "w") as f:
-        f.write(result)
+            if matrix_file:
+                write_depth_chunks(matrix_file, sm, intervals,
+                    _read_rows(matrix), maximum)
+        finally:
+            for x in files.values():
+                x.close()
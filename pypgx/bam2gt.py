@@ -1,8 +1,80 @@
+import os
+import json
+import shutil
+import logging
 import subprocess
 from typing import Optional, List
 from .common import temp_env, bam_getter
 from .bam2vcf import bam2vcf
 from .bam2gdf import bam2gdf
+from .gvcfcache import file_identity, gatk_version
+from .resultcache import (
+    bam_fingerprint,
+    file_checksum,
+    entry_path,
+    tool_version,
+    result_key,
+    fetch_entry,
+    store_entry,
+)
+
+logger = logging.getLogger(__name__)
+
+def _unique_files(input_files: List[str]) -> List[str]:
+    """Remove input files whose content is identical to an earlier one."""
+    result = []
+    seen = {}
+    for x in input_files:
+        # Fingerprints only sample the files, so confirm with checksums.
+        fingerprint = bam_fingerprint(x)
+        same = [y for y in seen.get(fingerprint, [])
+            if file_checksum(y) == file_checksum(x)]
+        if same:
+            logger.info(f"Skipping {x} (identical to {same[0]})")
+            continue
+        seen.setdefault(fingerprint, []).append(x)
+        result.append(x)
+    return result
+
+def _result_key(
+        cache_dir: str,
+        kind: str,
+        params: dict,
+        input_files: List[str]
+    ) -> str:
+    """Compute the cache key of a result from the fingerprints of the input
+    files, or from their checksums if different files with the same
+    fingerprints are cached under that key."""
+    fingerprints = sorted([bam_fingerprint(x) for x in input_files])
+    key = result_key(kind, dict(params, bam=fingerprints))
+
+    try:
+        with open(f"{entry_path(cache_dir, kind, key)}/entry.json") as f:
+            cached = json.load(f).get("checksums")
+    except FileNotFoundError:
+        return key
+
+    # Fingerprints only sample the files, so confirm with checksums.
+    checksums = sorted([file_checksum(x) for x in input_files])
+
+    if cached == checksums:
+        return key
+
+    return result_key(kind, dict(params, bam=checksums))
+
+def _metadata(input_files: List[str]) -> dict:
+    """Get the metadata of a cache entry (checksums are used by
+    _result_key)."""
+    return {"bam_files": [os.path.realpath(x) for x in input_files],
+        "checksums": sorted([file_checksum(x) for x in input_files])}
+
+def _copy_tree(src: str, dst: str) -> None:
+    """Copy a directory into another, which may already exist."""
+    for r, d, f in os.walk(src):
+        path = os.path.join(dst, os.path.relpath(r, src))
+        os.makedirs(path, exist_ok=True)
+        for x in f:
+            shutil.copy2(os.path.join(r, x), path)
 
 @bam_getter
 @temp_env
@@ -20,6 +92,7 @@ def bam2gt(
         dbsnp_file: Optional[str] = None,
         temp_dir: Optional[str] = None,
         plot: bool = False,
+        cache_dir: Optional[str] = None,
         **kwargs
    ) -> None:
     """Convert BAM files to a genotype file.
@@ -35,6 +108,12 @@ def bam2gt(
     the optional argument ``--control_gene`` will generate a GDF file. 
     If this argument is not provided, Stargazer will run as VCF-only mode.
 
+    With ``cache_dir``, the VCF, GDF and Stargazer outputs are stored in
+    a content-addressed cache (see :mod:`pypgx.resultcache`) and reused
+    when the same BAM files (by content, not path) are genotyped again
+    with the same parameters and tool versions. Input files with
+    identical content are only processed once.
+
     .. warning::
         Stargazer and GATK/BCFtools must be pre-installed.
 
@@ -66,48 +145,111 @@ def bam2gt(
             Temporary files will be written to this directory.
         plot (bool):
             Output copy number plots.
+        cache_dir (str, optional):
+            Reuse results stored in this directory.
     """
     # Parse keyward arguments from the decorators.
     temp_path = kwargs["temp_path"]
     input_files = kwargs["input_files"]
 
-    # Create the input VCF file.
-    bam2vcf(
-        snp_caller,
-        fasta_file,
-        target_gene,
-        f"{temp_path}/pypgx.vcf",
-        genome_build,
-        bam_file = input_files
-    )
+    vcf_file = f"{temp_path}/pypgx.vcf"
+    gdf_file = f"{temp_path}/pypgx.gdf"
+    entry = None
 
-    # Create the input GDF file.
-    if control_gene:
-        gdf = bam2gdf(
-            genome_build,
+    if cache_dir:
+        cache_dir = os.path.realpath(cache_dir)
+        input_files = _unique_files(input_files)
+        if snp_caller == "gatk":
+            caller_version = gatk_version()
+        else:
+            caller_version = tool_version(snp_caller)
+        vcf_key = _result_key(cache_dir, "vcf", {
+            "fasta": file_identity(fasta_file), "gene": target_gene,
+            "build": genome_build, "caller": snp_caller,
+            "version": caller_version}, input_files)
+        entry = fetch_entry(cache_dir, "vcf", vcf_key)
+
+    # Create the input VCF file.
+    if entry:
+        vcf_file = f"{entry}/pypgx.vcf"
+    else:
+        bam2vcf(
+            snp_caller,
+            fasta_file,
             target_gene,
-            control_gene,
-            f"{temp_path}/pypgx.gdf",
+            vcf_file,
+            genome_build,
             bam_file = input_files
         )
 
+        if cache_dir:
+            entry = store_entry(cache_dir, "vcf", vcf_key, [vcf_file],
+                _metadata(input_files))
+            vcf_file = f"{entry}/pypgx.vcf"
+
+    # Create the input GDF file.
+    if control_gene:
+        entry = None
+
+        if cache_dir:
+            gdf_key = _result_key(cache_dir, "gdf", {
+                "fasta": file_identity(fasta_file), "gene": target_gene,
+                "build": genome_build, "control": control_gene},
+                input_files)
+            entry = fetch_entry(cache_dir, "gdf", gdf_key)
+
+        if entry:
+            gdf_file = f"{entry}/pypgx.gdf"
+        else:
+            bam2gdf(
+                genome_build,
+                target_gene,
+                control_gene,
+                gdf_file,
+                bam_file = input_files,
+                fasta_file = fasta_file
+            )
+
+            if cache_dir:
+                entry = store_entry(cache_dir, "gdf", gdf_key, [gdf_file],
+                    _metadata(input_files))
+                gdf_file = f"{entry}/pypgx.gdf"
+
     # Run Stargazer.
+    if cache_dir:
+        stargazer_key = result_key("stargazer", {"vcf": vcf_key,
+            "gdf": gdf_key if control_gene else None,
+            "data_type": data_type, "gene": target_gene,
+            "build": genome_build, "control": control_gene,
+            "plot": plot and bool(control_gene),
+            "version": tool_version("stargazer")})
+        entry = fetch_entry(cache_dir, "stargazer", stargazer_key)
+
+        if entry:
+            _copy_tree(f"{entry}/stargazer", proj_dir)
+            return
+
     command = [
         "stargazer",
         data_type,
         genome_build,
         target_gene,
-        f"{temp_path}/pypgx.vcf",
-        proj_dir,
+        vcf_file,
+        f"{temp_path}/stargazer" if cache_dir else proj_dir,
     ]
 
     if control_gene:
         command += [
             "--cg", control_gene,
-            "--gdf", f"{temp_path}/pypgx.gdf",
+            "--gdf", gdf_file,
         ]
 
         if plot:
             command += ["--plot"]
 
     subprocess.run(command, check=True)
+
+    if cache_dir:
+        entry = store_entry(cache_dir, "stargazer", stargazer_key,
+            [f"{temp_path}/stargazer"], _metadata(input_files))
+        _copy_tree(f"{entry}/stargazer", proj_dir)
@@ -2,24 +2,38 @@ import configparser
 from os import mkdir
 from os.path import realpath
 from .bam2vcf2 import bam2vcf2
-from .common import conf_env, get_target_genes, sm_tag, LINE_BREAK1, randstr
+from .common import (
+    conf_env,
+    get_target_genes,
+    bam_headers,
+    is_cram,
+    LINE_BREAK1,
+    randstr,
+)
 
 def _write_bam2gdf_shell(
         genome_build,
-        target_gene,
+        target_genes,
         control_gene,
         bam_files,
         gdf_file,
+        fasta_file,
+        threads,
         shell_file
     ):
+    # All target genes share one pass over the BAM files.
     s = (
         "pypgx bam2gdf \\\n"
         f"  {genome_build} \\\n"
-        f"  {target_gene} \\\n"
+        f"  {','.join(target_genes)} \\\n"
         f"  {control_gene} \\\n"
         f"  {gdf_file} \\\n"
+        f"  --threads {threads} \\\n"
     )
 
+    if any([is_cram(x) for x in bam_files.values()]):
+        s += f"  --fasta_file {fasta_file} \\\n"
+
     for name in bam_files:
         s += f"  {bam_files[name]} \\\n"
 
@@ -28,24 +42,28 @@ def _write_bam2gdf_shell(
 
 def _write_bam2vcf_shell(
         fasta_file,
-        target_gene,
-        project_path,
+        target_genes,
+        vcf_file,
         genome_build,
-        bam_files
+        bam_files,
+        threads,
+        shell_file
     ):
+    # All target genes are called in one pass over the BAM files.
     s = (
         "pypgx bam2vcf \\\n"
         f"  bcftools \\\n"
         f"  {fasta_file} \\\n"
-        f"  {target_gene} \\\n"
-        f"  {project_path}/pypgx.vcf \\\n"
+        f"  {','.join(target_genes)} \\\n"
+        f"  {vcf_file} \\\n"
         f"  {genome_build} \\\n"
+        f"  --threads {threads} \\\n"
     )
 
     for name in bam_files:
         s += f"  {bam_files[name]} \\\n"
 
-    with open(f"{project_path}/shell/bam2vcf.sh", "w") as f:
+    with open(shell_file, "w") as f:
         f.write(s)
 
 def _write_bam2vcf2_shell(
@@ -83,21 +101,17 @@ def _write_bam2vcf2_shell(
     bam2vcf2(conf_file=f"{project_path}/conf.txt")
 
 def _write_stargazer_shell(
-        snp_caller,
         data_type,
         genome_build,
         target_gene,
         project_path,
         control_gene,
+        vcf_file,
+        gdf_file,
         ref_samples,
         plot
     ):
 
-    if snp_caller == "bcftools":
-        vcf_file = "$p/pypgx.vcf"
-    else:
-        vcf_file = "$p/bam2vcf2/pypgx.vcf"
-
     s = (
         f"p={project_path}\n"
         "\n"
@@ -112,7 +126,7 @@ def _write_stargazer_shell(
     if control_gene != "NONE":
         s += (
             f"  --cg {control_gene} \\\n"
-            f"  --gdf $p/pypgx.gdf \\\n"
+            f"  --gdf {gdf_file} \\\n"
         )
 
         if plot:
@@ -129,7 +143,9 @@ def _write_qsub_shell(
         snp_caller,
         qsub_options,
         control_gene,
-        project_path
+        project_path,
+        vcf_job,
+        gdf_job
     ):
     q = "qsub -e $p/log -o $p/log"
 
@@ -144,16 +160,11 @@ def _write_qsub_shell(
         "\n"
     )
 
-    if control_gene != "NONE":
-        s += f"{q} -N $j-bam2gdf $p/shell/bam2gdf.sh\n"
-
     if snp_caller == "bcftools":
-        s += f"{q} -N $j-bam2vcf $p/shell/bam2vcf.sh\n"
-
         if control_gene == "NONE":
-            s += f"{q} -hold_jid $j-bam2vcf -N $j-stargazer $p/shell/stargazer.sh\n"
+            s += f"{q} -hold_jid {vcf_job} -N $j-stargazer $p/shell/stargazer.sh\n"
         else:
-            s += f"{q} -hold_jid $j-bam2gdf,$j-bam2vcf -N $j-stargazer $p/shell/stargazer.sh\n"
+            s += f"{q} -hold_jid {gdf_job},{vcf_job} -N $j-stargazer $p/shell/stargazer.sh\n"
 
     else:
         with open(f"{project_path}/bam2vcf2/example-qsub.sh") as f:
@@ -164,7 +175,7 @@ def _write_qsub_shell(
         if control_gene == "NONE":
             s += f"{q} -hold_jid $j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
         else:
-            s += f"{q} -hold_jid $j-bam2gdf,$j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
+            s += f"{q} -hold_jid {gdf_job},$j-post-hc -N $j-stargazer $p/shell/stargazer.sh\n"
 
     with open(f"{project_path}/example-qsub.sh", "w") as f:
         f.write(s)
@@ -176,10 +187,12 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
     This command runs the entire genotyping pipeline for BAM files 
     with the Sun Grid Engine (SGE) cluster. By default, it will genotype 
     all genes currently targeted by the Stargazer program (you can specify 
-    select genes too). For each gene, the command runs under the hood 
-    ``bam2vcf`` with ``bcftools`` caller (i.e. BCFtools) or ``bam2vcf2`` 
-    (i.e. GATK) to create the input VCF file. The input GDF file is 
-    created with ``bam2gdf``.
+    select genes too). Under the hood, the command runs ``bam2vcf`` with 
+    ``bcftools`` caller (i.e. BCFtools) or, for each gene, ``bam2vcf2`` 
+    (i.e. GATK) to create the input VCF files. With ``bcftools``, the 
+    input VCF files of all genes are created with a single ``bam2vcf`` 
+    job, and the input GDF files of all genes are created with a single 
+    ``bam2gdf`` job, so each BAM file is read only once per step.
 
     Args:
         conf_file (str): Configuration file.
@@ -206,6 +219,7 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
             qsub_options = NONE
             sample_list = NONE
             target_genes = ALL
+            threads = 1
 
             # Make any necessary changes to this section.
             [USER]
@@ -255,6 +269,10 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
              - SNP caller (‘gatk’ or ‘bcftools’).
            * - target_genes
              - Names of target genes (e.g. 'cyp2d6').
+           * - threads
+             - Number of worker processes of the ``bam2gdf`` and 
+               ``bam2vcf`` jobs, which cover all genes (request the same 
+               number of slots with ``qsub_options``).
     """
     config = kwargs["config"]
 
@@ -272,14 +290,18 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
     sample_list = config["USER"]["sample_list"]
     snp_caller = config["USER"]["snp_caller"]
     target_genes = config["USER"]["target_genes"]
+    threads = config["USER"].getint("threads", fallback=1)
+
+    if snp_caller not in ["gatk", "bcftools"]:
+        raise ValueError(f"Incorrect SNP caller: {snp_caller}")
 
     bam_files = {}
 
     with open(bam_list) as f:
-        for line in f:
-            bam = line.strip()
-            name = sm_tag(bam)
-            bam_files[name] = bam
+        bams = [x.strip() for x in f]
+
+    for bam, header in zip(bams, bam_headers(bams)):
+        bam_files[header.sample] = bam
 
     all_genes = get_target_genes()
 
@@ -318,6 +340,70 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
         "\n"
     )
 
+    # Read depth of all genes is computed by one job, which reads each BAM
+    # file once instead of once per gene.
+    gdf_job = f"{randstr()}-bam2gdf"
+
+    if len(select_genes) == 1:
+        gdf_files = {select_genes[0]: f"{project_path}/gdf/{select_genes[0]}.gdf"}
+        gdf_output = gdf_files[select_genes[0]]
+    else:
+        gdf_files = {x: f"{project_path}/gdf/{x}.gdf" for x in select_genes}
+        gdf_output = f"{project_path}/gdf"
+
+    # Likewise, variants of all genes are called by one BCFtools job.
+    vcf_job = f"{randstr()}-bam2vcf"
+
+    if snp_caller == "bcftools":
+        vcf_files = {x: f"{project_path}/vcf/{x}.vcf" for x in select_genes}
+    else:
+        vcf_files = {x: "$p/bam2vcf2/pypgx.vcf" for x in select_genes}
+
+    if len(select_genes) == 1:
+        vcf_output = vcf_files[select_genes[0]]
+    else:
+        vcf_output = f"{project_path}/vcf"
+
+    q = f"qsub -e {project_path}/log -o {project_path}/log"
+
+    if qsub_options != "NONE":
+        q += f" {qsub_options}"
+
+    if control_gene != "NONE" or snp_caller == "bcftools":
+        mkdir(f"{project_path}/shell")
+        mkdir(f"{project_path}/log")
+
+    if control_gene != "NONE":
+        mkdir(f"{project_path}/gdf")
+
+        _write_bam2gdf_shell(
+            genome_build,
+            select_genes,
+            control_gene,
+            bam_files,
+            gdf_output,
+            fasta_file,
+            threads,
+            f"{project_path}/shell/bam2gdf.sh"
+        )
+
+        s += f"{q} -N {gdf_job} {project_path}/shell/bam2gdf.sh\n"
+
+    if snp_caller == "bcftools":
+        mkdir(f"{project_path}/vcf")
+
+        _write_bam2vcf_shell(
+            fasta_file,
+            select_genes,
+            vcf_output,
+            genome_build,
+            bam_files,
+            threads,
+            f"{project_path}/shell/bam2vcf.sh"
+        )
+
+        s += f"{q} -N {vcf_job} {project_path}/shell/bam2vcf.sh\n"
+
     for select_gene in select_genes:
         s += f"sh {project_path}/gene/{select_gene}/example-qsub.sh\n"
 
@@ -331,26 +417,7 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
         mkdir(f"{gene_path}/shell")
         mkdir(f"{gene_path}/log")
 
-        if control_gene != "NONE":
-            _write_bam2gdf_shell(
-                genome_build,
-                select_gene,
-                control_gene,
-                bam_files,
-                f"{gene_path}/pypgx.gdf",
-                f"{gene_path}/shell/bam2gdf.sh"
-            )
-
-        if snp_caller == "bcftools":
-            _write_bam2vcf_shell(
-                fasta_file,
-                select_gene,
-                gene_path,
-                genome_build,
-                bam_files
-            )
-
-        elif snp_caller == "gatk":
+        if snp_caller == "gatk":
             _write_bam2vcf2_shell(
                 fasta_file,
                 bam_list,
@@ -362,16 +429,14 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
                 dbsnp_file
             )
 
-        else:
-            raise ValueError(f"Incorrect SNP caller: {snp_caller}")
-
         _write_stargazer_shell(
-            snp_caller,
             data_type,
             genome_build,
             select_gene,
             gene_path,
             control_gene,
+            vcf_files[select_gene],
+            gdf_files[select_gene],
             ref_samples,
             plot
         )
@@ -380,5 +445,7 @@ def bam2gt2(conf_file: str, **kwargs) -> None:
             snp_caller,
             qsub_options,
             control_gene,
-            gene_path
+            gene_path,
+            vcf_job,
+            gdf_job
         )
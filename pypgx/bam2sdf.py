@@ -1,29 +1,30 @@
 import os
-from typing import List
+from io import StringIO
+from typing import Dict, List, Optional
 
-import pysam
-
-from .common import logging, sm_tag, get_gene_table
+from .common import logging, bam_headers, get_gene_table, setup_ref_cache
 from .sglib import sort_regions
+from .coverage import depth_matrices, write_sdf
+from .depthmatrix import write_depth_matrix
 
 logger = logging.getLogger(__name__)
 
-def bam2sdf(
+def get_gene_regions(
         genome_build: str,
-        target_gene: str,
+        target_genes: List[str],
         control_gene: str,
-        bam_file: List[str],
-        **kwargs
-    ) -> str:
+        bam_file: List[str]
+    ) -> Dict[str, List[str]]:
     """
-    Create SDF file from BAM file(s).
+    Get the sorted target and control regions of several target genes,
+    named as in the BAM files.
 
     Returns:
-        str: SDF file.
+        dict[str, list[str]]: Regions of each target gene.
 
     Args:
         genome_build (str): Genome build (hg19, hg38).
-        target_gene (str): Target gene.
+        target_genes (list[str]): Target genes.
         control_gene (str): Control gene or region.
         bam_file (list[str]): BAM file(s).
     """
@@ -32,10 +33,9 @@ def bam2sdf(
 
     targets = [k for k, v in gene_table.items() if v["type"] == "target"]
 
-    if target_gene not in targets:
-        raise ValueError(f"'{target_gene}' is not among target genes: {targets}")
-
-    tr = gene_table[target_gene][f"{genome_build}_region"].replace("chr", "")
+    for target_gene in target_genes:
+        if target_gene not in targets:
+            raise ValueError(f"'{target_gene}' is not among target genes: {targets}")
 
     if "chr" in control_gene or ":" in control_gene:
         cr = control_gene.replace("chr", "")
@@ -48,23 +48,12 @@ def bam2sdf(
 
         cr = gene_table[control_gene][f"{genome_build}_region"].replace("chr", "")
 
-    regions = sort_regions([tr, cr])
-
     # Get sample and sequence names from BAM headers.
-    sm = []
+    headers = bam_headers(bam_file)
+    sm = [x.sample for x in headers]
     sn = []
-    for x in bam_file:
-        sm.append(sm_tag(x))
-
-        result = pysam.view("-H", x).strip().split("\n")
-        for line in result:
-            fields = line.split("\t")
-            if "@SQ" == fields[0]:
-                for field in fields:
-                    if "SN:" in field:
-                        y = field.replace("SN:", "")
-                        if y not in sn:
-                            sn.append(y)
+    for x in headers:
+        sn += [y for y in x.contigs if y not in sn]
 
     logger.info(f"Sample IDs: {sm}")
     logger.info(f"Contigs: {sn}")
@@ -75,10 +64,80 @@ def bam2sdf(
     else:
         chr_str = ""
 
-    result = ""
+    result = {}
 
-    for region in regions:
-        temp = pysam.depth("-a", "-Q", "1", "-r", f"{chr_str}{region}", *bam_file)
-        result += temp
+    for target_gene in target_genes:
+        tr = gene_table[target_gene][f"{genome_build}_region"].replace("chr", "")
+        regions = sort_regions([tr, cr])
+        result[target_gene] = [f"{chr_str}{x}" for x in regions]
 
     return result
+
+def get_regions(
+        genome_build: str,
+        target_gene: str,
+        control_gene: str,
+        bam_file: List[str]
+    ) -> List[str]:
+    """
+    Get the sorted target and control regions, named as in the BAM files.
+
+    Returns:
+        list[str]: Regions.
+
+    Args:
+        genome_build (str): Genome build (hg19, hg38).
+        target_gene (str): Target gene.
+        control_gene (str): Control gene or region.
+        bam_file (list[str]): BAM file(s).
+    """
+    return get_gene_regions(
+        genome_build, [target_gene], control_gene, bam_file)[target_gene]
+
+def bam2sdf(
+        genome_build: str,
+        target_gene: str,
+        control_gene: str,
+        bam_file: List[str],
+        threads: int = 1,
+        matrix_file: Optional[str] = None,
+        fasta_file: Optional[str] = None,
+        **kwargs
+    ) -> str:
+    """
+    Create SDF file from BAM file(s).
+
+    Read depth is computed in-process (see :mod:`pypgx.coverage`) with the
+    same settings as ``samtools depth -a -Q 1``. CRAM files are decoded
+    with the shared reference cache (see
+    :func:`pypgx.common.setup_ref_cache`).
+
+    Returns:
+        str: SDF file.
+
+    Args:
+        genome_build (str): Genome build (hg19, hg38).
+        target_gene (str): Target gene.
+        control_gene (str): Control gene or region.
+        bam_file (list[str]): BAM or CRAM file(s).
+        threads (int): Number of worker processes.
+        matrix_file (str, optional): Also write the read depth to this DM
+            (depth matrix) file.
+        fasta_file (str, optional): Reference FASTA file used to decode
+            CRAM files.
+    """
+
+    setup_ref_cache(bam_file, fasta_file)
+    regions = get_regions(genome_build, target_gene, control_gene, bam_file)
+    blocks = depth_matrices(bam_file, regions, threads, fasta_file)
+
+    result = StringIO()
+
+    for x in blocks:
+        write_sdf(result, *x)
+
+    if matrix_file:
+        sm = [x.sample for x in bam_headers(bam_file)]
+        write_depth_matrix(matrix_file, sm, blocks)
+
+    return result.getvalue()
@@ -1,14 +1,130 @@
 import os
+import signal
+import logging
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from .common import get_target_region, is_chr, temp_env, bam_getter
+from .common import (
+    get_target_region,
+    get_target_genes,
+    bam_headers,
+    temp_env,
+    bam_getter,
+    setup_ref_cache,
+)
+from .coverage import merge_intervals, window_bins
+from .sglib import parse_region
+from .gvcfcache import (
+    gatk_version,
+    file_identity,
+    gvcf_key,
+    gvcf_path,
+    store_gvcf,
+    workspace_key,
+    workspace_path,
+    read_workspace,
+    write_workspace,
+    remove_workspace,
+    lock_workspace,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fraction of physical memory shared by concurrent GATK jobs.
+JAVA_MEMORY_FRACTION = 0.75
+
+# Minimum Java heap size (in MB) of each concurrent GATK job.
+MIN_JAVA_HEAP = 1024
+
+# Minimum size (in bp) of a region shard called by one BCFtools job.
+MIN_SHARD_SIZE = 5000
+
+def _run_jobs(function, tasks, threads):
+    """Run function for each argument tuple, at most threads at a time."""
+    if threads <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            function(*task)
+        return
+
+    with ThreadPoolExecutor(min(threads, len(tasks))) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # Do not start the remaining jobs after a failure.
+            for future in futures:
+                future.cancel()
+            raise
+
+def _make_shards(intervals, shards):
+    """Split sorted intervals into at most shards groups of similar size."""
+    total = sum([x[2] - x[1] + 1 for x in intervals])
+    size = max(MIN_SHARD_SIZE, -(-total // shards))
+    result = []
+    n = size
+    for contig, start, end in intervals:
+        for x, y in window_bins(start, end, size):
+            if n >= size:
+                result.append([])
+                n = 0
+            result[-1].append((contig, x, y))
+            n += y - x + 1
+    return result
+
+def _write_bed(bed_file, intervals):
+    with open(bed_file, "w") as f:
+        for contig, start, end in intervals:
+            f.write(f"{contig}\t{start - 1}\t{end}\n")
+
+def _shard_region(intervals, prefix):
+    """Get a region string, or a BED file if there are several intervals."""
+    if len(intervals) == 1:
+        return "{}:{}-{}".format(*intervals[0])
+    _write_bed(f"{prefix}.bed", intervals)
+    return f"{prefix}.bed"
+
+def _split_vcf(vcf_file, gene_regions, output_dir):
+    """Write the records within each gene's region to a separate VCF file."""
+    regions = {k: parse_region(v) for k, v in gene_regions.items()}
+    files = {k: open(f"{output_dir}/{k}.vcf", "w") for k in regions}
+    try:
+        with open(vcf_file) as f:
+            for line in f:
+                if line.startswith("#"):
+                    for x in files.values():
+                        x.write(line)
+                    continue
+                fields = line.split("\t", 2)
+                contig, pos = fields[0], int(fields[1])
+                for k, (c, start, end) in regions.items():
+                    if c == contig and start <= pos <= end:
+                        files[k].write(line)
+    finally:
+        for x in files.values():
+            x.close()
+
+def _job_java_options(java_options, jobs):
+    """Add a Java heap size for one of several concurrent GATK jobs."""
+    if java_options and "-Xmx" in java_options:
+        return java_options
+
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    heap = max(MIN_JAVA_HEAP,
+        int(memory * JAVA_MEMORY_FRACTION / jobs / 1024 ** 2))
+
+    if java_options:
+        return f"-Xmx{heap}m {java_options}"
+
+    return f"-Xmx{heap}m"
 
 def _run_haplotypecaller(
         fasta_file,
         input_file,
         gvcf_file,
         target_region,
-        java_options
+        java_options,
+        pairhmm_threads=None
     ):
     command = [
         "gatk", "HaplotypeCaller",
@@ -20,22 +136,64 @@ def _run_haplotypecaller(
         "--QUIET",
     ]
 
+    if pairhmm_threads:
+        command += ["--native-pair-hmm-threads", str(pairhmm_threads)]
+
     if java_options:
         command += ["--java-options", java_options]
 
     subprocess.run(command, check=True)
 
+def _run_haplotypecallers(
+        fasta_file,
+        input_files,
+        gvcf_files,
+        target_region,
+        java_options,
+        threads
+    ):
+    jobs = min(threads, len(input_files))
+    pairhmm_threads = None
+
+    # Split memory and PairHMM threads between the concurrent JVMs.
+    if jobs > 1:
+        java_options = _job_java_options(java_options, jobs)
+        pairhmm_threads = max(1, (os.cpu_count() or 1) // jobs)
+
+    tasks = [(fasta_file, input_file, gvcf_file, target_region,
+        java_options, pairhmm_threads)
+        for input_file, gvcf_file in zip(input_files, gvcf_files)]
+
+    _run_jobs(_run_haplotypecaller, tasks, jobs)
+
 def _run_genomicsdbimport(
         target_region,
         gvcf_files,
-        datastore
+        datastore,
+        threads=1,
+        update=False
     ):
-    command = [
-        "gatk", "GenomicsDBImport",
-        "--intervals", target_region,
-        "--genomicsdb-workspace-path", datastore,
-        "--QUIET",
-    ]
+    # An existing workspace keeps its intervals.
+    if update:
+        command = [
+            "gatk", "GenomicsDBImport",
+            "--genomicsdb-update-workspace-path", datastore,
+            "--QUIET",
+        ]
+
+    else:
+        command = [
+            "gatk", "GenomicsDBImport",
+            "--intervals", target_region,
+            "--genomicsdb-workspace-path", datastore,
+            "--QUIET",
+        ]
+
+        if target_region.endswith(".bed"):
+            command += ["--merge-input-intervals"]
+
+    if threads > 1:
+        command += ["--reader-threads", str(threads)]
 
     for gvcf_file in gvcf_files:
         command += [
@@ -67,6 +225,97 @@ def _run_genotypegvcfs(
 
     subprocess.run(command, check=True)
 
+def _run_cached_gatk(
+        fasta_file,
+        input_files,
+        samples,
+        intervals,
+        target_region,
+        dbsnp_file,
+        java_options,
+        threads,
+        gvcf_cache,
+        vcf_file,
+        temp_path
+    ):
+    version = gatk_version()
+    region_id = ",".join(["{}:{}-{}".format(*x) for x in intervals])
+    keys = [gvcf_key(x, region_id, fasta_file, version) for x in input_files]
+    gvcf_files = [gvcf_path(gvcf_cache, x) for x in keys]
+    missing = [i for i, x in enumerate(gvcf_files) if not os.path.exists(x)]
+
+    logger.info(f"Cached gVCF files: {len(keys) - len(missing)} of {len(keys)}")
+
+    # Only call samples that are not in the cache yet.
+    temp_files = [f"{temp_path}/{i}.g.vcf" for i in missing]
+
+    _run_haplotypecallers(
+        fasta_file,
+        [input_files[i] for i in missing],
+        temp_files,
+        target_region,
+        java_options,
+        threads
+    )
+
+    for i, temp_file in zip(missing, temp_files):
+        store_gvcf(gvcf_cache, keys[i], temp_file, {
+            "bam": file_identity(input_files[i]), "sample": samples[i],
+            "region": region_id, "fasta": os.path.realpath(fasta_file),
+            "gatk": version})
+
+    workspace = workspace_path(
+        gvcf_cache, workspace_key(region_id, fasta_file, version))
+    cohort = dict(zip(keys, samples))
+
+    with lock_workspace(workspace):
+        imported = read_workspace(workspace)
+        new_keys = [x for x in keys if x not in imported]
+        names = set(imported.values())
+
+        if not imported:
+            # Create the workspace (again, if a previous run failed).
+            remove_workspace(workspace)
+            datastore = workspace
+        elif set(imported) <= set(keys) and not any(
+            [cohort[x] in names for x in new_keys]):
+            # Add the new samples to the workspace.
+            datastore = workspace
+        else:
+            # The workspace has other samples (or other data for the same
+            # samples), so this cohort is imported into a new one.
+            datastore = f"{temp_path}/datastore"
+            new_keys = keys
+
+        if new_keys:
+            logger.info(f"Importing {len(new_keys)} gVCF files into "
+                f"{datastore}")
+
+            try:
+                _run_genomicsdbimport(
+                    target_region,
+                    [gvcf_path(gvcf_cache, x) for x in new_keys],
+                    datastore,
+                    threads,
+                    update=datastore == workspace and bool(imported)
+                )
+            except BaseException:
+                if datastore == workspace:
+                    remove_workspace(workspace)
+                raise
+
+            if datastore == workspace:
+                imported.update({x: cohort[x] for x in new_keys})
+                write_workspace(workspace, imported)
+
+        _run_genotypegvcfs(
+            fasta_file,
+            dbsnp_file,
+            f"gendb://{datastore}",
+            vcf_file,
+            java_options
+        )
+
 def _run_variantfiltration(
         fasta_file,
         target_region,
@@ -86,75 +335,96 @@ def _run_variantfiltration(
 
     subprocess.run(command, check=True)
 
-def _run_mpileup(
+def _run_pipeline(commands):
+    """Run commands concurrently, each reading the previous one's output."""
+    processes = []
+
+    try:
+        for i, command in enumerate(commands):
+            stdin = processes[-1].stdout if processes else None
+            stdout = subprocess.PIPE if i < len(commands) - 1 else None
+            processes.append(
+                subprocess.Popen(command, stdin=stdin, stdout=stdout))
+            # Only the next process keeps the pipe open, so an upstream
+            # process stops (SIGPIPE) if a downstream one fails.
+            if stdin is not None:
+                stdin.close()
+    except BaseException:
+        for process in processes:
+            process.kill()
+        raise
+
+    returncodes = [x.wait() for x in processes]
+    failed = [x for x in zip(returncodes, commands) if x[0]]
+
+    if failed:
+        # Report the failed process rather than those it stopped.
+        returncode, command = next(
+            (x for x in failed if x[0] != -signal.SIGPIPE), failed[0])
+        raise subprocess.CalledProcessError(returncode, command)
+
+def _mpileup_command(
         fasta_file,
         target_region,
-        input_files,
-        vcf_file
+        input_files
     ):
-    command = [
+    # A BED file is read as a regions file (i.e. with index jumps).
+    if target_region.endswith(".bed"):
+        region_option = "-R"
+    else:
+        region_option = "-r"
+
+    return [
         "bcftools", "mpileup",
         "-Ou",
         "-f", fasta_file,
         "-a", "AD",
-        "-r", target_region,
+        region_option, target_region,
         "-q", "1",
         "--max-depth", "1000",
-        "-o", vcf_file,
     ] + input_files
 
-    subprocess.run(command, check=True)
-
-def _run_call(
-        vcf_file1,
-        vcf_file2
-    ):
-    command = [
+def _call_command():
+    return [
         "bcftools", "call",
-        vcf_file1,
-        "-Oz",
+        "-",
+        "-Ou",
         "-mv",
-        "-o", vcf_file2
     ]
 
-    subprocess.run(command, check=True)
-
-def _run_index(vcf_file):
-    command = [
-        "bcftools", "index",
-        vcf_file,
-    ]
-
-    subprocess.run(command, check=True)
+def _concat_command(vcf_files):
+    return [
+        "bcftools", "concat",
+        "-Ou",
+    ] + vcf_files
 
-def _run_norm(
-        fasta_file,
-        vcf_file1,
-        vcf_file2
-    ):
-    command = [
+def _norm_command(fasta_file):
+    return [
         "bcftools", "norm",
-        vcf_file1,
-        "-Ob",
+        "-",
+        "-Ou",
         "-f", fasta_file,
-        "-o", vcf_file2,
     ]
 
-    subprocess.run(command, check=True)
-
-def _run_filter(
-        vcf_file1,
-        output_file
-    ):
-    command = [
+def _filter_command(output_file):
+    return [
         "bcftools", "filter",
-        vcf_file1,
+        "-",
         "-Ov",
         "--IndelGap", "5",
         "-o", output_file,
     ]
 
-    subprocess.run(command, check=True)
+def _run_shard(
+        fasta_file,
+        target_region,
+        input_files,
+        vcf_file
+    ):
+    _run_pipeline([
+        _mpileup_command(fasta_file, target_region, input_files),
+        _call_command() + ["-o", vcf_file],
+    ])
 
 @bam_getter
 @temp_env
@@ -170,6 +440,8 @@ def bam2vcf(
         dbsnp_file: Optional[str] = None,
         java_options: Optional[str] = None,
         temp_dir: Optional[str] = None,
+        threads: int = 1,
+        gvcf_cache: Optional[str] = None,
         **kwargs
     ) -> None:
     """Convert BAM files to a VCF file.
@@ -182,30 +454,75 @@ def bam2vcf(
     already normalized and filtered, ready for the downstream genotype 
     analysis by the Stargazer program.
 
+    Several target genes can be given at once as a comma-separated list
+    (or 'ALL' for all target genes), in which case ``output_file`` is a
+    directory and one VCF file is written for each gene (e.g.
+    ``cyp2d6.vcf``). The regions of all genes (which already include
+    flanking sequence) are merged into one BED file and variants are
+    called in a single pass, so each BAM file is read and each caller is
+    started only once for the whole panel.
+
     Args:
         snp_caller (str):
             SNP caller ('gatk' or 'bcftools').
         fasta_file (str):
             Reference FASTA file.
         target_gene (str):
-            Target gene (e.g. 'cyp2d6') or 
-            region (e.g.‘chr22:42512500-42551883’).
+            Target gene (e.g. 'cyp2d6'), comma-separated target genes,
+            'ALL' or region (e.g.‘chr22:42512500-42551883’).
         output_file (str):
-            Write output to this file.
+            Write output to this file (directory if there are several
+            target genes).
         genome_build (str):
             Genome build ('hg19' or 'hg38').
         bam_file (list[str]):
-            Input BAM files.
+            Input BAM/CRAM files.
         bam_dir (str, optional):
-            Use all BAM files in this directory as input.
+            Use all BAM/CRAM files in this directory as input.
         bam_list (str, optional):
-            List of input BAM files, one file per line.
+            List of input BAM/CRAM files, one file per line.
         dbsnp_file (str, optional):
             dbSNP VCF file used by GATK to add rs numbers.
         java_options (str, optional):
             Java-specific arguments for GATK (e.g. '-Xmx4G').
         temp_dir (str, optional):
             Temporary files will be written to this directory.
+        threads (int):
+            Number of concurrent HaplotypeCaller (``gatk``) or region
+            shard (``bcftools``) jobs.
+        gvcf_cache (str, optional):
+            Keep gVCF files and GenomicsDB workspaces in this directory
+            and reuse them in later runs (``gatk`` only).
+
+    With the ``gatk`` caller and ``threads`` greater than one, the
+    per-sample HaplotypeCaller jobs run concurrently, at most ``threads``
+    at a time. Unless ``java_options`` already sets ``-Xmx``, each job
+    gets an equal share of 75% of the physical memory as Java heap, and
+    the CPU cores are split between the jobs' PairHMM threads. The gVCF
+    files are then jointly genotyped as before, so the output does not
+    depend on ``threads``.
+
+    With ``gvcf_cache``, gVCF files are stored by the identity of the BAM
+    file (path, size and modification time), the target region, the
+    reference and the GATK version (see :mod:`pypgx.gvcfcache`), and
+    HaplotypeCaller only runs for samples that are not cached yet. The
+    GenomicsDB workspace of the region is also kept and updated with the
+    new samples only, so adding a batch of BAM files to a cohort costs
+    time proportional to the batch (apart from GenotypeGVCFs). If the
+    workspace contains samples that are not in the input, the cohort is
+    imported into a temporary workspace instead.
+
+    With the ``bcftools`` caller, the target regions are split into up to
+    ``threads`` shards of at least MIN_SHARD_SIZE bp, which are called
+    concurrently (``mpileup`` and ``call`` over all input files). The
+    shards are then concatenated in order and normalized and filtered
+    together, giving the same variant calls as a single job (only
+    annotations that BCFtools leaves out at sites without variation, such
+    as MQSBZ, may differ).
+
+    The BCFtools steps (``mpileup``, ``call``, ``norm`` and ``filter``)
+    run concurrently, connected by pipes that carry uncompressed BCF, so
+    no intermediate files are written.
 
     .. warning::
         GATK and/or BCFtools must be pre-installed.
@@ -216,15 +533,20 @@ def bam2vcf(
         takes 19 min with the ``gatk`` caller but only 2 min with the 
         ``bcftools`` caller. Therefore, if you have many samples and you do 
         not have access to Sun Grid Engine (SGE) for parallelism, we 
-        recommend that you use ``bcftools``. If you have SGE and want to 
-        use GATK, please check ``bam2vcf2``.
+        recommend that you use ``bcftools`` or run ``gatk`` with 
+        ``threads``. If you have SGE and want to use GATK, please check 
+        ``bam2vcf2``.
     """
     # Parse keyward arguments from the decorators.
     temp_path = kwargs["temp_path"]
     input_files = kwargs["input_files"]
 
+    # Make the reference cache available for CRAM files.
+    setup_ref_cache(input_files, fasta_file)
+
     # Pick the chromosome string.
-    _ = [is_chr(x) for x in input_files]
+    headers = bam_headers(input_files)
+    _ = [x.is_chr for x in headers]
 
     if all(_):
         chr_str = "chr"
@@ -233,78 +555,114 @@ def bam2vcf(
     else:
         raise ValueError("Mixed types of SN tags found.")    
 
-    # Get the study region.
+    # Get the study regions.
     if ":" in target_gene:
-        target_region = chr_str + target_gene.replace("chr", "")
+        gene_regions = {target_gene: chr_str + target_gene.replace("chr", "")}
+    else:
+        if target_gene == "ALL":
+            target_genes = get_target_genes()
+        else:
+            target_genes = [x.strip() for x in target_gene.split(",")]
+
+        gene_regions = {x: chr_str + get_target_region(
+            x, genome_build).replace("chr", "") for x in target_genes}
+
+    # Merge the regions and sort them as in the BAM header.
+    contigs = {x: i for i, x in enumerate(headers[0].contigs)}
+    intervals = sorted(
+        merge_intervals([parse_region(x) for x in gene_regions.values()]),
+        key=lambda x: (contigs.get(x[0], len(contigs)), x[1]))
+    target_region = _shard_region(intervals, f"{temp_path}/targets")
+
+    if len(gene_regions) == 1:
+        vcf_file = output_file
     else:
-        target_region = chr_str + get_target_region(
-            target_gene, genome_build).replace("chr", "")
+        vcf_file = f"{temp_path}/pypgx.vcf"
 
     # Run the selected SNP caller.
     if snp_caller == "gatk":
 
-        gvcf_files = []
+        if gvcf_cache:
+            _run_cached_gatk(
+                fasta_file,
+                input_files,
+                [x.sample for x in headers],
+                intervals,
+                target_region,
+                dbsnp_file,
+                java_options,
+                threads,
+                os.path.realpath(gvcf_cache),
+                f"{temp_path}/pypgx.joint.vcf",
+                temp_path
+            )
 
-        for i, input_file in enumerate(input_files):
-            gvcf_file = f"{temp_path}/{i}.g.vcf"
-            gvcf_files.append(gvcf_file)
+        else:
+            gvcf_files = [f"{temp_path}/{i}.g.vcf"
+                for i in range(len(input_files))]
 
-            _run_haplotypecaller(
+            _run_haplotypecallers(
                 fasta_file,
-                input_file,
-                gvcf_file,
+                input_files,
+                gvcf_files,
                 target_region,
-                java_options
+                java_options,
+                threads
             )
 
-        _run_genomicsdbimport(
-            target_region,
-            gvcf_files,
-            f"{temp_path}/datastore"
-        )
+            _run_genomicsdbimport(
+                target_region,
+                gvcf_files,
+                f"{temp_path}/datastore",
+                threads
+            )
 
-        _run_genotypegvcfs(
-            fasta_file,
-            dbsnp_file,
-            f"gendb://{temp_path}/datastore",
-            f"{temp_path}/pypgx.joint.vcf",
-            java_options
-        )
+            _run_genotypegvcfs(
+                fasta_file,
+                dbsnp_file,
+                f"gendb://{temp_path}/datastore",
+                f"{temp_path}/pypgx.joint.vcf",
+                java_options
+            )
 
         _run_variantfiltration(
             fasta_file,
             target_region,
             f"{temp_path}/pypgx.joint.vcf",
-            output_file
+            vcf_file
         )
 
     elif snp_caller == "bcftools":
-        _run_mpileup(
-            fasta_file,
-            target_region,
-            input_files,
-            f"{temp_path}/uncompressed.bcf"
-        )
-
-        _run_call(
-            f"{temp_path}/uncompressed.bcf",
-            f"{temp_path}/calls.vcf.gz"
-        )
-
-        _run_index(
-            f"{temp_path}/calls.vcf.gz"
-        )
+        shards = _make_shards(intervals, threads)
+
+        # The stages are connected by pipes (uncompressed BCF), so only
+        # the output VCF file (and the shards, if any) are written to disk.
+        if len(shards) == 1:
+            commands = [
+                _mpileup_command(fasta_file, target_region, input_files),
+                _call_command(),
+            ]
+
+        else:
+            prefixes = [f"{temp_path}/shard{i}" for i in range(len(shards))]
+
+            _run_jobs(
+                _run_shard,
+                [(fasta_file, _shard_region(x, y), input_files, f"{y}.bcf")
+                    for x, y in zip(shards, prefixes)],
+                threads
+            )
 
-        _run_norm(
-            fasta_file,
-            f"{temp_path}/calls.vcf.gz",
-            f"{temp_path}/calls.norm.bcf"
-        )
+            commands = [_concat_command([f"{x}.bcf" for x in prefixes])]
 
-        _run_filter(
-            f"{temp_path}/calls.norm.bcf",
-            output_file
-        )
+        _run_pipeline(commands + [
+            _norm_command(fasta_file),
+            _filter_command(vcf_file),
+        ])
 
     else:
         raise ValueError(f"Incorrect SNP caller: {snp_caller}")
+
+    if len(gene_regions) > 1:
+        os.makedirs(output_file, exist_ok=True)
+        _split_vcf(vcf_file, gene_regions, output_file)
@@ -1,7 +1,81 @@
 import configparser
 from os import mkdir
-from os.path import realpath
-from .common import is_chr, randstr, conf_env, get_target_region
+from os.path import realpath, exists, dirname
+from .common import bam_headers, randstr, conf_env, get_target_region
+from .coverage import read_bed
+from .gvcfcache import (
+    gatk_version,
+    file_identity,
+    gvcf_key,
+    gvcf_path,
+    write_gvcf_metadata,
+)
+
+def _haplotypecaller_shell(
+        fasta_file: str,
+        bam_file: str,
+        target_region: str,
+        temp_file: str,
+        gvcf_file: str,
+        conda_env: str = "NONE",
+        java_options: str = "NONE"
+    ) -> str:
+    """
+    Create the shell script of a HaplotypeCaller job.
+
+    If ``gvcf_file`` differs from ``temp_file`` (i.e. it is in the gVCF
+    cache), the output is moved there after HaplotypeCaller succeeded,
+    the gVCF file last, so that a failed job never leaves a cache entry.
+
+    Returns:
+        str: Shell script.
+
+    Args:
+        fasta_file (str): Reference FASTA file.
+        bam_file (str): BAM file.
+        target_region (str): Target region or BED file.
+        temp_file (str): gVCF file written by HaplotypeCaller.
+        gvcf_file (str): Final gVCF file.
+        conda_env (str): Name of conda environment to be activated.
+        java_options (str): Java-specific arguments for GATK.
+    """
+    s = "#!/bin/bash\n"
+
+    if conda_env != "NONE":
+        s += (
+            "\n"
+            f"conda activate {conda_env}\n"
+        )
+
+    s += (
+        "\n"
+        "set -euo pipefail\n"
+        "\n"
+        "gatk HaplotypeCaller \\\n"
+        f"  -R {fasta_file} \\\n"
+        f"  --emit-ref-confidence GVCF \\\n"
+        f"  -I {bam_file} \\\n"
+        f"  -O {temp_file} \\\n"
+        f"  -L {target_region} \\\n"
+        "  --QUIET \\\n"
+    )
+
+    if java_options != "NONE":
+        s += f"  --java-options {java_options} \\\n"
+
+    # Move the output into the cache under a temporary name first, so
+    # that the final names only appear when they are complete.
+    if gvcf_file != temp_file:
+        s += (
+            "\n"
+            f"mkdir -p {dirname(gvcf_file)}\n"
+            f"mv {temp_file}.idx {gvcf_file}.idx.$$.tmp\n"
+            f"mv {gvcf_file}.idx.$$.tmp {gvcf_file}.idx\n"
+            f"mv {temp_file} {gvcf_file}.$$.tmp\n"
+            f"mv {gvcf_file}.$$.tmp {gvcf_file}\n"
+        )
+
+    return s
 
 @conf_env
 def bam2vcf2(conf_file: str, **kwargs) -> None:
@@ -33,6 +107,7 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
             [DEFAULT]
             conda_env = NONE
             dbsnp_file = NONE
+            gvcf_cache = NONE
             java_options = NONE
             qsub_options = NONE
 
@@ -67,6 +142,9 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
              - Reference FASTA file.
            * - genome_build
              - Genome build ('hg19' or 'hg38').
+           * - gvcf_cache
+             - Directory of cached gVCF files, which are reused in 
+               later runs (see ``bam2vcf``).
            * - java_options
              - Java-specific arguments for GATK (e.g. ‘-Xmx4G’).
            * - project_path
@@ -89,6 +167,7 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
     java_options = config["USER"]["java_options"]
     dbsnp_file = config["USER"]["dbsnp_file"]
     conda_env = config["USER"]["conda_env"]
+    gvcf_cache = config["USER"].get("gvcf_cache", fallback="NONE")
 
     bam_files = []
 
@@ -102,7 +181,8 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
     mkdir(f"{project_path}/log")
     mkdir(f"{project_path}/temp")
 
-    t = [is_chr(x) for x in bam_files]
+    headers = bam_headers(bam_files)
+    t = [x.is_chr for x in headers]
     if all(t):
         chr_str = "chr"
     elif not any(t):
@@ -112,32 +192,37 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
 
     if target_gene.endswith(".bed"):
         target_region = realpath(target_gene)
+        # Identify the regions by content, like bam2vcf.
+        region_id = ",".join(["{}:{}-{}".format(*x)
+            for x in read_bed(target_region)])
     else:
         target_region = chr_str + get_target_region(target_gene, genome_build).replace("chr", "")
+        region_id = target_region
+
+    gvcf_files = [f"{project_path}/temp/{i}.g.vcf"
+        for i in range(len(bam_files))]
+    called = list(range(len(bam_files)))
+
+    # Only call samples that are not in the gVCF cache yet.
+    if gvcf_cache != "NONE":
+        gvcf_cache = realpath(gvcf_cache)
+        version = gatk_version()
+        keys = [gvcf_key(x, region_id, fasta_file, version)
+            for x in bam_files]
+        gvcf_files = [gvcf_path(gvcf_cache, x) for x in keys]
+        called = [i for i, x in enumerate(gvcf_files) if not exists(x)]
+
+        for i in called:
+            write_gvcf_metadata(gvcf_cache, keys[i], {
+                "bam": file_identity(bam_files[i]),
+                "sample": headers[i].sample, "region": region_id,
+                "fasta": realpath(fasta_file), "gatk": version})
 
     # Write the shell script for HaplotypeCaller.
-    for i, bam_file in enumerate(bam_files):
-        s = "#!/bin/bash\n"
-
-        if conda_env != "NONE":
-            s += (
-                "\n"
-                f"conda activate {conda_env}\n"
-            )
-
-        s += (
-            "\n"
-            "gatk HaplotypeCaller \\\n"
-            f"  -R {fasta_file} \\\n"
-            f"  --emit-ref-confidence GVCF \\\n"
-            f"  -I {bam_file} \\\n"
-            f"  -O {project_path}/temp/{i}.g.vcf \\\n"
-            f"  -L {target_region} \\\n"
-            "  --QUIET \\\n"
-        )
-
-        if java_options != "NONE":
-            s += f"  --java-options {java_options} \\\n"
+    for i in called:
+        s = _haplotypecaller_shell(fasta_file, bam_files[i], target_region,
+            f"{project_path}/temp/{i}.g.vcf", gvcf_files[i], conda_env,
+            java_options)
 
         with open(f"{project_path}/shell/haplotypecaller-{i}.sh", "w") as f:
             f.write(s)
@@ -165,8 +250,8 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
     if java_options != "NONE":
         s += f"  --java-options {java_options} \\\n"
 
-    for i, bam_file in enumerate(bam_files):
-        s += f"  -V $p/temp/{i}.g.vcf \\\n"
+    for gvcf_file in gvcf_files:
+        s += f"  -V {gvcf_file} \\\n"
 
     s += (
         "\n"
@@ -215,10 +300,13 @@ def bam2vcf2(conf_file: str, **kwargs) -> None:
         "\n"
     )
 
-    for i, bam_file in enumerate(bam_files):
+    for i in called:
         s += f"{q} -N $j-hc $p/shell/haplotypecaller-{i}.sh\n"
 
-    s += f"{q} -hold_jid $j-hc -N $j-post-hc $p/shell/post-haplotypecaller.sh\n"
+    if called:
+        s += f"{q} -hold_jid $j-hc -N $j-post-hc $p/shell/post-haplotypecaller.sh\n"
+    else:
+        s += f"{q} -N $j-post-hc $p/shell/post-haplotypecaller.sh\n"
 
     with open(f"{project_path}/example-qsub.sh", "w") as f:
         f.write(s)
@@ -1,12 +1,14 @@
 import os
+import hashlib
 import logging
 import random
 import string
 import configparser
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, NamedTuple, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import TemporaryDirectory
 import pysam
-from functools import wraps
+from functools import wraps, lru_cache
 
 from .sglib import (
     read_gene_table,
@@ -16,45 +18,122 @@ from .sglib import (
     build_stardb,
     StarAllele,
 )
+from .sgbundle import open_bundle
 
 LINE_BREAK1 = "-" * 70
 LINE_BREAK2 = "*" * 70
 
-def sm_tag(bam: str) -> str:
+# Maximum number of (gene, genome build) StarAllele databases kept in memory.
+STARDB_CACHE_SIZE = 128
+
+# Maximum number of BAM headers kept in memory.
+BAM_HEADER_CACHE_SIZE = 65536
+
+# Default number of threads used to read many BAM headers.
+HEADER_THREADS = 8
+
+# File extensions of input alignment files.
+ALIGNMENT_EXTENSIONS = ("bam", "cram")
+
+# Default directory of the reference cache used for CRAM files.
+REF_CACHE_DIR = os.environ.get("PYPGX_REF_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "pypgx", "ref_cache"))
+
+logger = logging.getLogger(__name__)
+
+class BamHeaderInfo(NamedTuple):
+    """Information extracted from the header of a BAM file.
+
+    Attributes:
+        path (str): BAM file.
+        sm (tuple[str]): Unique SM tags of the read groups.
+        contigs (tuple[str]): Sequence names (SN tags).
+        is_chr (bool): True if any sequence name contains "chr".
+        md5 (tuple[str]): MD5 checksums of the sequences (M5 tags, None
+            if missing).
     """
-    Extract SM tag from BAM file.
+    path: str
+    sm: Tuple[str, ...]
+    contigs: Tuple[str, ...]
+    is_chr: bool
+    md5: Tuple[Optional[str], ...] = ()
+
+    @property
+    def sample(self) -> str:
+        """The SM tag (the first one if there are several)."""
+        if not self.sm:
+            raise ValueError(f"SM tag not found: {self.path}")
+
+        if len(self.sm) > 1:
+            logger.warning(
+                f"Multiple SM tags found (will return the first one): "
+                f"{self.path}")
+
+        return self.sm[0]
+
+@lru_cache(maxsize=BAM_HEADER_CACHE_SIZE)
+def _read_bam_header(path: str, size: int, mtime: int) -> BamHeaderInfo:
+    with pysam.AlignmentFile(path, check_sq=False) as f:
+        header = f.header.to_dict()
+
+    sm = []
+    for rg in header.get("RG", []):
+        if "SM" in rg and rg["SM"] not in sm:
+            sm.append(rg["SM"])
+
+    contigs = tuple([x["SN"] for x in header.get("SQ", [])])
+    md5 = tuple([x.get("M5") for x in header.get("SQ", [])])
+
+    return BamHeaderInfo(path, tuple(sm), contigs,
+        any(["chr" in x for x in contigs]), md5)
+
+def bam_header(bam: str) -> BamHeaderInfo:
+    """
+    Inspect the header of a BAM file.
+
+    The header is read once with ``pysam.AlignmentFile`` and cached by
+    path, size and modification time, so repeated calls for the same file
+    do not touch the file again unless it has changed.
 
     Returns:
-        str: SM tag.
+        BamHeaderInfo: Header information.
 
     Args:
         bam (str): BAM file.
     """
+    st = os.stat(bam)
+    return _read_bam_header(os.path.abspath(bam), st.st_size, st.st_mtime_ns)
 
-    header = pysam.view("-H", bam).strip().split("\n")
-
-    l = []
+def bam_headers(
+        bams: List[str],
+        threads: int = HEADER_THREADS
+    ) -> List[BamHeaderInfo]:
+    """
+    Inspect the headers of many BAM files in a thread pool.
 
-    for line in header:
-        fields = line.split("\t")
-        if "@RG" == fields[0]:
-            for field in fields:
-                if "SM:" in field:
-                    l.append(field.replace("SM:", ""))
+    Returns:
+        list[BamHeaderInfo]: Header information in the order of bams.
 
-    l = list(set(l))
+    Args:
+        bams (list[str]): BAM files.
+        threads (int): Number of threads.
+    """
+    if threads > 1 and len(bams) > 1:
+        with ThreadPoolExecutor(min(threads, len(bams))) as executor:
+            return list(executor.map(bam_header, bams))
+    return [bam_header(x) for x in bams]
 
-    if not l:
-        raise ValueError(f"SM tag not found: {bam}")
+def sm_tag(bam: str) -> str:
+    """
+    Extract SM tag from BAM file.
 
-    if len(l) > 1:
-        logger.warning(
-            f"Multiple SM tags found (will return the first one): {bam}")
-        result = l[0]
-    else:
-        result = l[0]
+    Returns:
+        str: SM tag.
 
-    return result
+    Args:
+        bam (str): BAM file.
+    """
+    return bam_header(bam).sample
 
 def is_chr(bam: str) -> bool:
     """
@@ -66,24 +145,209 @@ def is_chr(bam: str) -> bool:
     Args:
         bam (str): BAM file.
     """
+    return bam_header(bam).is_chr
+
+def is_cram(fn: str) -> bool:
+    """Check whether the alignment file is a CRAM file."""
+    return fn.endswith(".cram")
+
+def _ref_cache_file(cache_dir: str, md5: str) -> str:
+    return os.path.join(cache_dir, md5[:2], md5[2:4], md5[4:])
+
+def populate_ref_cache(
+        fasta_file: str,
+        contigs: Optional[Dict[str, str]] = None,
+        cache_dir: Optional[str] = None
+    ) -> str:
+    """
+    Add reference sequences to the reference cache.
+
+    Sequences are stored by MD5 checksum in the layout used by htslib's
+    ``REF_CACHE`` (i.e. ``seq_cache_populate.pl``), so that CRAM files can
+    be decoded without the FASTA file. Sequences already in the cache are
+    skipped.
+
+    Returns:
+        str: Cache directory.
+
+    Args:
+        fasta_file (str): Reference FASTA file (must be indexed).
+        contigs (dict[str, str], optional): Only add these sequences
+            (name to expected MD5); all sequences by default.
+        cache_dir (str, optional): Cache directory [REF_CACHE_DIR].
+    """
+
+    if cache_dir is None:
+        cache_dir = REF_CACHE_DIR
+
+    with pysam.FastaFile(fasta_file) as f:
+        if contigs is None:
+            contigs = {x: None for x in f.references}
+
+        for name, expected in contigs.items():
+            if expected and os.path.exists(_ref_cache_file(cache_dir, expected)):
+                continue
+
+            if name not in f.references:
+                logger.warning(f"Sequence not found in {fasta_file}: {name}")
+                continue
+
+            seq = f.fetch(name).upper().encode()
+            md5 = hashlib.md5(seq).hexdigest()
+
+            if expected and md5 != expected:
+                logger.warning(f"MD5 mismatch for sequence {name}: "
+                    f"{md5} (expected {expected})")
+                continue
+
+            fn = _ref_cache_file(cache_dir, md5)
+
+            if os.path.exists(fn):
+                continue
+
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+
+            # Write to a temporary file first so that concurrent readers
+            # never see a partial sequence.
+            with open(f"{fn}.{os.getpid()}.tmp", "wb") as g:
+                g.write(seq)
+            os.replace(f"{fn}.{os.getpid()}.tmp", fn)
+
+    return cache_dir
+
+def setup_ref_cache(
+        input_files: List[str],
+        fasta_file: Optional[str] = None,
+        cache_dir: Optional[str] = None
+    ) -> None:
+    """
+    Prepare the reference cache for CRAM input files.
+
+    If any input file is a CRAM file, htslib (used by pysam, SAMtools and
+    BCFtools) is pointed to the reference cache via the ``REF_PATH`` and
+    ``REF_CACHE`` environment variables, unless they are already set. If a
+    FASTA file is given, the sequences listed in the CRAM headers that are
+    not cached yet are added, so the cache is filled locally once and then
+    reused by all depth and calling commands.
+
+    Args:
+        input_files (list[str]): Input BAM/CRAM files.
+        fasta_file (str, optional): Reference FASTA file.
+        cache_dir (str, optional): Cache directory [REF_CACHE_DIR].
+    """
+
+    crams = [x for x in input_files if is_cram(x)]
+
+    if not crams:
+        return
+
+    if cache_dir is None:
+        cache_dir = REF_CACHE_DIR
+
+    pattern = os.path.join(cache_dir, "%2s", "%2s", "%s")
+    os.environ.setdefault("REF_PATH", pattern)
+    os.environ.setdefault("REF_CACHE", pattern)
+
+    if fasta_file is None:
+        return
+
+    contigs = {}
+
+    for header in bam_headers(crams):
+        for name, md5 in zip(header.contigs, header.md5):
+            if md5 and not os.path.exists(_ref_cache_file(cache_dir, md5)):
+                contigs[name] = md5
+
+    if contigs:
+        logger.info(f"Adding {len(contigs)} sequences to reference cache: "
+            f"{cache_dir}")
+        populate_ref_cache(fasta_file, contigs, cache_dir)
+
+def _resource_path(fn: str) -> str:
+    p = os.path.dirname(__file__)
+    return f"{p}/resources/sg/{fn}"
+
+@lru_cache(maxsize=1)
+def _load_bundle():
+    return open_bundle(_resource_path(""))
+
+@lru_cache(maxsize=1)
+def _load_gene_table() -> Dict[str, Dict[str, str]]:
+    bundle = _load_bundle()
+    if bundle:
+        return bundle.gene_table()
+    return read_gene_table(_resource_path("gene_table.txt"))
+
+@lru_cache(maxsize=1)
+def _load_target_genes() -> tuple:
+    gene_table = _load_gene_table()
+    return tuple(k for k, v in gene_table.items() if v["type"] == "target")
+
+@lru_cache(maxsize=STARDB_CACHE_SIZE)
+def _load_stardb(tg: str, gb: str) -> Dict[str, StarAllele]:
+    bundle = _load_bundle()
+    if bundle:
+        snp_table = {tg: bundle.snp_table(tg)}
+        star_table = {tg: bundle.star_table(tg)}
+    else:
+        snp_table = read_snp_table(
+            _resource_path("snp_table.txt"), _load_gene_table(), [tg])
+        star_table = read_star_table(_resource_path("star_table.txt"), [tg])
+    snpdb = build_snpdb(tg, gb, snp_table)
+    return build_stardb(tg, gb, star_table, snpdb)
+
+def clear_cache() -> None:
+    """
+    Clear the in-memory cache of the Stargazer resource tables.
+
+    The gene table and the StarAllele database of each (gene, genome build)
+    pair are built only once per process and the resulting objects are
+    shared by all callers. Call this function
+    to force the tables to be re-read from disk on the next access (e.g.
+    after the resource files have been updated in a long-lived worker).
+    The BAM header cache (see :func:`bam_header`) is cleared as well.
+    """
+
+    _read_bam_header.cache_clear()
+    _load_bundle.cache_clear()
+    _load_gene_table.cache_clear()
+    _load_target_genes.cache_clear()
+    _load_stardb.cache_clear()
+
+def reload_cache() -> None:
+    """
+    Clear the resource cache, re-open the binary bundle and eagerly re-read
+    the gene table.
+    """
 
-    header = pysam.view("-H", bam).strip().split("\n")
+    clear_cache()
+    _load_bundle()
+    _load_gene_table()
 
-    l = []
+def cache_info() -> Dict[str, tuple]:
+    """
+    Get the statistics of the resource cache.
 
-    for line in header:
-        fields = line.split("\t")
-        if "@SQ" == fields[0]:
-            for field in fields:
-                if "SN:" in field:
-                    l.append(field.replace("SN:", ""))
+    Returns:
+        dict[str, tuple]: Cache statistics (hits, misses, maxsize, currsize)
+        for each of the cached resources.
+    """
 
-    return any(["chr" in x for x in l])
+    return {
+        "bundle": _load_bundle.cache_info(),
+        "gene_table": _load_gene_table.cache_info(),
+        "stardb": _load_stardb.cache_info(),
+        "bam_header": _read_bam_header.cache_info(),
+    }
 
 def get_stardb(tg: str, gb: str) -> Dict[str, StarAllele]:
     """
     Get StarAllele database.
 
+    The database is built once per (gene, genome build) pair and cached for
+    the lifetime of the process (see ``clear_cache``). The returned object
+    is shared between callers and must not be modified.
+
     Returns:
         dict[str, StarAllele]: StarAllele objects.
 
@@ -98,24 +362,21 @@ def get_stardb(tg: str, gb: str) -> Dict[str, StarAllele]:
         1.0
     """
 
-    p = os.path.dirname(__file__)
-    gene_table = read_gene_table(f"{p}/resources/sg/gene_table.txt")
-    snp_table = read_snp_table(f"{p}/resources/sg/snp_table.txt", gene_table)
-    snpdb = build_snpdb(tg, gb, snp_table)
-    star_table = read_star_table(f"{p}/resources/sg/star_table.txt")
-
-    return build_stardb(tg, gb, star_table, snpdb)
+    return _load_stardb(tg, gb)
 
 def get_gene_table() -> Dict[str, Dict[str, str]]:
     """
     Get gene table object.
 
+    The table is cached for the lifetime of the process (see
+    ``clear_cache``). The returned object is shared between callers and
+    must not be modified.
+
     Returns:
         dict[str, dict[str, str]]: Gene table object.
     """
 
-    p = os.path.dirname(__file__)
-    return read_gene_table(f"{p}/resources/sg/gene_table.txt")
+    return _load_gene_table()
 
 def get_target_genes() -> List[str]:
     """Get the list of target gene names.
@@ -123,8 +384,7 @@ def get_target_genes() -> List[str]:
     Returns:
         list[str]: A list of gene names.
     """
-    gene_table = get_gene_table()
-    return [k for k, v in gene_table.items() if v["type"] == "target"]
+    return list(_load_target_genes())
 
 def get_target_region(tg: str, gb: str) -> str:
     """Get the genomic region for the target gene.
@@ -136,13 +396,12 @@ def get_target_region(tg: str, gb: str) -> str:
         tg (str): Target gene.
         gb (str): Genome build (hg19, hg38).
     """
-    gene_table = get_gene_table()
-    target_genes = [k for k, v in gene_table.items() if v["type"] == "target"]
+    target_genes = get_target_genes()
 
     if tg not in target_genes:
         raise ValueError(f"'{tg}' is not among target genes: {target_genes}")
 
-    return gene_table[tg][f"{gb}_region"]
+    return get_gene_table()[tg][f"{gb}_region"]
 
 def get_file_list(
         td: str,
@@ -217,7 +476,7 @@ def bam_getter(func):
             input_files = []
             for r, d, f in os.walk(bam_path):
                 for x in f:
-                    if x.endswith("bam"):
+                    if x.endswith(ALIGNMENT_EXTENSIONS):
                         input_files.append(f"{bam_path}/{x}")
         elif kwargs["bam_list"]:
             input_files = []
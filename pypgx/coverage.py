@@ -0,0 +1,448 @@
+"""
+In-process read depth engine.
+
+Read depth is computed directly from the alignments with
+``pysam.AlignmentFile`` and stored in NumPy arrays, instead of running
+``samtools depth`` and parsing its text output. The results are identical
+to ``samtools depth -a -Q 1 -r region``: every position of the region is
+reported (including zero depth), reads that are unmapped, secondary,
+QC-failed or duplicates are skipped, as well as reads with a mapping
+quality below 1, and deletions and reference skips are not counted.
+
+CRAM files are supported as well. Their reference sequences are taken
+from the ``reference`` FASTA file if given, or otherwise looked up by
+htslib via ``REF_PATH``/``REF_CACHE`` (see
+:func:`pypgx.common.setup_ref_cache`).
+"""
+
+from multiprocessing import Pool
+from typing import List, Optional, Tuple, TextIO
+
+import numpy as np
+import pysam
+
+# Reads with any of these flags are skipped (UNMAP, SECONDARY, QCFAIL, DUP).
+EXCLUDE_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+# Minimum mapping quality of counted reads (i.e. ``samtools depth -Q 1``).
+MIN_MAPQ = 1
+
+# Maximum number of positions whose depth is held in memory at a time.
+MAX_INTERVAL_SIZE = 1000000
+
+def _parse_region(region: str) -> Tuple[str, int, int]:
+    contig, coords = region.split(":")
+    start, end = [int(x) for x in coords.split("-")]
+    return contig, start, end
+
+def _fetch_depth(
+        f: pysam.AlignmentFile,
+        contig: str,
+        start: int,
+        end: int,
+        min_mapq: int
+    ) -> np.ndarray:
+    offset = start - 1
+    size = end - offset
+    starts = []
+    ends = []
+
+    for read in f.fetch(contig, offset, end):
+        if read.flag & EXCLUDE_FLAGS or read.mapping_quality < min_mapq:
+            continue
+        for block in read.get_blocks():
+            starts.append(block[0])
+            ends.append(block[1])
+
+    # Count aligned blocks with a difference array.
+    starts = np.clip(np.array(starts, dtype=np.int64) - offset, 0, size)
+    ends = np.clip(np.array(ends, dtype=np.int64) - offset, 0, size)
+    diff = (np.bincount(starts, minlength=size + 1)
+        - np.bincount(ends, minlength=size + 1))
+
+    return np.cumsum(diff[:size]).astype(np.uint32)
+
+def bam_depth(
+        bam_file: str,
+        contig: str,
+        start: int,
+        end: int,
+        threads: int = 1,
+        min_mapq: int = MIN_MAPQ,
+        reference: Optional[str] = None
+    ) -> np.ndarray:
+    """
+    Compute read depth of a region from a BAM file.
+
+    Returns:
+        numpy.ndarray: Depth of each position from start to end.
+
+    Args:
+        bam_file (str): BAM or CRAM file.
+        contig (str): Contig name.
+        start (int): Start position (1-based, inclusive).
+        end (int): End position (1-based, inclusive).
+        threads (int): Number of BGZF decompression threads.
+        min_mapq (int): Minimum mapping quality.
+        reference (str, optional): Reference FASTA file (CRAM only).
+    """
+    with pysam.AlignmentFile(bam_file, threads=threads,
+        reference_filename=reference) as f:
+        return _fetch_depth(f, contig, start, end, min_mapq)
+
+def merge_intervals(
+        intervals: List[Tuple[str, int, int]]
+    ) -> List[Tuple[str, int, int]]:
+    """
+    Sort and merge overlapping or adjacent intervals.
+
+    Contigs are kept in the order of their first appearance.
+
+    Returns:
+        list[tuple[str, int, int]]: Merged intervals.
+
+    Args:
+        intervals (list[tuple[str, int, int]]): Contig, start and end
+            (1-based, inclusive) of each interval.
+    """
+
+    contigs = {}
+
+    for contig, start, end in intervals:
+        if contig not in contigs:
+            contigs[contig] = []
+        contigs[contig].append((start, end))
+
+    result = []
+
+    for contig, x in contigs.items():
+        merged = []
+        for start, end in sorted(x):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        result += [(contig, start, end) for start, end in merged]
+
+    return result
+
+def read_bed(bed_file: str) -> List[Tuple[str, int, int]]:
+    """
+    Read a BED file as sorted, merged intervals.
+
+    Overlapping and adjacent intervals are merged, so that each position
+    is counted once (like ``samtools depth -b``).
+
+    Returns:
+        list[tuple[str, int, int]]: Contig, start and end (1-based,
+        inclusive) of each interval.
+
+    Args:
+        bed_file (str): BED file.
+    """
+
+    intervals = []
+
+    with open(bed_file) as f:
+        for line in f:
+            fields = line.strip().split("\t")
+            if not fields[0] or fields[0].startswith(("#", "track", "browser")):
+                continue
+            intervals.append(
+                (fields[0], int(fields[1]) + 1, int(fields[2])))
+
+    return merge_intervals(intervals)
+
+def split_intervals(
+        intervals: List[Tuple[str, int, int]],
+        size: int = MAX_INTERVAL_SIZE
+    ) -> List[Tuple[str, int, int]]:
+    """
+    Split intervals to at most size positions.
+
+    Returns:
+        list[tuple[str, int, int]]: Intervals.
+
+    Args:
+        intervals (list[tuple[str, int, int]]): Intervals.
+        size (int): Maximum number of positions.
+    """
+    result = []
+    for contig, start, end in intervals:
+        for x in range(start, end + 1, size):
+            result.append((contig, x, min(x + size - 1, end)))
+    return result
+
+def depth_counts(
+        bam_file: str,
+        intervals: List[Tuple[str, int, int]],
+        coverages: List[int],
+        min_mapq: int = 0,
+        reference: Optional[str] = None
+    ) -> np.ndarray:
+    """
+    Count positions at or above each coverage in intervals.
+
+    Depth of each interval is computed at once, so intervals should be
+    split to at most MAX_INTERVAL_SIZE positions (see
+    :func:`split_intervals`). Counts are additive, so they can be summed
+    over intervals to get the counts of larger regions.
+
+    Returns:
+        numpy.ndarray: Number of positions (intervals x coverages).
+
+    Args:
+        bam_file (str): BAM or CRAM file.
+        intervals (list[tuple[str, int, int]]): Intervals (see
+            :func:`read_bed`).
+        coverages (list[int]): Coverages in ascending order.
+        min_mapq (int): Minimum mapping quality.
+        reference (str, optional): Reference FASTA file (CRAM only).
+    """
+
+    max_depth = coverages[-1]
+    result = np.zeros((len(intervals), len(coverages)), dtype=np.int64)
+
+    with pysam.AlignmentFile(bam_file, reference_filename=reference) as f:
+        for i, interval in enumerate(intervals):
+            depth = _fetch_depth(f, *interval, min_mapq)
+            hist = np.bincount(np.minimum(depth, max_depth),
+                minlength=max_depth + 1)
+            # Number of positions with depth >= x for every x in one pass.
+            result[i] = np.cumsum(hist[::-1])[::-1][coverages]
+
+    return result
+
+def _bam_depths(args) -> List[np.ndarray]:
+    bam_file, regions, threads, reference = args
+    with pysam.AlignmentFile(bam_file, threads=threads,
+        reference_filename=reference) as f:
+        return [_fetch_depth(f, *_parse_region(x), MIN_MAPQ) for x in regions]
+
+def depth_matrices(
+        bam_files: List[str],
+        regions: List[str],
+        threads: int = 1,
+        reference: Optional[str] = None
+    ) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Compute read depth of regions from multiple BAM files.
+
+    Each BAM file is opened once and read for all regions. If there are
+    several BAM files and ``threads`` is greater than one, the files are
+    processed in a pool of worker processes, so that at most ``threads``
+    files are open at any time; a single BAM file uses ``threads`` BGZF
+    decompression threads instead. Columns are always in the order of
+    ``bam_files``.
+
+    Returns:
+        list[tuple[str, numpy.ndarray, numpy.ndarray]]: Contig, positions
+        and depth matrix (positions x samples) of each region.
+
+    Args:
+        bam_files (list[str]): BAM or CRAM files.
+        regions (list[str]): Regions ('chr:start-end').
+        threads (int): Number of worker processes.
+        reference (str, optional): Reference FASTA file (CRAM only).
+    """
+
+    result = []
+
+    for region in regions:
+        contig, start, end = _parse_region(region)
+        depth = np.zeros((end - start + 1, len(bam_files)), dtype=np.uint32)
+        result.append((contig, np.arange(start, end + 1), depth))
+
+    if threads > 1 and len(bam_files) > 1:
+        tasks = [(x, regions, 1, reference) for x in bam_files]
+        chunksize = max(1, len(tasks) // (threads * 4))
+        with Pool(min(threads, len(bam_files))) as p:
+            columns = p.imap(_bam_depths, tasks, chunksize=chunksize)
+            for i, column in enumerate(columns):
+                for j, x in enumerate(column):
+                    result[j][2][:, i] = x
+    else:
+        for i, bam_file in enumerate(bam_files):
+            for j, x in enumerate(_bam_depths(
+                (bam_file, regions, threads, reference))):
+                result[j][2][:, i] = x
+
+    return result
+
+def _bam_depth_row(args) -> int:
+    i, bam_file, regions, threads, reference, fn, shape = args
+    matrix = np.memmap(fn, dtype=np.uint32, mode="r+", shape=shape)
+    row = 0
+    with pysam.AlignmentFile(bam_file, threads=threads,
+        reference_filename=reference) as f:
+        for region in regions:
+            depth = _fetch_depth(f, *_parse_region(region), MIN_MAPQ)
+            matrix[i, row:row + len(depth)] = depth
+            row += len(depth)
+    matrix.flush()
+    return i
+
+def depth_file(
+        bam_files: List[str],
+        regions: List[str],
+        fn: str,
+        threads: int = 1,
+        reference: Optional[str] = None
+    ) -> np.memmap:
+    """
+    Compute read depth of regions from multiple BAM files into a file.
+
+    Unlike :func:`depth_matrices`, the depth is not held in memory. Each
+    BAM file is opened once and read for all regions in order by one
+    worker process, which writes its depth as one row of a matrix (samples
+    x positions of all regions) memory-mapped from ``fn``, so that the
+    rows of different BAM files are written independently. With a single
+    BAM file, ``threads`` BGZF decompression threads are used instead.
+
+    Returns:
+        numpy.memmap: Read-only depth matrix (samples x positions).
+
+    Args:
+        bam_files (list[str]): BAM or CRAM files.
+        regions (list[str]): Regions ('chr:start-end').
+        fn (str): File of the depth matrix (overwritten).
+        threads (int): Number of worker processes.
+        reference (str, optional): Reference FASTA file (CRAM only).
+    """
+
+    size = sum([x[2] - x[1] + 1 for x in map(_parse_region, regions)])
+    shape = (len(bam_files), size)
+    np.memmap(fn, dtype=np.uint32, mode="w+", shape=shape).flush()
+
+    if threads > 1 and len(bam_files) > 1:
+        tasks = [(i, x, regions, 1, reference, fn, shape)
+            for i, x in enumerate(bam_files)]
+        with Pool(min(threads, len(bam_files))) as p:
+            for _ in p.imap_unordered(_bam_depth_row, tasks):
+                pass
+    else:
+        for i, bam_file in enumerate(bam_files):
+            _bam_depth_row((i, bam_file, regions, threads, reference, fn,
+                shape))
+
+    return np.memmap(fn, dtype=np.uint32, mode="r", shape=shape)
+
+def depth_matrix(
+        bam_files: List[str],
+        region: str,
+        threads: int = 1,
+        reference: Optional[str] = None
+    ) -> Tuple[str, np.ndarray, np.ndarray]:
+    """
+    Compute read depth of a region from multiple BAM files.
+
+    Returns:
+        tuple[str, numpy.ndarray, numpy.ndarray]: Contig, positions and
+        depth matrix (positions x samples).
+
+    Args:
+        bam_files (list[str]): BAM or CRAM files.
+        region (str): Region ('chr:start-end').
+        threads (int): Number of worker processes (see
+            :func:`depth_matrices`).
+        reference (str, optional): Reference FASTA file (CRAM only).
+    """
+    return depth_matrices(bam_files, [region], threads, reference)[0]
+
+def slice_blocks(
+        blocks: List[Tuple[str, np.ndarray, np.ndarray]],
+        region: str
+    ) -> Tuple[str, np.ndarray, np.ndarray]:
+    """
+    Get the depth of a region from the depth matrices of larger regions.
+
+    Returns:
+        tuple[str, numpy.ndarray, numpy.ndarray]: Contig, positions and
+        depth matrix (positions x samples).
+
+    Args:
+        blocks (list[tuple]): Contig, positions and depth matrix of each
+            region (see :func:`depth_matrices`).
+        region (str): Region ('chr:start-end'), which must be within one
+            of the blocks.
+    """
+
+    contig, start, end = _parse_region(region)
+
+    for x, positions, depth in blocks:
+        if x == contig and positions[0] <= start and end <= positions[-1]:
+            i = start - positions[0]
+            j = end - positions[0] + 1
+            return contig, positions[i:j], depth[i:j]
+
+    raise ValueError(f"Region not found in depth matrices: {region}")
+
+def window_bins(start: int, end: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Split a region into fixed-size windows (the last one may be shorter).
+
+    Returns:
+        list[tuple[int, int]]: Start and end (1-based, inclusive) of each
+        window.
+
+    Args:
+        start (int): Start position.
+        end (int): End position.
+        size (int): Window size.
+    """
+    return [(x, min(x + size - 1, end)) for x in range(start, end + 1, size)]
+
+def bin_depth(
+        positions: np.ndarray,
+        depth: np.ndarray,
+        bins: List[Tuple[int, int]],
+        stat: str = "mean"
+    ) -> np.ndarray:
+    """
+    Aggregate a depth matrix into bins.
+
+    Returns:
+        numpy.ndarray: Mean or median depth (bins x samples).
+
+    Args:
+        positions (numpy.ndarray): Positions (consecutive).
+        depth (numpy.ndarray): Depth matrix (positions x samples).
+        bins (list[tuple[int, int]]): Start and end of each bin, which
+            must be within the positions.
+        stat (str): Statistic ('mean' or 'median').
+    """
+
+    if stat not in ["mean", "median"]:
+        raise ValueError(f"Incorrect bin statistic: {stat}")
+
+    offset = positions[0]
+    result = np.zeros((len(bins), depth.shape[1]))
+
+    for i, (start, end) in enumerate(bins):
+        x = depth[start - offset:end - offset + 1]
+        if stat == "mean":
+            result[i] = x.mean(axis=0)
+        else:
+            result[i] = np.median(x, axis=0)
+
+    return result
+
+def write_sdf(
+        out: TextIO,
+        contig: str,
+        positions: np.ndarray,
+        depth: np.ndarray
+    ) -> None:
+    """
+    Write a depth matrix as SDF data (i.e. ``samtools depth`` output).
+
+    Args:
+        out (TextIO): SDF data will be written to this handle.
+        contig (str): Contig name.
+        positions (numpy.ndarray): Positions.
+        depth (numpy.ndarray): Depth matrix (positions x samples).
+    """
+
+    data = np.column_stack([positions, depth])
+    for row in data.tolist():
+        out.write(contig + "\t" + "\t".join(map(str, row)) + "\n")
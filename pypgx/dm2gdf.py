@@ -0,0 +1,54 @@
+import gzip
+from io import StringIO
+from typing import Optional
+
+from .depthmatrix import DepthMatrix
+from .sdf2gdf import CHUNK_SIZE, write_gdf_header, write_gdf_block
+
+def dm2gdf(
+        dm_file: str,
+        region: Optional[str] = None,
+        output: Optional[str] = None,
+        **kwargs
+    ) -> Optional[str]:
+    """
+    Create GDF file from DM (depth matrix) file.
+
+    Returns:
+        str: GDF file, or None if it was written to ``output``.
+
+    Args:
+        dm_file (str): DM file.
+        region (str, optional): Only convert this region.
+        output (str, optional): Write GDF data directly to this file
+            (gzip compressed if it ends with '.gz').
+    """
+
+    dm = DepthMatrix(dm_file)
+
+    if region is None:
+        blocks = dm.blocks()
+    else:
+        blocks = [dm.fetch(region)]
+
+    if output is None:
+        out = StringIO()
+    elif output.endswith(".gz"):
+        out = gzip.open(output, "wt")
+    else:
+        out = open(output, "w")
+
+    try:
+        write_gdf_header(out, dm.samples)
+        for contig, positions, depth in blocks:
+            for i in range(0, len(positions), CHUNK_SIZE):
+                write_gdf_block(out, contig, positions[i:i + CHUNK_SIZE],
+                    depth[i:i + CHUNK_SIZE])
+    finally:
+        if output is not None:
+            out.close()
+
+    if output is None:
+        return out.getvalue()
+
+    return None
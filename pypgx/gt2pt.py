@@ -1,33 +1,117 @@
-from .phenotyper import phenotyper
+import os
+from io import StringIO
+from multiprocessing import Pool
+from typing import List, Optional, Tuple, Union
 
-def gt2pt(gt_file: str,
-          **kwargs) -> str:
-    """Convert a genotype file to phenotypes.
+from .common import get_file_list, read_file_list
+from .phenotyper import phenotyper_batch
 
-    This command is just a wrapper for the ``phenotyper`` module.
-
-    Returns:
-        str: Phenotype calls.
-
-    Args:
-        gt_file (str): Genotype file from Stargazer (``genotype.txt``).
-    """
-
-    result = []
+def _phenotype_file(gt_file: str) -> List[Tuple[str, str, str]]:
+    names = []
+    genes = []
+    hap1s = []
+    hap2s = []
 
     with open(gt_file) as f:
         header = next(f).strip().split("\t")
 
+        i0 = header.index("name")
         i1 = header.index("gene")
         i2 = header.index("hap1_main")
         i3 = header.index("hap2_main")
 
         for line in f:
             fields = line.strip().split("\t")
-            gene = fields[i1]
-            hap1 = fields[i2]
-            hap2 = fields[i3]
+            names.append(fields[i0])
+            genes.append(fields[i1])
+            hap1s.append(fields[i2])
+            hap2s.append(fields[i3])
+
+    result = phenotyper_batch(genes, hap1s, hap2s)
+
+    return list(zip(names, genes, result))
+
+def gt2pt(gt_file: Union[str, List[str]],
+          gt_dir: Optional[str] = None,
+          gt_list: Optional[str] = None,
+          threads: int = 1,
+          output: Optional[str] = None,
+          **kwargs) -> Optional[str]:
+    """Convert genotype files to phenotypes.
+
+    This command is just a wrapper for the ``phenotyper`` module. All rows
+    of a genotype file are phenotyped at once with ``phenotyper_batch``.
+
+    For a single genotype file given as ``gt_file``, the output is one
+    phenotype call per line. Otherwise (several files, directories,
+    ``gt_dir`` or ``gt_list``, even if they yield only one file), the output is a tab-delimited table with the columns
+    ``file``, ``name``, ``gene`` and ``phenotype``. The files are
+    processed in a pool of ``threads`` worker processes, each of which
+    loads the star allele databases only once, and rows are written in
+    the order of the input files as soon as each file is done.
+
+    Returns:
+        str: Phenotype calls, or None if they were written to ``output``.
+
+    Args:
+        gt_file (str or list[str]): Genotype files from Stargazer
+            (``genotype.txt``). Directories are searched for genotype files.
+        gt_dir (str, optional): Use all genotype files in this directory
+            as input.
+        gt_list (str, optional): List of input genotype files, one file per
+            line.
+        threads (int): Number of worker processes.
+        output (str, optional): Write phenotype calls directly to this
+            file.
+    """
+
+    if isinstance(gt_file, str):
+        gt_file = [gt_file]
+
+    # The output format depends only on how the files were given, not on
+    # how many were found.
+    input_files = []
+    table = bool(gt_dir or gt_list) or len(gt_file or []) > 1
+
+    for x in list(gt_file or []) + ([gt_dir] if gt_dir else []):
+        if os.path.isdir(x):
+            input_files += sorted(get_file_list(x, "genotype.txt"))
+            table = True
+        else:
+            input_files.append(x)
+
+    if gt_list:
+        input_files += read_file_list(gt_list)
+
+    if not input_files:
+        raise ValueError("No input genotype files found")
+
+    out = StringIO() if output is None else open(output, "w")
+    p = None
+
+    try:
+        if not table:
+            rows = _phenotype_file(input_files[0])
+            out.write("\n".join([x[2] for x in rows]) + "\n")
+        else:
+            if threads > 1:
+                p = Pool(min(threads, len(input_files)))
+                results = p.imap(_phenotype_file, input_files)
+            else:
+                results = map(_phenotype_file, input_files)
+
+            out.write("file\tname\tgene\tphenotype\n")
+
+            for gt_file, rows in zip(input_files, results):
+                for row in rows:
+                    out.write("\t".join((gt_file,) + row) + "\n")
+    finally:
+        if p is not None:
+            p.terminate()
+        if output is not None:
+            out.close()
 
-            result.append(phenotyper(gene, hap1, hap2))
+    if output is None:
+        return out.getvalue()
 
-    return "\n".join(result) + "\n"
\ No newline at end of file
+    return None
@@ -0,0 +1,62 @@
+import logging
+from typing import Optional
+
+import pandas as pd
+
+from .resultcache import (
+    RESULT_KINDS,
+    list_entries,
+    read_access_log,
+    compact_access_log,
+    evict,
+)
+
+logger = logging.getLogger(__name__)
+
+def gtcache(
+        cache_dir: str,
+        max_size: Optional[float] = None,
+        max_age: Optional[float] = None,
+        **kwargs
+    ) -> str:
+    """
+    Report and evict the result cache of ``bam2gt``.
+
+    Entries that were not used for more than ``max_age`` days are removed
+    first, then the least recently used entries are removed until the
+    cache is not larger than ``max_size`` GB. The access log is compacted
+    to the number of hits and misses of each kind of result.
+
+    Returns:
+        str: Table with the number of entries, size (MB), hits, misses and
+        hit rate (%) of each kind of result.
+
+    Args:
+        cache_dir (str): Cache directory (``--cache_dir`` of ``bam2gt``).
+        max_size (float, optional): Maximum cache size in GB.
+        max_age (float, optional): Maximum time since last use in days.
+    """
+    if max_size is not None or max_age is not None:
+        removed = evict(cache_dir,
+            None if max_size is None else int(max_size * 1024 ** 3),
+            None if max_age is None else max_age * 86400)
+        size = sum([x["size"] for x in removed]) / 1024 ** 2
+        logger.info(f"Removed {len(removed)} entries ({size:.1f} MB)")
+    else:
+        compact_access_log(cache_dir)
+
+    entries = list_entries(cache_dir)
+    counts = read_access_log(cache_dir)
+    rows = []
+
+    for kind in RESULT_KINDS:
+        hits, misses = counts[kind]
+        sizes = [x["size"] for x in entries if x["kind"] == kind]
+        total = hits + misses
+        rows.append([kind, len(sizes), round(sum(sizes) / 1024 ** 2, 1),
+            hits, misses, round(hits / total * 100, 1) if total else 0.0])
+
+    df = pd.DataFrame(rows, columns=["kind", "entries", "size_mb", "hits",
+        "misses", "hit_rate"])
+
+    return df.to_string(index=False) + "\n"
@@ -0,0 +1,175 @@
+"""
+Persistent per-sample gVCF cache for GATK joint calling.
+
+HaplotypeCaller gVCF files are stored by a key computed from the identity
+of the BAM file (path, size and modification time), the target region,
+the reference FASTA file and the GATK version, so that a sample is only
+called again when one of them changes. The cache directory also holds
+one GenomicsDB workspace per target region, reference and GATK version,
+which records the gVCF keys it was built from and is updated with new
+samples only.
+
+The cache layout is::
+
+    gvcf/<key[:2]>/<key>.g.vcf(.idx)  HaplotypeCaller output
+    gvcf/<key[:2]>/<key>.json         Metadata (BAM file, sample, ...)
+    genomicsdb/<key>/                 GenomicsDB workspace
+    genomicsdb/<key>.json             gVCF keys and samples in workspace
+    genomicsdb/<key>.lock             Lock file of the workspace
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, Optional
+
+# Increase to invalidate all cached gVCF files (e.g. when the
+# HaplotypeCaller arguments change).
+GVCF_CACHE_VERSION = 1
+
+@lru_cache(maxsize=1)
+def gatk_version() -> str:
+    """Get the version of the installed GATK (e.g. 'v4.1.9.0')."""
+    result = subprocess.run(["gatk", "--version"], check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+
+    for line in result.stdout.splitlines():
+        if "(GATK)" in line:
+            return line.split()[-1]
+
+    raise ValueError("Could not determine the GATK version")
+
+def file_identity(fn: str) -> Dict[str, object]:
+    """Get the real path, size and modification time of a file."""
+    stat = os.stat(fn)
+    return {"path": os.path.realpath(fn), "size": stat.st_size,
+        "mtime": stat.st_mtime_ns}
+
+def _hash(data: Dict[str, object]) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def gvcf_key(
+        bam_file: str,
+        target_region: str,
+        fasta_file: str,
+        version: str
+    ) -> str:
+    """
+    Compute the cache key of a gVCF file.
+
+    Returns:
+        str: Cache key.
+
+    Args:
+        bam_file (str): BAM file.
+        target_region (str): Target region(s) (e.g.
+            'chr22:42512500-42551883').
+        fasta_file (str): Reference FASTA file.
+        version (str): GATK version.
+    """
+    return _hash({"cache": GVCF_CACHE_VERSION, "bam": file_identity(bam_file),
+        "region": target_region, "fasta": file_identity(fasta_file),
+        "gatk": version})
+
+def workspace_key(target_region: str, fasta_file: str, version: str) -> str:
+    """Compute the cache key of a GenomicsDB workspace."""
+    return _hash({"cache": GVCF_CACHE_VERSION, "region": target_region,
+        "fasta": file_identity(fasta_file), "gatk": version})
+
+def gvcf_path(cache_dir: str, key: str) -> str:
+    """Get the path of a cached gVCF file (which may not exist yet)."""
+    return f"{cache_dir}/gvcf/{key[:2]}/{key}.g.vcf"
+
+def write_gvcf_metadata(
+        cache_dir: str,
+        key: str,
+        metadata: Dict[str, object]
+    ) -> None:
+    """Write the metadata of a cached gVCF file."""
+    dest = gvcf_path(cache_dir, key)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(f"{dest[:-6]}.json", "w") as f:
+        json.dump(metadata, f, indent=4)
+
+def store_gvcf(
+        cache_dir: str,
+        key: str,
+        gvcf_file: str,
+        metadata: Optional[Dict[str, object]] = None
+    ) -> str:
+    """
+    Move a gVCF file and its index into the cache.
+
+    The gVCF file is moved last, so that it only appears in the cache
+    when it is complete.
+
+    Returns:
+        str: Path of the cached gVCF file.
+
+    Args:
+        cache_dir (str): Cache directory.
+        key (str): Cache key (see :func:`gvcf_key`).
+        gvcf_file (str): gVCF file.
+        metadata (dict, optional): Information stored with the gVCF file.
+    """
+    dest = gvcf_path(cache_dir, key)
+    write_gvcf_metadata(cache_dir, key, metadata or {})
+
+    for suffix in [".idx", ""]:
+        if os.path.exists(f"{gvcf_file}{suffix}"):
+            temp = f"{dest}{suffix}.{os.getpid()}.tmp"
+            shutil.move(f"{gvcf_file}{suffix}", temp)
+            os.replace(temp, f"{dest}{suffix}")
+
+    return dest
+
+def workspace_path(cache_dir: str, key: str) -> str:
+    """Get the path of a cached GenomicsDB workspace."""
+    return f"{cache_dir}/genomicsdb/{key}"
+
+def read_workspace(workspace: str) -> Dict[str, str]:
+    """
+    Get the gVCF keys and samples imported into a GenomicsDB workspace.
+
+    Returns:
+        dict[str, str]: Sample of each gVCF key (empty if the workspace
+        does not exist).
+
+    Args:
+        workspace (str): GenomicsDB workspace.
+    """
+    if not os.path.exists(workspace) or not os.path.exists(
+        f"{workspace}.json"):
+        return {}
+
+    with open(f"{workspace}.json") as f:
+        return json.load(f)
+
+def write_workspace(workspace: str, samples: Dict[str, str]) -> None:
+    """Record the gVCF keys and samples of a GenomicsDB workspace."""
+    with open(f"{workspace}.json.tmp", "w") as f:
+        json.dump(samples, f, indent=4)
+    os.replace(f"{workspace}.json.tmp", f"{workspace}.json")
+
+def remove_workspace(workspace: str) -> None:
+    """Remove a (possibly incomplete) GenomicsDB workspace."""
+    if os.path.exists(f"{workspace}.json"):
+        os.remove(f"{workspace}.json")
+    shutil.rmtree(workspace, ignore_errors=True)
+
+@contextmanager
+def lock_workspace(workspace: str) -> Iterator[None]:
+    """Lock a GenomicsDB workspace against concurrent runs."""
+    os.makedirs(os.path.dirname(workspace), exist_ok=True)
+    with open(f"{workspace}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
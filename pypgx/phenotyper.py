@@ -1,88 +1,82 @@
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
 from .common import get_stardb
+from .sglib import parse_haplotype
+
+# Each phenotyping algorithm is a list of (condition, phenotype) pairs over
+# the total activity score, plus the phenotype used when none is met. The
+# conditions work on both scalars and NumPy arrays.
+_PHENOTYPE_DEFAULT = ([
+    (lambda x: x < 0, "unknown_function"),
+    (lambda x: x == 0, "no_function"),
+    (lambda x: (0 < x) & (x < 2), "decreased_function"),
+    (lambda x: x == 2, "normal_function"),
+    (lambda x: x > 2, "increased_function"),
+], "undetermined_function")
+
+_METABOLIZER_DEFAULT = ([
+    (lambda x: x < 0, "unknown_metabolizer"),
+    (lambda x: x == 0, "poor_metabolizer"),
+    (lambda x: (0 < x) & (x <= 1.25), "intermediate_metabolizer"),
+    (lambda x: (1.25 < x) & (x <= 2), "normal_metabolizer"),
+    (lambda x: (2 < x) & (x < 2.5), "rapid_metabolizer"),
+    (lambda x: x >= 2.5, "ultrarapid_metabolizer"),
+], "undetermined_metabolizer")
+
+_METABOLIZER_CYP2D6 = ([
+    (lambda x: x < 0, "unknown_metabolizer"),
+    (lambda x: x == 0, "poor_metabolizer"),
+    (lambda x: (0 < x) & (x <= 1), "intermediate_metabolizer"),
+    (lambda x: (1 < x) & (x <= 2.25), "normal_metabolizer"),
+    (lambda x: x > 2.25, "ultrarapid_metabolizer"),
+], "undetermined_metabolizer")
+
+_TRANSPORTER_DEFAULT = ([
+    (lambda x: x < 0, "unknown_function"),
+    (lambda x: (0 <= x) & (x <= 1), "poor_function"),
+    (lambda x: (1 < x) & (x <= 1.5), "decreased_function"),
+    (lambda x: (1.5 < x) & (x <= 2), "normal_function"),
+    (lambda x: 2 < x, "increased_function"),
+], "undetermined_function")
+
+def _classify(rules, total):
+    conditions, default = rules
+    for condition, label in conditions:
+        if condition(total):
+            return label
+    return default
+
+def _classify_array(rules, total):
+    conditions, default = rules
+    return np.select(
+        [condition(total) for condition, label in conditions],
+        [label for condition, label in conditions],
+        default
+    ).astype(object)
 
 def _phenotype_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_function"
-    elif total == 0:
-        result = "no_function"
-    elif 0 < total < 2:
-        result = "decreased_function"
-    elif total == 2:
-        result = "normal_function"
-    elif total > 2:
-        result = "increased_function"
-    else:
-        result = "undetermined_function"
-    return result
+    total = _hap2as(stardb, hap1) + _hap2as(stardb, hap2)
+    return _classify(_PHENOTYPE_DEFAULT, total)
 
 def _metabolizer_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_metabolizer"
-    elif total == 0:
-        result = "poor_metabolizer"
-    elif 0 < total <= 1.25:
-        result = "intermediate_metabolizer"
-    elif 1.25 < total <= 2:
-        result = "normal_metabolizer"
-    elif 2 < total < 2.5:
-        result = "rapid_metabolizer"
-    elif total >= 2.5:
-        result = "ultrarapid_metabolizer"
-    else:
-        result = "undetermined_metabolizer"
-    return result
+    total = _hap2as(stardb, hap1) + _hap2as(stardb, hap2)
+    return _classify(_METABOLIZER_DEFAULT, total)
 
 def _metabolizer_cyp2d6(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_metabolizer"
-    elif total == 0:
-        result = "poor_metabolizer"
-    elif 0 < total <= 1:
-        result = "intermediate_metabolizer"
-    elif 1 < total <= 2.25:
-        result = "normal_metabolizer"
-    elif total > 2.25:
-        result = "ultrarapid_metabolizer"
-    else:
-        result = "undetermined_metabolizer"
-    return result
+    total = _hap2as(stardb, hap1) + _hap2as(stardb, hap2)
+    return _classify(_METABOLIZER_CYP2D6, total)
 
 def _transporter_default(stardb, hap1, hap2):
-    as1 = _hap2as(stardb, hap1)
-    as2 = _hap2as(stardb, hap2)
-    total = as1 + as2
-    if total < 0:
-        result = "unknown_function"
-    elif 0 <= total <= 1:
-        result = "poor_function"
-    elif 1 < total <= 1.5:
-        result = "decreased_function"
-    elif 1.5 < total <= 2:
-        result = "normal_function"
-    elif 2 < total:
-        result = "increased_function"
-    else:
-        result = "undetermined_function"
-    return result
+    total = _hap2as(stardb, hap1) + _hap2as(stardb, hap2)
+    return _classify(_TRANSPORTER_DEFAULT, total)
 
 def _hap2as(stardb, hap):
     result = 0
-    for sa in hap.split("+"):
-        if "x" in sa:
-            n = int(sa.split("x")[1])
-            name = sa.split("x")[0]
-            result += stardb[name].score * n
-        else:
-            result += stardb[sa].score
+    for name, n in parse_haplotype(hap).components:
+        result += stardb[name].score * n
     return result
 
 ptcallers = {
@@ -145,6 +139,13 @@ ptcallers = {
     "xpc": _phenotype_default,
 }
 
+_ptrules = {
+    _phenotype_default: _PHENOTYPE_DEFAULT,
+    _metabolizer_default: _METABOLIZER_DEFAULT,
+    _metabolizer_cyp2d6: _METABOLIZER_CYP2D6,
+    _transporter_default: _TRANSPORTER_DEFAULT,
+}
+
 def phenotyper(gene: str, hap1: str, hap2: str) -> str:
     """Maps haplotype calls to a phenotype.
 
@@ -262,12 +263,80 @@ def phenotyper(gene: str, hap1: str, hap2: str) -> str:
           - AS > 2
         * - undetermined_function
           - All other cases
-    """
-    stardb = get_stardb(gene, "hg19")
 
+    Genes without a phenotyping algorithm (including unknown genes) give
+    'no_phenotype'.
+    """
     if gene in ptcallers:
-        result = ptcallers[gene](stardb, hap1, hap2)
+        result = ptcallers[gene](get_stardb(gene, "hg19"), hap1, hap2)
     else:
         result = "no_phenotype"
 
     return result
+
+
+def phenotyper_batch(
+        genes: Sequence[str],
+        hap1s: Sequence[str],
+        hap2s: Sequence[str]
+    ) -> np.ndarray:
+    """Maps many haplotype calls to phenotypes at once.
+
+    This is the vectorized version of ``phenotyper``. The activity score of
+    each distinct (gene, haplotype) pair is computed only once, and total
+    scores are mapped to phenotypes with array operations using the same
+    algorithms. As with ``phenotyper``, genes without a phenotyping
+    algorithm (including unknown genes) give 'no_phenotype'.
+
+    Returns:
+        Phenotypes, one for each diplotype.
+
+    Args:
+        genes: Target genes (e.g. a list or DataFrame column).
+        hap1s: 1st haplotype calls.
+        hap2s: 2nd haplotype calls.
+
+    Making phenotype predictions for several genotypes::
+
+        from pypgx.phenotyper import phenotyper_batch
+        phenotyper_batch(["cyp2d6", "cyp2d6"], ["*1", "*4"], ["*2x2", "*5"])
+
+    To give::
+
+        array(['ultrarapid_metabolizer', 'poor_metabolizer'], dtype=object)
+    """
+    df = pd.DataFrame({
+        "gene": np.asarray(genes, dtype=object),
+        "hap1": np.asarray(hap1s, dtype=object),
+        "hap2": np.asarray(hap2s, dtype=object),
+    })
+
+    result = np.full(len(df), "no_phenotype", dtype=object)
+
+    if df.empty:
+        return result
+
+    # Compute the activity score of each distinct (gene, haplotype) pair.
+    gene_codes, gene_names = pd.factorize(df["gene"])
+    hap_codes, hap_names = pd.factorize(pd.concat([df["hap1"], df["hap2"]]))
+    pairs = np.tile(gene_codes, 2) * len(hap_names) + hap_codes
+    uniques, inverse = np.unique(pairs, return_inverse=True)
+    scores = np.full(len(uniques), np.nan)
+
+    for i, pair in enumerate(uniques):
+        gene = gene_names[pair // len(hap_names)]
+        if gene not in ptcallers:
+            continue
+        stardb = get_stardb(gene, "hg19")
+        scores[i] = _hap2as(stardb, hap_names[pair % len(hap_names)])
+
+    scores = scores[inverse]
+    total = scores[:len(df)] + scores[len(df):]
+
+    for ptcaller, rules in _ptrules.items():
+        names = [k for k, v in ptcallers.items() if v is ptcaller]
+        mask = df["gene"].isin(names).to_numpy()
+        if mask.any():
+            result[mask] = _classify_array(rules, total[mask])
+
+    return result
@@ -0,0 +1,354 @@
+"""
+Content-addressed cache of ``bam2gt`` results.
+
+The VCF, GDF and Stargazer outputs of ``bam2gt`` are stored by a key
+computed from a fingerprint of the content of each BAM file (not its
+path), the pipeline parameters and the versions of PyPGx and the tools
+involved, so that a cohort is only processed again when one of them
+changes. The VCF and GDF entries are keyed separately, so that e.g. a new
+Stargazer version reuses the called variants and read depth.
+
+The cache layout is::
+
+    bam2gt/<kind>/<key[:2]>/<key>/            Cached files
+    bam2gt/<kind>/<key[:2]>/<key>/entry.json  Metadata (also last access)
+    bam2gt/access.log                         Hits and misses (compacted
+                                              by evict)
+
+where ``<kind>`` is 'vcf', 'gdf' or 'stargazer'.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from .version import __version__
+from .gvcfcache import file_identity
+
+# Increase to invalidate all cached results.
+RESULT_CACHE_VERSION = 1
+
+RESULT_KINDS = ("vcf", "gdf", "stargazer")
+
+# Files up to this size are hashed entirely by bam_fingerprint.
+FINGERPRINT_HEAD = 1 << 20
+FINGERPRINT_BLOCK = 1 << 16
+FINGERPRINT_BLOCKS = 16
+
+# Maximum number of files whose fingerprint and checksum are memoized.
+FINGERPRINT_CACHE_SIZE = 65536
+
+def bam_fingerprint(fn: str) -> str:
+    """
+    Compute a fast fingerprint of the content of a BAM/CRAM file.
+
+    The fingerprint is a hash of the file size, the first MiB (which
+    includes the header) and 16 blocks of 64 KiB spread evenly over the
+    rest of the file, so that copies of a file under different paths have
+    the same fingerprint. It is not a full checksum.
+
+    Returns:
+        str: Fingerprint.
+
+    Args:
+        fn (str): BAM/CRAM file.
+    """
+    stat = os.stat(fn)
+    return _bam_fingerprint(os.path.realpath(fn), stat.st_size,
+        stat.st_mtime_ns)
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _bam_fingerprint(path: str, size: int, mtime: int) -> str:
+    h = hashlib.sha1(str(size).encode())
+
+    with open(path, "rb") as f:
+        if size <= FINGERPRINT_HEAD + FINGERPRINT_BLOCK * FINGERPRINT_BLOCKS:
+            h.update(f.read())
+            return h.hexdigest()
+
+        h.update(f.read(FINGERPRINT_HEAD))
+        step = (size - FINGERPRINT_HEAD - FINGERPRINT_BLOCK) // (
+            FINGERPRINT_BLOCKS - 1)
+        for i in range(FINGERPRINT_BLOCKS):
+            f.seek(FINGERPRINT_HEAD + i * step)
+            h.update(f.read(FINGERPRINT_BLOCK))
+
+    return h.hexdigest()
+
+def file_checksum(fn: str) -> str:
+    """
+    Compute the SHA-1 checksum of the entire content of a file.
+
+    Returns:
+        str: Checksum.
+
+    Args:
+        fn (str): File.
+    """
+    stat = os.stat(fn)
+    return _file_checksum(os.path.realpath(fn), stat.st_size,
+        stat.st_mtime_ns)
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _file_checksum(path: str, size: int, mtime: int) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(FINGERPRINT_HEAD), b""):
+            h.update(data)
+    return h.hexdigest()
+
+@lru_cache(maxsize=None)
+def tool_version(command: str) -> str:
+    """
+    Get the version of a command-line tool.
+
+    Returns:
+        str: First line printed by ``command --version``, or the path,
+        size and modification time of the executable if the tool has no
+        such option.
+
+    Args:
+        command (str): Name of the tool (e.g. 'bcftools').
+    """
+    try:
+        result = subprocess.run([command, "--version"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+    except OSError:
+        raise ValueError(f"Could not find the {command} program")
+
+    lines = [x for x in result.stdout.splitlines() if x.strip()]
+
+    if result.returncode == 0 and lines:
+        return lines[0].strip()
+
+    return json.dumps(file_identity(shutil.which(command)), sort_keys=True)
+
+def result_key(kind: str, params: Dict[str, object]) -> str:
+    """
+    Compute the cache key of a result.
+
+    Returns:
+        str: Cache key.
+
+    Args:
+        kind (str): Kind of result ('vcf', 'gdf' or 'stargazer').
+        params (dict): Everything the result depends on (e.g. BAM
+            fingerprints, target gene and tool versions).
+    """
+    data = {"cache": RESULT_CACHE_VERSION, "pypgx": __version__,
+        "kind": kind, "params": params}
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def entry_path(cache_dir: str, kind: str, key: str) -> str:
+    """Get the path of a cache entry (which may not exist yet)."""
+    return f"{cache_dir}/bam2gt/{kind}/{key[:2]}/{key}"
+
+def _log_access(cache_dir: str, kind: str, key: str, hit: bool) -> None:
+    os.makedirs(f"{cache_dir}/bam2gt", exist_ok=True)
+    line = "\t".join([str(int(time.time())), kind, key,
+        "hit" if hit else "miss"])
+    with open(f"{cache_dir}/bam2gt/access.log", "a") as f:
+        f.write(line + "\n")
+
+def fetch_entry(cache_dir: str, kind: str, key: str) -> Optional[str]:
+    """
+    Look up a cache entry and record the hit or miss.
+
+    Returns:
+        str: Directory of the cached files, or None if there is no entry.
+
+    Args:
+        cache_dir (str): Cache directory.
+        kind (str): Kind of result ('vcf', 'gdf' or 'stargazer').
+        key (str): Cache key (see :func:`result_key`).
+    """
+    entry = entry_path(cache_dir, kind, key)
+
+    try:
+        # The modification time of the metadata is the last access.
+        os.utime(f"{entry}/entry.json")
+    except FileNotFoundError:
+        entry = None
+
+    _log_access(cache_dir, kind, key, entry is not None)
+
+    return entry
+
+def store_entry(
+        cache_dir: str,
+        kind: str,
+        key: str,
+        files: List[str],
+        metadata: Optional[Dict[str, object]] = None
+    ) -> str:
+    """
+    Move files or directories into a new cache entry.
+
+    The entry is created in a temporary directory and renamed when it is
+    complete. If another process stored the same entry in the meantime,
+    its files are kept.
+
+    Returns:
+        str: Directory of the cached files.
+
+    Args:
+        cache_dir (str): Cache directory.
+        kind (str): Kind of result ('vcf', 'gdf' or 'stargazer').
+        key (str): Cache key (see :func:`result_key`).
+        files (list[str]): Files or directories to store.
+        metadata (dict, optional): Information stored with the entry.
+    """
+    entry = entry_path(cache_dir, kind, key)
+    temp = f"{entry}.{os.getpid()}.tmp"
+    shutil.rmtree(temp, ignore_errors=True)
+    os.makedirs(temp)
+
+    for fn in files:
+        shutil.move(fn, f"{temp}/{os.path.basename(fn)}")
+
+    with open(f"{temp}/entry.json", "w") as f:
+        json.dump(dict(metadata or {}, key=key, kind=kind,
+            created=int(time.time())), f, indent=4)
+
+    try:
+        os.rename(temp, entry)
+    except OSError:
+        if not os.path.exists(f"{entry}/entry.json"):
+            raise
+        shutil.rmtree(temp)
+
+    return entry
+
+def _entry_size(entry: str) -> int:
+    return sum([os.path.getsize(os.path.join(r, x))
+        for r, d, f in os.walk(entry) for x in f])
+
+def list_entries(cache_dir: str) -> List[Dict[str, object]]:
+    """
+    List the entries in a cache directory.
+
+    Returns:
+        list[dict]: Path, kind, size (bytes) and last access time of each
+        entry, least recently used first.
+
+    Args:
+        cache_dir (str): Cache directory.
+    """
+    result = []
+
+    for kind in RESULT_KINDS:
+        root = f"{cache_dir}/bam2gt/{kind}"
+        if not os.path.isdir(root):
+            continue
+        for prefix in os.listdir(root):
+            for key in os.listdir(f"{root}/{prefix}"):
+                entry = f"{root}/{prefix}/{key}"
+                if key.endswith(".tmp") or not os.path.exists(
+                    f"{entry}/entry.json"):
+                    continue
+                result.append({"path": entry, "kind": kind,
+                    "size": _entry_size(entry),
+                    "atime": os.path.getmtime(f"{entry}/entry.json")})
+
+    return sorted(result, key=lambda x: x["atime"])
+
+def read_access_log(cache_dir: str) -> Dict[str, List[int]]:
+    """
+    Count the hits and misses of each kind of result.
+
+    Returns:
+        dict[str, list[int]]: Number of hits and misses of each kind.
+
+    Args:
+        cache_dir (str): Cache directory.
+    """
+    result = {x: [0, 0] for x in RESULT_KINDS}
+    fn = f"{cache_dir}/bam2gt/access.log"
+
+    if not os.path.exists(fn):
+        return result
+
+    with open(fn) as f:
+        for line in f:
+            # Compacted lines have a fifth column with the count.
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) not in (4, 5) or fields[1] not in result:
+                continue
+            count = int(fields[4]) if len(fields) == 5 else 1
+            result[fields[1]][0 if fields[3] == "hit" else 1] += count
+
+    return result
+
+def compact_access_log(cache_dir: str) -> None:
+    """
+    Replace the lines of the access log with the number of hits and
+    misses of each kind of result.
+
+    Args:
+        cache_dir (str): Cache directory.
+    """
+    fn = f"{cache_dir}/bam2gt/access.log"
+
+    if not os.path.exists(fn):
+        return
+
+    counts = read_access_log(cache_dir)
+    temp = f"{fn}.{os.getpid()}.tmp"
+    now = str(int(time.time()))
+
+    with open(temp, "w") as f:
+        for kind, (hits, misses) in counts.items():
+            f.write("\t".join([now, kind, "-", "hit", str(hits)]) + "\n")
+            f.write("\t".join([now, kind, "-", "miss", str(misses)]) + "\n")
+
+    os.replace(temp, fn)
+
+def evict(
+        cache_dir: str,
+        max_size: Optional[int] = None,
+        max_age: Optional[float] = None
+    ) -> List[Dict[str, object]]:
+    """
+    Remove cache entries by age and total size.
+
+    Entries that were not used for more than ``max_age`` seconds are
+    removed first, then the least recently used entries are removed until
+    the cache is not larger than ``max_size`` bytes. The access log is
+    compacted (see :func:`compact_access_log`), so that it does not grow
+    without limit.
+
+    Returns:
+        list[dict]: Removed entries (see :func:`list_entries`).
+
+    Args:
+        cache_dir (str): Cache directory.
+        max_size (int, optional): Maximum total size in bytes.
+        max_age (float, optional): Maximum time since last access in
+            seconds.
+    """
+    entries = list_entries(cache_dir)
+    total = sum([x["size"] for x in entries])
+    now = time.time()
+    removed = []
+
+    for x in entries:
+        too_old = max_age is not None and now - x["atime"] > max_age
+        too_big = max_size is not None and total > max_size
+        if not too_old and not too_big:
+            continue
+        # Rename first so that the entry disappears at once.
+        temp = f"{x['path']}.{os.getpid()}.tmp"
+        os.rename(x["path"], temp)
+        shutil.rmtree(temp)
+        total -= x["size"]
+        removed.append(x)
+
+    compact_access_log(cache_dir)
+
+    return removed
@@ -1,54 +1,149 @@
-import statistics
+import gzip
+from io import StringIO
+from typing import Optional, List, TextIO, Union
 
-from typing import Optional, List, TextIO
+import numpy as np
+import pandas as pd
+
+# Number of SDF lines processed at a time.
+CHUNK_SIZE = 50000
+
+def _format_means(total: np.ndarray, n: int) -> np.ndarray:
+    """Format mean depths exactly like round(statistics.mean(x), 2)."""
+    uniques, inverse = np.unique(total, return_inverse=True)
+    means = [str(x // n) if x % n == 0 else str(round(x / n, 2))
+        for x in uniques.tolist()]
+    return np.array(means, dtype=object)[inverse]
+
+def _format_values(x: np.ndarray) -> np.ndarray:
+    """Format depths rounded to two decimals (integers without decimals)."""
+    x = np.round(x, 2)
+    return np.where(x == np.floor(x), x.astype(np.int64).astype(str),
+        x.astype(str))
+
+def write_gdf_header(out: TextIO, id: List[str]) -> None:
+    """
+    Write the header line of GDF data.
+
+    Args:
+        out (TextIO): GDF data will be written to this handle.
+        id (list[str]): Sample ID(s).
+    """
+    out.write("\t".join(["Locus", "Total_Depth", "Average_Depth_sample"]
+        + [f"Depth_for_{x}" for x in id]) + "\n")
+
+def write_gdf_block(
+        out: TextIO,
+        contig: Union[str, pd.Series],
+        positions: Union[np.ndarray, pd.Series],
+        depth: np.ndarray
+    ) -> None:
+    """
+    Write a depth matrix as GDF data lines.
+
+    Depth may also be a float matrix (e.g. mean depth of bins), in which
+    case all values are rounded to two decimals.
+
+    Args:
+        out (TextIO): GDF data will be written to this handle.
+        contig (str or pandas.Series): Contig name(s).
+        positions (numpy.ndarray or pandas.Series): Positions.
+        depth (numpy.ndarray): Depth matrix (positions x samples).
+    """
+    depth = np.asarray(depth)
+    loci = contig + ":" + pd.Series(positions).astype(str)
+
+    if np.issubdtype(depth.dtype, np.integer):
+        depth = depth.astype(np.int64)
+        total = depth.sum(axis=1)
+        gdf = pd.DataFrame(depth)
+        average = _format_means(total, depth.shape[1])
+    else:
+        total = depth.sum(axis=1)
+        gdf = pd.DataFrame(_format_values(depth))
+        average = _format_values(total / depth.shape[1])
+        total = _format_values(total)
+
+    gdf.insert(0, "Locus", loci.to_numpy())
+    gdf.insert(1, "Total_Depth", total)
+    gdf.insert(2, "Average_Depth_sample", average)
+    gdf.to_csv(out, sep="\t", header=False, index=False)
+
+def write_gdf(
+        f: TextIO,
+        id: List[str],
+        out: TextIO,
+        chunk_size: int = CHUNK_SIZE
+    ) -> None:
+    """
+    Convert SDF data to GDF data in a streaming fashion.
+
+    SDF lines are read in chunks and their depth columns are parsed into
+    NumPy arrays, so memory usage does not depend on the region size.
+
+    Args:
+        f (TextIO): SDF data.
+        id (list[str]): Sample ID(s).
+        out (TextIO): GDF data will be written to this handle.
+        chunk_size (int): Number of lines processed at a time.
+    """
+
+    write_gdf_header(out, id)
+
+    try:
+        chunks = pd.read_csv(f, sep="\t", header=None, dtype={0: str},
+            chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        return
+
+    for chunk in chunks:
+        # Check the sample count.
+        if chunk.shape[1] - 2 != len(id):
+            raise ValueError("incorrect sample count")
+
+        write_gdf_block(out, chunk[0], chunk[1],
+            chunk.iloc[:, 2:].to_numpy(dtype=np.int64))
 
 def sdf2gdf(
         sdf_file: str,
         id: List[str],
-        f: Optional[TextIO] = None, 
+        f: Optional[TextIO] = None,
+        output: Optional[str] = None,
         **kwargs
-    ) -> str:
+    ) -> Optional[str]:
     """
     Create GDF file from SDF file.
 
     Returns:
-        str: GDF file.
+        str: GDF file, or None if it was written to ``output``.
 
     Args:
         sdf_file (str): SDF file.
         id (list[str]): Sample ID(s).
         f (TextIO, optional): SDF file.
+        output (str, optional): Write GDF data directly to this file
+            (gzip compressed if it ends with '.gz').
     """
 
     if sdf_file:
         f = open(sdf_file)
 
-    # Get the header.
-    result = "Locus\tTotal_Depth\tAverage_Depth_sample"
-    for x in id:
-        result += f"\tDepth_for_{x}"
-    result += "\n"
-
-    # Check the sample count with the first line.
-    fields1 = next(f).strip().split("\t")
-    if len(fields1) - 2 != len(id):
-        raise ValueError("incorrect sample count")
-    locus = f"{fields1[0]}:{fields1[1]}"
-    depth = [int(x) for x in fields1[2:]]
-    avg = round(statistics.mean(depth), 2)
-    fields2 = [locus, sum(depth), avg] + depth
-    result += "\t".join([str(x) for x in fields2]) + "\n"
-
-    # Read rest of the lines.
-    for line in f:
-        fields1 = line.strip().split("\t")
-        locus = f"{fields1[0]}:{fields1[1]}"
-        depth = [int(x) for x in fields1[2:]]
-        avg = round(statistics.mean(depth), 2)
-        fields2 = [locus, sum(depth), avg] + depth
-        result += "\t".join([str(x) for x in fields2]) + "\n"
+    if output is None:
+        out = StringIO()
+    elif output.endswith(".gz"):
+        out = gzip.open(output, "wt")
+    else:
+        out = open(output, "w")
 
-    if sdf_file:
-        f.close()
+    try:
+        write_gdf(f, id, out)
+    finally:
+        if sdf_file:
+            f.close()
+        if output is not None:
+            out.close()
+
+    if output is None:
+        return out.getvalue()
 
-    return result
+    return None
@@ -0,0 +1,230 @@
+"""
+Precompiled binary bundle of the Stargazer resource tables.
+
+The bundle stores the gene, SNP and star allele tables found in
+``resources/sg`` as one memory-mapped file with a per-gene index, so that
+the rows of a single gene can be loaded without parsing the text tables.
+It is created by running ``python -m pypgx.sgbundle`` (which is also done
+automatically when the package is built) and is only used for the bundled
+tables; custom table files are always read as text.
+
+The file layout is::
+
+    magic (4 bytes) | version (uint32) | index size (uint32) | index | data
+
+where the index is a JSON object with the header of each table and, for
+the gene table and the SNP and star allele rows of each gene, the offset
+and number of rows of an array of little-endian uint32 (offset, length)
+pairs, one pair per field. The offsets point into a pool of UTF-8 strings
+at the end of the data section, which is shared by all tables. Rows are
+therefore read in place from the memory map, without parsing text or
+unpickling objects.
+
+The bundle records the PyPGx version and the size of each text table it
+was compiled from, and is ignored if either differs.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .version import __version__
+
+BUNDLE_MAGIC = b"PGXB"
+BUNDLE_VERSION = 2
+BUNDLE_NAME = "sg_tables.bin"
+SOURCE_FILES = ["gene_table.txt", "snp_table.txt", "star_table.txt"]
+
+_HEADER = struct.Struct("<4sII")
+_ALIGN = 8
+
+def _pad(n: int) -> int:
+    return -n % _ALIGN
+
+def _sources(sg_dir: str) -> Dict[str, Optional[int]]:
+    result = {}
+    for x in SOURCE_FILES:
+        fn = os.path.join(sg_dir, x)
+        result[x] = os.path.getsize(fn) if os.path.exists(fn) else None
+    return result
+
+def compile_bundle(sg_dir: str, output_file: Optional[str] = None) -> str:
+    """
+    Compile the Stargazer tables into a binary bundle.
+
+    The tables are read with the readers of :mod:`pypgx.sglib`.
+
+    Returns:
+        str: Bundle file.
+
+    Args:
+        sg_dir (str): Directory containing the Stargazer tables.
+        output_file (str, optional): Bundle file [sg_dir/sg_tables.bin].
+    """
+    from .sglib import read_gene_table, read_snp_table, read_star_table
+
+    if output_file is None:
+        output_file = os.path.join(sg_dir, BUNDLE_NAME)
+
+    gene_table = read_gene_table(os.path.join(sg_dir, "gene_table.txt"))
+    tables = {
+        "snp_table": read_snp_table(
+            os.path.join(sg_dir, "snp_table.txt"), gene_table),
+        "star_table": read_star_table(os.path.join(sg_dir, "star_table.txt")),
+    }
+
+    pool = bytearray()
+    strings = {}
+    arrays = []
+    offset = 0
+
+    def add(rows):
+        nonlocal offset
+        header = list(next(iter(rows.values()))) if rows else []
+        fields = []
+        for row in rows.values():
+            for column in header:
+                x = row[column]
+                if x not in strings:
+                    data = x.encode()
+                    strings[x] = (len(pool), len(data))
+                    pool.extend(data)
+                fields.extend(strings[x])
+        array = np.array(fields, dtype="<u4").tobytes()
+        arrays.append(array)
+        offset += len(array)
+        return header, [offset - len(array), len(rows)]
+
+    index = {"pypgx": __version__, "sources": _sources(sg_dir),
+        "headers": {}, "gene_table": None, "snp_table": {},
+        "star_table": {}}
+
+    index["headers"]["gene_table"], index["gene_table"] = add(gene_table)
+
+    for name, table in tables.items():
+        for gene, rows in table.items():
+            header, index[name][gene] = add(rows)
+            if header:
+                index["headers"][name] = header
+
+    index["pool"] = offset
+    data = json.dumps(index).encode()
+    data += b" " * _pad(_HEADER.size + len(data))
+
+    with open(output_file, "wb") as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(data)))
+        f.write(data)
+        for array in arrays:
+            f.write(array)
+        f.write(pool)
+
+    return output_file
+
+class SGBundle:
+    """Memory-mapped bundle of the Stargazer tables.
+
+    Attributes:
+        fn (str): Bundle file.
+        index (dict): Headers, and offset and number of rows of each table
+            (and gene).
+    """
+    def __init__(self, fn: str) -> None:
+        self.fn = fn
+
+        with open(fn, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size = _HEADER.unpack_from(self._mm, 0)
+
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"Not a Stargazer bundle: {fn}")
+
+        if version != BUNDLE_VERSION:
+            raise ValueError(
+                f"Unsupported bundle version ({version}): {fn}")
+
+        start = _HEADER.size
+        self.index = json.loads(self._mm[start:start + size])
+        self._start = start + size
+        self._pool = memoryview(self._mm)[self._start + self.index["pool"]:]
+
+    def _load(self, name: str, entry) -> Dict[str, Dict[str, str]]:
+        header = self.index["headers"].get(name, [])
+        if not entry[1]:
+            return {}
+        fields = np.frombuffer(self._mm, dtype="<u4",
+            count=entry[1] * len(header) * 2, offset=self._start + entry[0])
+        pool = self._pool
+        values = [str(pool[x:x + n], "utf-8")
+            for x, n in fields.reshape(-1, 2).tolist()]
+        # Rows are keyed by the second column (gene name or SNP ID), except
+        # star alleles, which are keyed by the third.
+        key = 1 if name != "star_table" else 2
+        result = {}
+        for i in range(0, len(values), len(header)):
+            row = values[i:i + len(header)]
+            result[row[key]] = dict(zip(header, row))
+        return result
+
+    @property
+    def genes(self) -> List[str]:
+        return list(self.index["star_table"])
+
+    def gene_table(self) -> Dict[str, Dict[str, str]]:
+        """Get gene table object."""
+        return self._load("gene_table", self.index["gene_table"])
+
+    def snp_table(self, tg: str) -> Dict[str, Dict[str, str]]:
+        """Get the SNP table rows of target gene (empty if none)."""
+        if tg not in self.index["snp_table"]:
+            return {}
+        return self._load("snp_table", self.index["snp_table"][tg])
+
+    def star_table(self, tg: str) -> Dict[str, Dict[str, str]]:
+        """Get the star allele table rows of target gene."""
+        return self._load("star_table", self.index["star_table"][tg])
+
+    def is_current(self, sg_dir: str) -> bool:
+        """Check whether the bundle was compiled by this PyPGx version from
+        tables of the same size as those in sg_dir (without reading them)."""
+        return (self.index["pypgx"] == __version__
+            and self.index["sources"] == _sources(sg_dir))
+
+def open_bundle(sg_dir: str) -> Optional[SGBundle]:
+    """
+    Open the bundle in sg_dir if it exists and is up to date.
+
+    Returns:
+        SGBundle: Bundle object, or None if the text tables should be used.
+
+    Args:
+        sg_dir (str): Directory containing the Stargazer tables.
+    """
+
+    fn = os.path.join(sg_dir, BUNDLE_NAME)
+
+    if not os.path.exists(fn):
+        return None
+
+    try:
+        bundle = SGBundle(fn)
+    except (ValueError, struct.error):
+        return None
+
+    if not bundle.is_current(sg_dir):
+        return None
+
+    return bundle
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sg_dir = sys.argv[1]
+    else:
+        sg_dir = os.path.join(os.path.dirname(__file__), "resources", "sg")
+
+    print(compile_bundle(sg_dir))
@@ -3,13 +3,32 @@
 # Email: sbstevenlee@gmail.com
 # Last updated: 2020-08-06 14:04
 
+import os
+import re
+import sys
+import json
 import gzip
+import hashlib
+import tempfile
 import pandas as pd
 import statistics
-from typing import List, Dict, TextIO, Optional
-from copy import deepcopy
+from types import MappingProxyType
+from functools import lru_cache
+from typing import List, Dict, TextIO, Optional, Iterator, NamedTuple, Tuple
 from vcfgo.VCFFile import VCFFile
 
+# Read-only row shared by SNPAllele objects without SNP table data.
+EMPTY_DATA = MappingProxyType({})
+
+# Directory of the gene offset indexes of table files.
+TABLE_INDEX_DIR = os.environ.get("PYPGX_TABLE_INDEX",
+    os.path.join(os.path.expanduser("~"), ".cache", "pypgx", "table_index"))
+
+# Maximum number of distinct haplotype names kept by parse_haplotype.
+HAPLOTYPE_CACHE_SIZE = 4096
+
+_NON_DIGITS = re.compile(r"\D")
+
 class SNPAllele:
     """SNP allele object.
 
@@ -28,7 +47,11 @@ class SNPAllele:
        vi (str): Variant impact.
        rv (str): Reverting variant.
        gb (str): Genome build.
+       data (dict[str, str]): SNP table row, shared by reference.
     """
+    __slots__ = ("pos", "wt", "var", "rs", "het", "ad", "td", "n", "hg",
+                 "so", "fe", "vi", "rv", "gb", "data")
+
     def __init__(self):
         self.pos = ''
         self.wt = ''
@@ -44,7 +67,7 @@ class SNPAllele:
         self.vi = ''
         self.rv = ''
         self.gb = ''
-        self.data = {}
+        self.data = EMPTY_DATA
 
     @property
     def key(self):
@@ -75,6 +98,8 @@ class SNPAllele:
         )
 
 class StarAllele:
+    __slots__ = ("name", "score", "core", "tag", "sv")
+
     def __init__(self):
         self.name = ''
         self.score = -100.0
@@ -114,6 +139,8 @@ class StarAllele:
         return hash(self.name)
 
 class BioHaplotype:
+    __slots__ = ("cand", "obs", "start", "end")
+
     def __init__(self):
         self.cand = []
         self.obs = []
@@ -173,7 +200,7 @@ class BioHaplotype:
         sY = StarAllele()
         sY.name = name
         sY.score = sX.score * cn
-        sY.core = deepcopy(sX.core)
+        sY.core = list(sX.core)
         sY.sv = "cnv{}".format(cn)
         
         self.cand.insert(0, sY)
@@ -201,6 +228,12 @@ def vcf2biosamples(vcf: VCFFile,
                    filter: bool = False) -> List[BioSample]:
     """Convert a VCFFile to a list of BioSample.
 
+    Record-level data (position, alleles and annotations) is parsed once
+    and shared by all samples, and annotation strings are interned. Each
+    sample-record then costs two SNPAllele objects, which is about 200
+    bytes each on CPython 3 (i.e. ~0.4 KB per sample-record, or ~1.2 GB
+    for 3,000 samples x 1,000 records).
+
     Returns:
         A list of BioSample.
 
@@ -210,26 +243,42 @@ def vcf2biosamples(vcf: VCFFile,
     """
 
     result = []
+    gb = sys.intern(vcf.search_meta("genome_build"))
+    records = []
+
+    def f(x):
+        return [sys.intern(y) for y in ["NA"] + x.split(",")]
+
+    for v in vcf.data:
+        if filter and "D" not in v.info["PS"]:
+            continue
+
+        records.append((
+            v,
+            str(v.pos),
+            [v.ref] + v.alt,
+            f(v.info["VI"]),
+            f(v.info["SO"]),
+            f(v.info["FE"]),
+            f(v.info["RV"]),
+            "AD" in v.format,
+        ))
 
     for name in vcf.header[9:]:
         biosample = BioSample(name)
         i = vcf.header.index(name)
 
-        for v in vcf.data:
-            if filter and "D" not in v.info["PS"]:
-                continue
+        for v, pos, alleles, vi, so, fe, rv, has_ad in records:
+            fields = v.fields[i].split(":")
+            gt = [int(x) for x in fields[0].split("|")]
 
-            gt = [int(x) for x in v.fields[i].split(":")[0].split("|")]
-            alleles = [v.ref] + v.alt
-            vi = ["NA"] + v.info["VI"].split(",")
-            so = ["NA"] + v.info["SO"].split(",")
-            fe = ["NA"] + v.info["FE"].split(",")
-            rv = ["NA"] + v.info["RV"].split(",")
+            if has_ad:
+                ad = [int(x) for x in fields[1].split(",")]
 
             for j in [0, 1]:
                 k = gt[j]
                 snpallele = SNPAllele()
-                snpallele.pos = str(v.pos)
+                snpallele.pos = pos
                 snpallele.wt = v.ref
                 snpallele.var = alleles[k]
                 snpallele.rs = v.id
@@ -238,10 +287,9 @@ def vcf2biosamples(vcf: VCFFile,
                 snpallele.vi = vi[k]
                 snpallele.fe = fe[k]
                 snpallele.rv = rv[k]
-                snpallele.gb = vcf.search_meta("genome_build")
+                snpallele.gb = gb
 
-                if "AD" in v.format:
-                    ad = [int(x) for x in v.fields[i].split(":")[1].split(",")]
+                if has_ad:
                     snpallele.ad = ad[k]
                     snpallele.td = sum(ad)
 
@@ -251,6 +299,56 @@ def vcf2biosamples(vcf: VCFFile,
 
     return result
 
+class Haplotype(NamedTuple):
+    """Parsed haplotype name.
+
+    Attributes:
+        name (str): Haplotype name (e.g. '*36+*10x2').
+        components (tuple[tuple[str, int], ...]): Star alleles and their
+            copy numbers (e.g. (('*36', 1), ('*10', 2))).
+        sort_key (tuple[int, int, int]): Key used by ``sort_star_names``.
+    """
+    name: str
+    components: Tuple[Tuple[str, int], ...]
+    sort_key: Tuple[int, int, int]
+
+@lru_cache(maxsize=HAPLOTYPE_CACHE_SIZE)
+def parse_haplotype(name: str) -> Haplotype:
+    """
+    Parse haplotype name.
+
+    Haplotype names consist of one or more star alleles joined by '+',
+    each of which may carry a copy number after 'x' (e.g. '*2x2',
+    '*4+*10', '*36+*10x2'). Results are cached, so each distinct name is
+    parsed only once.
+
+    Returns:
+        Haplotype: Parsed haplotype.
+
+    Args:
+        name (str): Haplotype name.
+
+    Examples:
+
+        >>> print(parse_haplotype("*36+*10x2").components)
+        (('*36', 1), ('*10', 2))
+    """
+
+    components = []
+
+    for component in name.split("+"):
+        star, x, cn = component.partition("x")
+        components.append((star, int(cn.split("x")[0]) if x else 1))
+
+    digits = _NON_DIGITS.sub("", components[0][0])
+
+    if "*" not in name or name == "*DEL" or not digits:
+        sort_key = (999, 1, len(name))
+    else:
+        sort_key = (int(digits), components[0][1], len(name))
+
+    return Haplotype(name, tuple(components), sort_key)
+
 def sort_star_names(names: List[str]) -> List[str]:
     """
     Sort star names.
@@ -273,22 +371,7 @@ def sort_star_names(names: List[str]) -> List[str]:
         ['*3+*5', '*4']
     """
 
-    def f(name):
-        cn = 1
-
-        if "*" not in name or name == "*DEL":
-            n = 999
-
-        else:
-            _ = name.split("+")[0].split("x")[0]
-            n = int("".join([x for x in _ if x.isdigit()]))
-
-            if "x" in name.split("+")[0]:
-                cn = int(name.split("+")[0].split("x")[1])
-
-        return (n, cn, len(name))
-
-    return sorted(names, key = f)
+    return sorted(names, key = lambda x: parse_haplotype(x).sort_key)
 
 def parse_region(
         region: str,
@@ -374,6 +457,115 @@ def read_sv_table(fn):
 
     return result
 
+def index_table(fn: str) -> Dict[str, List[List[int]]]:
+    """
+    Build gene offset index for table file.
+
+    The index maps each gene (i.e. the first column) to the byte ranges
+    of its rows, so that the rows of a single gene can be read without
+    parsing the whole table.
+
+    Returns:
+        dict[str, list[list[int]]]: Byte ranges of the header and each gene.
+
+    Args:
+        fn (str): Table file.
+    """
+
+    result = {"header": None, "genes": {}}
+
+    with open(fn, "rb") as f:
+        data = f.read()
+
+    offset = 0
+
+    for line in data.splitlines(keepends=True):
+        start = offset
+        offset += len(line)
+
+        if result["header"] is None:
+            result["header"] = [start, offset]
+            continue
+
+        gene = line.split(b"\t", 1)[0].strip().decode()
+        ranges = result["genes"].setdefault(gene, [])
+
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = offset
+        else:
+            ranges.append([start, offset])
+
+    return result
+
+def read_table_index(fn: str) -> Dict[str, List[List[int]]]:
+    """
+    Read gene offset index for table file.
+
+    The index is cached in TABLE_INDEX_DIR (set with the
+    ``PYPGX_TABLE_INDEX`` environment variable) under a name derived from
+    the path of the table, and rebuilt whenever the size or modification
+    time of the table changes. It is written to a temporary file which is
+    then renamed, so that concurrent processes never read a partial index.
+    If the directory is not writable, the index is rebuilt in memory.
+
+    Returns:
+        dict[str, list[list[int]]]: Byte ranges of the header and each gene.
+
+    Args:
+        fn (str): Table file.
+    """
+
+    st = os.stat(fn)
+    stamp = [st.st_size, st.st_mtime_ns]
+    name = hashlib.sha1(os.path.realpath(fn).encode()).hexdigest()
+    idx_file = os.path.join(TABLE_INDEX_DIR, f"{name}.idx")
+
+    try:
+        with open(idx_file) as f:
+            result = json.load(f)
+        if result["stamp"] == stamp:
+            return result
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = index_table(fn)
+    result["stamp"] = stamp
+
+    try:
+        os.makedirs(TABLE_INDEX_DIR, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=TABLE_INDEX_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.replace(temp_file, idx_file)
+        except OSError:
+            os.remove(temp_file)
+            raise
+    except OSError:
+        pass
+
+    return result
+
+def _read_table_lines(
+        fn: str,
+        genes: Optional[List[str]] = None
+    ) -> Iterator[str]:
+    """Yield the header and rows of table file (only the given genes)."""
+    if genes is None:
+        with open(fn) as f:
+            yield from f
+        return
+
+    index = read_table_index(fn)
+
+    with open(fn, "rb") as f:
+        ranges = [index["header"]]
+        for gene in genes:
+            ranges += index["genes"].get(gene, [])
+        for start, end in ranges:
+            f.seek(start)
+            yield from f.read(end - start).decode().splitlines()
+
 def read_gene_table(
         fn: str
     ) -> Dict[str, Dict[str, str]]:
@@ -407,7 +599,8 @@ def read_gene_table(
 
 def read_snp_table(
         fn: str,
-        gene_table: Dict[str, Dict[str, str]]
+        gene_table: Dict[str, Dict[str, str]],
+        genes: Optional[List[str]] = None
     ) -> Dict[str, Dict[str, Dict[str, str]]]:
     """
     Read SNP table file.
@@ -418,6 +611,8 @@ def read_snp_table(
     Args:
         fn (str): SNP table file.
         gene_table (dict[str, dict[str, str]]): Gene table object.
+        genes (list[str], optional): Only read the rows of these genes,
+            using the gene offset index (see ``read_table_index``).
 
     Examples:
 
@@ -429,21 +624,22 @@ def read_snp_table(
 
     result = {}
 
-    with open(fn) as f:
-        header = next(f).strip().split("\t")
+    lines = _read_table_lines(fn, genes)
+    header = next(lines).strip().split("\t")
 
-        for line in f:
-            fields = line.strip().split("\t")
-            gene = fields[0]
-            sg_id = fields[1]
+    for line in lines:
+        fields = line.strip().split("\t")
+        gene = fields[0]
+        sg_id = fields[1]
 
-            if gene not in result:
-                result[gene] = {}
+        if gene not in result:
+            result[gene] = {}
 
-            result[gene][sg_id] = dict(zip(header, fields))
+        result[gene][sg_id] = dict(zip(header, fields))
 
     target_genes = [
-        x for x in gene_table if gene_table[x]["type"] == "target"]
+        x for x in gene_table if gene_table[x]["type"] == "target"
+        and (genes is None or x in genes)]
 
     for target_gene in target_genes:
         if target_gene not in result:
@@ -452,7 +648,8 @@ def read_snp_table(
     return result
 
 def read_star_table(
-        fn: str
+        fn: str,
+        genes: Optional[List[str]] = None
     ) -> Dict[str, Dict[str, Dict[str, str]]]:
     """
     Read star table file.
@@ -462,6 +659,8 @@ def read_star_table(
 
     Args:
         fn (str): Star table file.
+        genes (list[str], optional): Only read the rows of these genes,
+            using the gene offset index (see ``read_table_index``).
 
     Examples:
 
@@ -472,15 +671,15 @@ def read_star_table(
 
     result = {}
 
-    with open(fn) as f:
-        header = next(f).strip().split("\t")
-        for line in f:
-            fields = line.strip().split("\t")
-            gene = fields[0]
-            name = fields[2]
-            if gene not in result:
-                result[gene] = {}
-            result[gene][name] = dict(zip(header, fields))
+    lines = _read_table_lines(fn, genes)
+    header = next(lines).strip().split("\t")
+    for line in lines:
+        fields = line.strip().split("\t")
+        gene = fields[0]
+        name = fields[2]
+        if gene not in result:
+            result[gene] = {}
+        result[gene][name] = dict(zip(header, fields))
 
     return result
 
@@ -511,11 +710,11 @@ def build_snpdb(
         snpallele.hg = v[f'{gb}_allele']
         snpallele.var = v['var_allele']
         snpallele.wt = v['wt_allele']
-        snpallele.fe = v['functional_effect']
-        snpallele.so = v['sequence_ontology']
-        snpallele.vi = v['variant_impact']
-        snpallele.rv = v[f'{gb}_revertant']
-        snpallele.gb = gb
+        snpallele.fe = sys.intern(v['functional_effect'])
+        snpallele.so = sys.intern(v['sequence_ontology'])
+        snpallele.vi = sys.intern(v['variant_impact'])
+        snpallele.rv = sys.intern(v[f'{gb}_revertant'])
+        snpallele.gb = sys.intern(gb)
         snpallele.data = v
         result.append(snpallele)
 
@@ -530,6 +729,11 @@ def build_stardb(
     """
     Build StarAllele database for target gene.
 
+    Star allele definitions are resolved through a hash index of the
+    SNPAllele objects, and the core/tag lists of each StarAllele object
+    reference (rather than copy) the objects in snpdb. These shared objects
+    must be treated as read-only.
+
     Returns:
         dict[str, StarAllele]: StarAllele objects.
 
@@ -552,6 +756,16 @@ def build_stardb(
 
     result = {}
 
+    # Index the SNP alleles by their definition string (e.g. '42522613:C>G').
+    index = {}
+
+    for i, x in enumerate(snpdb):
+        index[f"{x.pos}:{x.wt}>{x.var}"] = (i, x)
+
+    def resolve(definition):
+        hits = [index[x] for x in definition.split(",") if x in index]
+        return [x for i, x in sorted(hits, key=lambda y: y[0])]
+
     for k, v in star_table[tg].items():
         if v[f"{gb}_has"] == "no":
             continue
@@ -563,18 +777,12 @@ def build_stardb(
         if v[f"{gb}_core"] in ["ref", "."]:
             starallele.core = []
         else:
-            starallele.core = deepcopy([
-                x for x in snpdb
-                if f"{x.pos}:{x.wt}>{x.var}"  in v[f"{gb}_core"].split(",")
-            ])
+            starallele.core = resolve(v[f"{gb}_core"])
 
         if v[f"{gb}_tag"] == ".":
             starallele.tag = []
         else:
-            starallele.tag = deepcopy([
-                x for x in snpdb
-                if f"{x.pos}:{x.wt}>{x.var}" in v[f"{gb}_tag"].split(",")
-            ])
+            starallele.tag = resolve(v[f"{gb}_tag"])
 
         if v["sv"] == ".":
             starallele.sv = ""
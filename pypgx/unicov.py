@@ -1,36 +1,208 @@
-import pysam
+import numpy as np
 import pandas as pd
-from typing import Optional, List
-from io import StringIO
-from .common import bam_getter, sm_tag
+from multiprocessing import Pool
+from typing import Optional, List, Tuple
+from .common import bam_getter, bam_headers, get_gene_table, setup_ref_cache
+from .coverage import read_bed, split_intervals, depth_counts
 
 COVERAGES = [1, 10, 20, 30, 40, 50, 100, 200, 300, 400, 500, 1000]
 
+# Minimum number of positions per shard when running in parallel.
+MIN_SHARD_SIZE = 100000
+
+def uniformity(counts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """
+    Compute % of positions at or above each coverage.
+
+    Returns:
+        numpy.ndarray: Percentages (same shape as counts).
+
+    Args:
+        counts (numpy.ndarray): Number of positions at or above each
+            coverage (regions x coverages).
+        sizes (numpy.ndarray): Number of positions of each region.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return counts / sizes[..., None] * 100
+
+def _gene_regions(genome_build: str) -> List[Tuple[str, str, int, int]]:
+    gene_table = get_gene_table()
+    result = []
+    for k, v in gene_table.items():
+        if v["type"] != "target":
+            continue
+        contig, coords = v[f"{genome_build}_region"].split(":")
+        start, end = [int(x) for x in coords.split("-")]
+        result.append((k, contig.replace("chr", ""), start, end))
+    return result
+
+def _make_pieces(intervals, genes):
+    """Split intervals at gene boundaries and assign genes to pieces."""
+    pieces = []
+    owners = []
+    contigs = {}
+
+    for j, x in enumerate(genes):
+        contigs.setdefault(x[1], []).append((j, x[2], x[3]))
+
+    for i, (contig, start, end) in enumerate(intervals):
+        overlaps = [(j, max(start, gs), min(end, ge))
+            for j, gs, ge in contigs.get(contig.replace("chr", ""), [])
+            if gs <= end and start <= ge]
+        cuts = {start, end + 1}
+        for j, s, e in overlaps:
+            cuts.update([s, e + 1])
+        cuts = sorted(cuts)
+        for s, e in zip(cuts[:-1], cuts[1:]):
+            members = [j for j, gs, ge in overlaps if gs <= s and e - 1 <= ge]
+            for x in split_intervals([(contig, s, e - 1)]):
+                pieces.append(x)
+                owners.append((i, members))
+
+    return pieces, owners
+
+def _make_shards(pieces, threads):
+    total = sum([x[2] - x[1] + 1 for x in pieces])
+    size = max(MIN_SHARD_SIZE, -(-total // (threads * 4)))
+    shards = [[]]
+    n = 0
+    for i, x in enumerate(pieces):
+        if n >= size:
+            shards.append([])
+            n = 0
+        shards[-1].append(i)
+        n += x[2] - x[1] + 1
+    return shards
+
+def _unicov_task(args) -> np.ndarray:
+    bam_file, pieces, coverages, reference = args
+    return depth_counts(bam_file, pieces, coverages, reference=reference)
+
+def _write_rows(f, name, labels, sizes, percs):
+    for label, size, x in zip(labels, sizes, percs):
+        fields = [name, label, str(size)] + [f"{y:.2f}" for y in x]
+        f.write("\t".join(fields) + "\n")
+
 @bam_getter
-def unicov(bed_file,
+def unicov(bed_file: str,
            bam_file: List[str],
            bam_dir: Optional[str] = None,
            bam_list: Optional[str] = None,
-           **kwargs):
+           coverages: Optional[List[int]] = None,
+           threads: int = 1,
+           region_file: Optional[str] = None,
+           gene_file: Optional[str] = None,
+           genome_build: str = "hg19",
+           fasta_file: Optional[str] = None,
+           **kwargs) -> str:
+    """
+    Compute the uniformity of sequencing coverage.
+
+    Depth of every position in the BED regions (like ``samtools depth -a
+    -b``) is reduced to the number of positions at or above each coverage.
+    The regions are split into shards that are processed in a pool of
+    worker processes, and the counts are summed into global, per-region
+    and per-gene (target genes of the gene table) results.
+
+    Returns:
+        str: Table with one row per coverage and one column per sample.
+
+    Args:
+        bed_file (str): BED file.
+        bam_file (list[str]): Input BAM/CRAM files.
+        bam_dir (str, optional): Use all BAM/CRAM files in this directory
+            as input.
+        bam_list (str, optional): List of input BAM/CRAM files, one file
+            per line.
+        coverages (list[int], optional): Coverages [COVERAGES].
+        threads (int): Number of worker processes.
+        region_file (str, optional): Write per-region results to this file.
+        gene_file (str, optional): Write per-gene results to this file.
+        genome_build (str): Genome build of the BED file ('hg19' or
+            'hg38'), used to find target genes.
+        fasta_file (str, optional): Reference FASTA file used to decode
+            CRAM files.
+    """
 
     input_files = kwargs["input_files"]
-    names = [sm_tag(x) for x in input_files]
-    s = pysam.depth("-a", "-b", bed_file, *input_files)
-    f = StringIO(s)
-    df = pd.read_table(f)
-    df.columns = ["chr", "pos"] + names
-    size = df.shape[0]
+    setup_ref_cache(input_files, fasta_file)
+    names = [x.sample for x in bam_headers(input_files)]
+
+    if coverages is None:
+        coverages = COVERAGES
+
+    coverages = sorted(coverages)
+    intervals = read_bed(bed_file)
+    genes = _gene_regions(genome_build) if gene_file else []
+    pieces, owners = _make_pieces(intervals, genes)
+    shards = _make_shards(pieces, threads)
+
+    piece_sizes = np.array([x[2] - x[1] + 1 for x in pieces])
+    piece_regions = np.array([x[0] for x in owners], dtype=np.int64)
+    region_sizes = np.array([x[2] - x[1] + 1 for x in intervals])
+    gene_sizes = np.zeros(len(genes), dtype=np.int64)
+    for size, (i, members) in zip(piece_sizes, owners):
+        gene_sizes[members] += size
+
+    # Only report genes covered by the BED file.
+    covered = np.flatnonzero(gene_sizes)
+
+    tasks = [(x, [pieces[i] for i in shard], coverages, fasta_file)
+        for x in input_files for shard in shards]
+
+    files = {}
+    header = [str(x) for x in coverages]
+
+    if region_file:
+        files["region"] = open(region_file, "w")
+        files["region"].write("\t".join(
+            ["sample", "region", "size"] + header) + "\n")
+
+    if gene_file:
+        files["gene"] = open(gene_file, "w")
+        files["gene"].write("\t".join(
+            ["sample", "gene", "size"] + header) + "\n")
+
+    labels = [f"{x[0]}:{x[1]}-{x[2]}" for x in intervals]
+    total = np.zeros((len(input_files), len(coverages)), dtype=np.int64)
+    p = None
+
+    try:
+        if threads > 1 and len(tasks) > 1:
+            p = Pool(min(threads, len(tasks)))
+            results = p.imap(_unicov_task, tasks)
+        else:
+            results = map(_unicov_task, tasks)
+
+        for i, name in enumerate(names):
+            counts = np.concatenate([next(results) for x in shards])
+            total[i] = counts.sum(axis=0)
 
-    dat = {"coverage": COVERAGES}
+            if region_file:
+                region_counts = np.zeros(
+                    (len(intervals), len(coverages)), dtype=np.int64)
+                np.add.at(region_counts, piece_regions, counts)
+                _write_rows(files["region"], name, labels, region_sizes,
+                    uniformity(region_counts, region_sizes))
 
-    for name in names:
-        percs = []
+            if gene_file:
+                gene_counts = np.zeros(
+                    (len(genes), len(coverages)), dtype=np.int64)
+                for j, (k, members) in enumerate(owners):
+                    gene_counts[members] += counts[j]
+                _write_rows(files["gene"], name,
+                    [genes[j][0] for j in covered], gene_sizes[covered],
+                    uniformity(gene_counts[covered], gene_sizes[covered]))
+    finally:
+        if p is not None:
+            p.terminate()
+        for f in files.values():
+            f.close()
 
-        for coverage in COVERAGES:
-            count = sum(df[name] >= coverage)
-            perc = count / size * 100
-            percs.append(perc)
+    dat = {"coverage": coverages}
 
+    for name, percs in zip(names, uniformity(total, region_sizes.sum())):
         dat[name] = percs
 
     df = pd.DataFrame(dat)
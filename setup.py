@@ -1,9 +1,29 @@
+import os
+import sys
+import warnings
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 exec(open("pypgx/version.py").read())
 
-requirements = ["requests>=2", "pandas>=1.0.0", "bs4>=0.0.1", "lxml>=4.5.0",
-                "pysam>=0.16.0", "vcfgo>=0.0.10",]
+class BuildPyCommand(build_py):
+    """Compile the Stargazer tables into a binary bundle after copying."""
+    def run(self):
+        super().run()
+        # The tables are read with pypgx.sglib, which needs the
+        # dependencies; without them the text tables are used instead.
+        sys.path.insert(0, os.path.abspath(self.build_lib))
+        try:
+            from pypgx.sgbundle import compile_bundle
+            compile_bundle(
+                os.path.join(self.build_lib, "pypgx", "resources", "sg"))
+        except ImportError as e:
+            warnings.warn(f"Skipped the Stargazer bundle ({e})")
+        finally:
+            sys.path.pop(0)
+
+requirements = ["requests>=2", "numpy>=1.15.0", "pandas>=1.0.0", "bs4>=0.0.1",
+                "lxml>=4.5.0", "pysam>=0.16.0", "vcfgo>=0.0.10",]
 
 setup(
     name="pypgx",
@@ -14,17 +34,19 @@ setup(
     long_description=open("README.rst").read(),
     long_description_content_type="text/x-rst",
     url="https://github.com/sbslee/pypgx",
-    packages=find_packages(exclude=["tests"]),
+    packages=find_packages(exclude=["tests", "benchmarks"]),
     package_data={
         "pypgx.resources.cpic": ["cpicPairs.csv"],
         "pypgx.resources.sg": [
             "gene_table.txt",
             "snp_table.txt",
             "star_table.txt",
+            "sg_tables.bin",
         ],
         "pypgx.resources.pgkb": ["action_table.txt"],
     },
     install_requires=requirements,
+    cmdclass={"build_py": BuildPyCommand},
     classifiers=[
         "Programming Language :: Python :: 3.6",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
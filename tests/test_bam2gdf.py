@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pysam
+
+import pypgx.bam2gdf
+import pypgx.coverage
+from pypgx.bam2gdf import bam2gdf, _plan_pieces
+
+def test_plan_pieces():
+    intervals = [("22", 1, 100), ("12", 1, 30)]
+    bins = {"22:1-60": [(1, 20), (21, 45), (46, 60)], "22:50-100": None,
+        "12:1-30": None}
+    pieces = _plan_pieces(intervals, bins, 30)
+    # The bin 21-45 is not split, so the first piece is extended.
+    assert pieces == [("22", 1, 45), ("22", 46, 75), ("22", 76, 100),
+        ("12", 1, 30)]
+
+def _make_bam(fn, sample):
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": "22", "LN": 50000000}],
+        "RG": [{"ID": sample, "SM": sample}]}
+    with pysam.AlignmentFile(fn, "wb", header=header) as f:
+        for i in range(10):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.cigarstring = "100M"
+            a.query_sequence = "A" * 100
+            a.reference_id = 0
+            a.reference_start = i * 20
+            a.mapping_quality = 60
+            a.set_tag("RG", sample)
+            f.write(a)
+    pysam.index(fn)
+
+def test_bam2gdf_opens(tmp_path, monkeypatch):
+    bams = [str(tmp_path / f"{x}.bam") for x in ["s1", "s2"]]
+    for bam in bams:
+        _make_bam(bam, bam[-6:-4])
+    opens = []
+    def AlignmentFile(fn, *args, **kwargs):
+        opens.append(fn)
+        return pysam.AlignmentFile(fn, *args, **kwargs)
+    monkeypatch.setattr(pypgx.coverage, "pysam",
+        SimpleNamespace(AlignmentFile=AlignmentFile))
+    outputs = []
+    for cells in [1 << 26, 2000]:
+        # With 2000 cells, the regions are split into dozens of pieces.
+        monkeypatch.setattr(pypgx.bam2gdf, "MAX_DEPTH_CELLS", cells)
+        output_file = str(tmp_path / f"{cells}.gdf")
+        bam2gdf(genome_build="hg19", target_gene="cyp2d6",
+            control_gene="22:1-300", output_file=output_file, bam_file=bams)
+        outputs.append(open(output_file).read())
+    assert sorted(opens) == sorted(bams * 2)
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,43 @@
+import shutil
+
+import pypgx.bam2gt
+from pypgx.bam2gt import _unique_files, _result_key, _metadata, _copy_tree
+from pypgx.resultcache import store_entry
+
+def test_unique_files(tmp_path, monkeypatch):
+    a = tmp_path / "a.bam"
+    b = tmp_path / "b.bam"
+    c = tmp_path / "c.bam"
+    a.write_bytes(b"a" * 100)
+    b.write_bytes(b"b" * 100)
+    shutil.copy(a, c)
+    # Pretend that the sampled fingerprints of all files collide.
+    monkeypatch.setattr(pypgx.bam2gt, "bam_fingerprint", lambda x: "same")
+    assert _unique_files([str(a), str(b), str(c)]) == [str(a), str(b)]
+
+def test_copy_tree(tmp_path):
+    src = tmp_path / "src"
+    (src / "plot").mkdir(parents=True)
+    (src / "genotype.txt").write_text("gt")
+    (src / "plot" / "a.png").write_text("png")
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (dst / "other.txt").write_text("x")
+    _copy_tree(str(src), str(dst))
+    assert (dst / "genotype.txt").read_text() == "gt"
+    assert (dst / "plot" / "a.png").exists() and (dst / "other.txt").exists()
+
+def test_result_key(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    a = tmp_path / "a.bam"
+    b = tmp_path / "b.bam"
+    a.write_bytes(b"a" * 100)
+    b.write_bytes(b"b" * 100)
+    monkeypatch.setattr(pypgx.bam2gt, "bam_fingerprint", lambda x: "same")
+    key = _result_key(cache_dir, "vcf", {}, [str(a)])
+    vcf_file = tmp_path / "pypgx.vcf"
+    vcf_file.write_text("vcf")
+    store_entry(cache_dir, "vcf", key, [str(vcf_file)], _metadata([str(a)]))
+    assert _result_key(cache_dir, "vcf", {}, [str(a)]) == key
+    # A different file with the same fingerprint does not reuse the entry.
+    assert _result_key(cache_dir, "vcf", {}, [str(b)]) != key
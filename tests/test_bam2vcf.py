@@ -0,0 +1,49 @@
+import subprocess
+
+import pytest
+
+from pypgx.bam2vcf import (
+    _job_java_options,
+    _make_shards,
+    _split_vcf,
+    _run_pipeline,
+    MIN_JAVA_HEAP,
+)
+
+def test_job_java_options():
+    assert _job_java_options("-Xmx4G", 8) == "-Xmx4G"
+    heap = int(_job_java_options(None, 1000000)[4:-1])
+    assert heap == MIN_JAVA_HEAP
+    assert _job_java_options("-XX:+UseSerialGC", 1).endswith(" -XX:+UseSerialGC")
+
+def test_make_shards():
+    assert _make_shards([("chr22", 1001, 1100)], 4) == [[("chr22", 1001, 1100)]]
+    shards = _make_shards([("chr22", 42512500, 42551883)], 4)
+    assert shards[0] == [("chr22", 42512500, 42522345)]
+    assert shards[-1][0][2] == 42551883 and len(shards) == 4
+    intervals = [("chr1", 1, 3000), ("chr1", 5001, 8000), ("chr2", 1, 6000)]
+    shards = _make_shards(intervals, 2)
+    assert shards == [[("chr1", 1, 3000), ("chr1", 5001, 8000)],
+        [("chr2", 1, 6000)]]
+
+def test_split_vcf(tmp_path):
+    vcf_file = str(tmp_path / "in.vcf")
+    with open(vcf_file, "w") as f:
+        f.write("##fileformat=VCFv4.2\n#CHROM\tPOS\n")
+        f.write("chr1\t10\n" "chr1\t25\n" "chr2\t10\n")
+    _split_vcf(vcf_file, {"a": "chr1:1-20", "b": "chr1:20-30"}, str(tmp_path))
+    with open(tmp_path / "a.vcf") as f:
+        assert f.read().splitlines()[2:] == ["chr1\t10"]
+    with open(tmp_path / "b.vcf") as f:
+        assert f.read().splitlines() == [
+            "##fileformat=VCFv4.2", "#CHROM\tPOS", "chr1\t25"]
+
+def test_run_pipeline(tmp_path):
+    out = str(tmp_path / "out.txt")
+    _run_pipeline([["printf", "b\\na\\n"], ["sort"], ["tee", out]])
+    with open(out) as f:
+        assert f.read() == "a\nb\n"
+    # The failed command is reported, not the one stopped by SIGPIPE.
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        _run_pipeline([["yes"], ["false"]])
+    assert e.value.cmd == ["false"]
@@ -0,0 +1,34 @@
+import os
+import stat
+import subprocess
+
+from pypgx.bam2vcf2 import _haplotypecaller_shell
+
+def _run_shell(tmp_path, status):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    gatk = bin_dir / "gatk"
+    gatk.write_text("#!/bin/bash\n"
+        "out=$(echo \"$@\" | sed 's/.* -O \\([^ ]*\\).*/\\1/')\n"
+        "echo partial > $out\n"
+        "echo partial > $out.idx\n"
+        f"exit {status}\n")
+    gatk.chmod(gatk.stat().st_mode | stat.S_IEXEC)
+    temp_file = str(tmp_path / "0.g.vcf")
+    gvcf_file = str(tmp_path / "cache" / "gvcf" / "ab" / "abc.g.vcf")
+    shell = tmp_path / "haplotypecaller-0.sh"
+    shell.write_text(_haplotypecaller_shell("ref.fa", "a.bam", "chr22:1-100",
+        temp_file, gvcf_file))
+    env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}")
+    result = subprocess.run(["bash", str(shell)], env=env)
+    return result.returncode, gvcf_file
+
+def test_haplotypecaller_shell(tmp_path):
+    returncode, gvcf_file = _run_shell(tmp_path, 0)
+    assert returncode == 0
+    assert os.path.exists(gvcf_file) and os.path.exists(f"{gvcf_file}.idx")
+
+def test_haplotypecaller_shell_failure(tmp_path):
+    returncode, gvcf_file = _run_shell(tmp_path, 1)
+    assert returncode != 0
+    assert not os.path.exists(os.path.dirname(gvcf_file))
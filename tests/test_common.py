@@ -0,0 +1,38 @@
+import pysam
+
+from pypgx.common import (
+    bam_header,
+    bam_headers,
+    sm_tag,
+    get_stardb,
+    get_target_genes,
+    get_target_region,
+    clear_cache,
+    cache_info,
+)
+
+def test_get_stardb_cache():
+    clear_cache()
+    stardb1 = get_stardb("cyp2d6", "hg19")
+    stardb2 = get_stardb("cyp2d6", "hg19")
+    assert stardb1 is stardb2
+    assert stardb1 is not get_stardb("cyp2d6", "hg38")
+    assert cache_info()["stardb"].currsize == 2
+    clear_cache()
+    assert get_stardb("cyp2d6", "hg19") is not stardb1
+    assert get_stardb("cyp2d6", "hg19")["*2"].score == 1.0
+
+def test_get_target_region():
+    assert "cyp2d6" in get_target_genes()
+    assert get_target_region("cyp2d6", "hg19") == "chr22:42512500-42551883"
+
+def test_bam_header(tmp_path):
+    fn = str(tmp_path / "test.bam")
+    header = {"SQ": [{"SN": "chr22", "LN": 100}],
+        "RG": [{"ID": "a", "SM": "S1"}, {"ID": "b", "SM": "S1"}]}
+    with pysam.AlignmentFile(fn, "wb", header=header):
+        pass
+    info = bam_header(fn)
+    assert info.sm == ("S1",) and info.contigs == ("chr22",) and info.is_chr
+    assert bam_headers([fn, fn]) == [info, info]
+    assert sm_tag(fn) == "S1"
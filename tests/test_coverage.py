@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pysam
+
+from pypgx.common import bam_header, setup_ref_cache
+from pypgx.coverage import bam_depth, merge_intervals, window_bins, bin_depth
+
+def _make_bam(fn):
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": "22", "LN": 1000}]}
+    reads = [
+        ("100M", 0, 60), ("50M5D50M", 10, 60), ("20S80M", 20, 60),
+        ("40M100N60M", 30, 60), ("100M", 40, 0), ("100M", 50, 60, 0x400),
+    ]
+    with pysam.AlignmentFile(fn, "wb", header=header) as f:
+        for i, (cigar, pos, mapq, *flag) in enumerate(reads):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.cigarstring = cigar
+            a.query_sequence = "A" * a.infer_query_length()
+            a.reference_id = 0
+            a.reference_start = pos
+            a.mapping_quality = mapq
+            a.flag = flag[0] if flag else 0
+            f.write(a)
+    pysam.index(fn)
+
+def test_bam_depth(tmp_path):
+    fn = str(tmp_path / "test.bam")
+    _make_bam(fn)
+    depth = bam_depth(fn, "22", 1, 300)
+    result = pysam.depth("-a", "-Q", "1", "-r", "22:1-300", fn)
+    assert depth.tolist() == [
+        int(x.split("\t")[2]) for x in result.strip().split("\n")]
+
+def test_merge_intervals():
+    intervals = [("22", 50, 60), ("12", 1, 5), ("22", 10, 20), ("22", 21, 55)]
+    assert merge_intervals(intervals) == [("22", 10, 60), ("12", 1, 5)]
+
+def test_bin_depth():
+    positions = np.arange(101, 106)
+    depth = np.array([[1, 0], [2, 0], [3, 9], [4, 9], [10, 9]])
+    bins = window_bins(101, 105, 2)
+    assert bins == [(101, 102), (103, 104), (105, 105)]
+    assert bin_depth(positions, depth, bins).tolist() == [
+        [1.5, 0], [3.5, 9], [10, 9]]
+    assert bin_depth(positions, depth, [(101, 105)], "median").tolist() == [
+        [3, 9]]
+
+def test_cram_depth(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "ref_cache")
+    monkeypatch.setenv("REF_PATH", f"{cache_dir}/%2s/%2s/%s")
+    monkeypatch.setenv("REF_CACHE", f"{cache_dir}/%2s/%2s/%s")
+    bam = str(tmp_path / "test.bam")
+    cram = str(tmp_path / "test.cram")
+    fasta = str(tmp_path / "ref.fa")
+    _make_bam(bam)
+    with open(fasta, "w") as f:
+        f.write(">22\n" + "acgt" * 250 + "\n")
+    pysam.faidx(fasta)
+    pysam.view("-C", "-T", fasta, "-o", cram, bam, catch_stdout=False)
+    pysam.index(cram)
+    setup_ref_cache([cram], fasta, cache_dir)
+    md5 = bam_header(cram).md5[0]
+    assert os.path.exists(f"{cache_dir}/{md5[:2]}/{md5[2:4]}/{md5[4:]}")
+    # The CRAM file is decoded from the cache without the FASTA file.
+    os.remove(fasta)
+    assert (bam_depth(cram, "22", 1, 300).tolist()
+        == bam_depth(bam, "22", 1, 300).tolist())
@@ -0,0 +1,36 @@
+import numpy as np
+
+from pypgx.depthmatrix import (
+    DepthMatrix,
+    write_depth_matrix,
+    write_depth_chunks,
+)
+from pypgx.dm2gdf import dm2gdf
+
+def test_depth_matrix(tmp_path):
+    fn = str(tmp_path / "test.dm")
+    blocks = [
+        ("22", np.arange(100, 110), np.arange(20).reshape(10, 2)),
+        ("12", np.arange(5, 8), np.array([[1, 2], [3, 70000], [5, 6]])),
+    ]
+    write_depth_matrix(fn, ["A", "B"], blocks)
+    dm = DepthMatrix(fn)
+    assert dm.samples == ["A", "B"]
+    assert dm.regions == ["22:100-109", "12:5-7"]
+    contig, positions, depth = dm.fetch("22:102-103")
+    assert positions.tolist() == [102, 103]
+    assert depth.tolist() == [[4, 5], [6, 7]]
+    lines = dm2gdf(fn, region="12:6-6").splitlines()
+    assert lines[1] == "12:6\t70003\t35001.5\t3\t70000"
+
+def test_write_depth_chunks(tmp_path):
+    depth = np.arange(26).reshape(13, 2)
+    write_depth_matrix(str(tmp_path / "a.dm"), ["A", "B"], [
+        ("22", np.arange(100, 110), depth[:10]),
+        ("12", np.arange(5, 8), depth[10:]),
+    ])
+    write_depth_chunks(str(tmp_path / "b.dm"), ["A", "B"],
+        [("22", 100, 109), ("12", 5, 7)],
+        [depth[:4], depth[4:11], depth[11:]], int(depth.max()))
+    a = (tmp_path / "a.dm").read_bytes()
+    assert a == (tmp_path / "b.dm").read_bytes()
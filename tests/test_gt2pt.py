@@ -0,0 +1,29 @@
+from pypgx.gt2pt import gt2pt
+
+HEADER = "name\tgene\thap1_main\thap2_main\n"
+
+def test_gt2pt(tmp_path):
+    a = tmp_path / "a.txt"
+    b = tmp_path / "b.txt"
+    a.write_text(HEADER + "S1\tcyp2d6\t*1\t*4\n")
+    b.write_text(HEADER)
+    assert gt2pt(str(a)) == "intermediate_metabolizer\n"
+    assert gt2pt(str(b)) == "\n"
+    lines = gt2pt([str(a), str(b)]).splitlines()
+    assert lines == ["file\tname\tgene\tphenotype",
+        f"{a}\tS1\tcyp2d6\tintermediate_metabolizer"]
+    gt2pt([str(a), str(b)], threads=2, output=str(tmp_path / "out.tsv"))
+    assert (tmp_path / "out.tsv").read_text().splitlines() == lines
+
+def test_gt2pt_dir(tmp_path):
+    gt_dir = tmp_path / "gt"
+    gt_dir.mkdir()
+    a = gt_dir / "genotype.txt"
+    a.write_text(HEADER + "S1\tcyp2d6\t*1\t*4\n")
+    lines = ["file\tname\tgene\tphenotype",
+        f"{a}\tS1\tcyp2d6\tintermediate_metabolizer"]
+    assert gt2pt(None, gt_dir=str(gt_dir)).splitlines() == lines
+    assert gt2pt(str(gt_dir)).splitlines() == lines
+    gt_list = tmp_path / "list.txt"
+    gt_list.write_text(f"{a}\n")
+    assert gt2pt(None, gt_list=str(gt_list)).splitlines() == lines
@@ -0,0 +1,41 @@
+import os
+
+from pypgx.gvcfcache import (
+    gvcf_key,
+    gvcf_path,
+    store_gvcf,
+    read_workspace,
+    write_workspace,
+    remove_workspace,
+)
+
+def test_gvcf_key(tmp_path):
+    bam = tmp_path / "a.bam"
+    fasta = tmp_path / "ref.fa"
+    bam.write_text("a")
+    fasta.write_text(">1\nA\n")
+    key = gvcf_key(str(bam), "chr22:1-100", str(fasta), "v4.1.9.0")
+    assert key == gvcf_key(str(bam), "chr22:1-100", str(fasta), "v4.1.9.0")
+    assert key != gvcf_key(str(bam), "chr22:1-101", str(fasta), "v4.1.9.0")
+    assert key != gvcf_key(str(bam), "chr22:1-100", str(fasta), "v4.2.0.0")
+    bam.write_text("ab")
+    assert key != gvcf_key(str(bam), "chr22:1-100", str(fasta), "v4.1.9.0")
+
+def test_store_gvcf(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    gvcf_file = tmp_path / "0.g.vcf"
+    gvcf_file.write_text("gvcf")
+    (tmp_path / "0.g.vcf.idx").write_text("idx")
+    dest = store_gvcf(cache_dir, "abc", str(gvcf_file), {"sample": "S1"})
+    assert dest == gvcf_path(cache_dir, "abc")
+    assert os.path.exists(f"{dest}.idx") and not gvcf_file.exists()
+    assert open(dest).read() == "gvcf"
+
+def test_workspace(tmp_path):
+    workspace = str(tmp_path / "ws")
+    assert read_workspace(workspace) == {}
+    os.mkdir(workspace)
+    write_workspace(workspace, {"abc": "S1"})
+    assert read_workspace(workspace) == {"abc": "S1"}
+    remove_workspace(workspace)
+    assert read_workspace(workspace) == {} and not os.path.exists(workspace)
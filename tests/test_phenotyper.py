@@ -1,7 +1,20 @@
-from pypgx.phenotyper import phenotyper
+from pypgx.phenotyper import phenotyper, phenotyper_batch
 
 def test_phenotyper():
     assert phenotyper("cyp2d6", "*1", "*1") == "normal_metabolizer"
     assert phenotyper("cyp2d6", "*1", "*4") == "intermediate_metabolizer"
     assert phenotyper("cyp2d6", "*1", "*2x2") == "ultrarapid_metabolizer"
-    assert phenotyper("cyp2d6", "*4", "*5") == "poor_metabolizer"
\ No newline at end of file
+    assert phenotyper("cyp2d6", "*4", "*5") == "poor_metabolizer"
+
+def test_phenotyper_batch():
+    genes = ["cyp2d6", "cyp2d6", "cyp2c19", "slco1b1", "dpyd", "foo"]
+    hap1s = ["*1", "*4", "*17", "*5", "*1", "*1"]
+    hap2s = ["*2x2", "*5", "*17", "*1", "*2", "*1"]
+    result = phenotyper_batch(genes, hap1s, hap2s)
+    assert list(result[:5]) == [
+        phenotyper(*x) for x in zip(genes[:5], hap1s[:5], hap2s[:5])]
+    assert result[5] == "no_phenotype"
+
+def test_phenotyper_unknown_gene():
+    assert phenotyper("foo", "*1", "*1") == "no_phenotype"
+    assert list(phenotyper_batch(["foo"], ["*1"], ["*1"])) == ["no_phenotype"]
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from pypgx.resultcache import (
+    bam_fingerprint,
+    fetch_entry,
+    store_entry,
+    list_entries,
+    read_access_log,
+    evict,
+)
+
+def test_bam_fingerprint(tmp_path):
+    bam = tmp_path / "a.bam"
+    bam.write_bytes(os.urandom(3 << 20))
+    copy = tmp_path / "b.bam"
+    shutil.copy(bam, copy)
+    assert bam_fingerprint(str(bam)) == bam_fingerprint(str(copy))
+    with open(copy, "r+b") as f:
+        f.write(b"x")
+    assert bam_fingerprint(str(bam)) != bam_fingerprint(str(copy))
+
+def test_store_entry(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    vcf_file = tmp_path / "pypgx.vcf"
+    vcf_file.write_text("vcf")
+    assert fetch_entry(cache_dir, "vcf", "abc") is None
+    entry = store_entry(cache_dir, "vcf", "abc", [str(vcf_file)])
+    assert fetch_entry(cache_dir, "vcf", "abc") == entry
+    assert open(f"{entry}/pypgx.vcf").read() == "vcf"
+    assert read_access_log(cache_dir)["vcf"] == [1, 1]
+
+def test_evict(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    for i, key in enumerate(["aa", "bb", "cc"]):
+        fn = tmp_path / "pypgx.gdf"
+        fn.write_text("x" * 100)
+        entry = store_entry(cache_dir, "gdf", key, [str(fn)])
+        os.utime(f"{entry}/entry.json", (i, i))
+    entries = list_entries(cache_dir)
+    assert len(entries) == 3
+    removed = evict(cache_dir, max_size=sum([x["size"] for x in entries]) - 1)
+    assert [os.path.basename(x["path"]) for x in removed] == ["aa"]
+    assert len(evict(cache_dir, max_age=0)) == 2
+    assert list_entries(cache_dir) == []
+
+def test_compact_access_log(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    for i in range(10):
+        fetch_entry(cache_dir, "vcf", "abc")
+    store_entry(cache_dir, "vcf", "abc", [])
+    fetch_entry(cache_dir, "vcf", "abc")
+    evict(cache_dir)
+    assert read_access_log(cache_dir)["vcf"] == [1, 10]
+    log = open(f"{cache_dir}/bam2gt/access.log").read().splitlines()
+    assert len(log) == 6
+    fetch_entry(cache_dir, "vcf", "abc")
+    assert read_access_log(cache_dir)["vcf"] == [2, 10]
@@ -0,0 +1,18 @@
+from io import StringIO
+
+from pypgx.sdf2gdf import sdf2gdf, write_gdf
+
+SDF = "22\t100\t10\t20\n22\t101\t3\t4\n22\t102\t0\t0\n"
+
+def test_sdf2gdf():
+    lines = sdf2gdf(None, ["A", "B"], f=StringIO(SDF)).splitlines()
+    assert lines[0] == ("Locus\tTotal_Depth\tAverage_Depth_sample"
+        "\tDepth_for_A\tDepth_for_B")
+    assert lines[1:] == ["22:100\t30\t15\t10\t20", "22:101\t7\t3.5\t3\t4",
+        "22:102\t0\t0\t0\t0"]
+
+def test_write_gdf_chunks():
+    out1, out2 = StringIO(), StringIO()
+    write_gdf(StringIO(SDF), ["A", "B"], out1)
+    write_gdf(StringIO(SDF), ["A", "B"], out2, chunk_size=1)
+    assert out1.getvalue() == out2.getvalue()
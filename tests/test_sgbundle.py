@@ -0,0 +1,29 @@
+import os
+
+from pypgx.sgbundle import compile_bundle, open_bundle, SGBundle
+from pypgx.sglib import read_gene_table, read_snp_table, read_star_table
+
+SG_DIR = os.path.join(os.path.dirname(__file__), "..", "pypgx", "resources", "sg")
+
+def test_compile_bundle(tmp_path):
+    bundle = SGBundle(compile_bundle(SG_DIR, str(tmp_path / "sg_tables.bin")))
+    gene_table = read_gene_table(f"{SG_DIR}/gene_table.txt")
+    snp_table = read_snp_table(f"{SG_DIR}/snp_table.txt", gene_table)
+    star_table = read_star_table(f"{SG_DIR}/star_table.txt")
+    assert bundle.is_current(SG_DIR)
+    assert bundle.gene_table() == gene_table
+    assert bundle.snp_table("cyp2d6") == snp_table["cyp2d6"]
+    assert bundle.star_table("cyp2d6") == star_table["cyp2d6"]
+
+def test_open_bundle(tmp_path):
+    assert open_bundle(str(tmp_path)) is None
+
+def test_is_current(tmp_path):
+    for x in ["gene_table.txt", "snp_table.txt", "star_table.txt"]:
+        (tmp_path / x).write_text(open(f"{SG_DIR}/{x}").read())
+    assert open_bundle(str(tmp_path)) is None
+    compile_bundle(str(tmp_path))
+    assert open_bundle(str(tmp_path)) is not None
+    with open(tmp_path / "star_table.txt", "a") as f:
+        f.write("\n")
+    assert open_bundle(str(tmp_path)) is None
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import pypgx.sglib
+from pypgx.sglib import (
+    SNPAllele,
+    StarAllele,
+    BioHaplotype,
+    read_star_table,
+    read_table_index,
+    parse_haplotype,
+    sort_star_names,
+)
+
+def test_slots():
+    for cls in [SNPAllele, StarAllele, BioHaplotype]:
+        with pytest.raises(AttributeError):
+            cls().foo = 1
+
+def test_read_star_table_genes():
+    fn = "pypgx/resources/sg/star_table.txt"
+    star_table = read_star_table(fn)
+    assert read_star_table(fn, ["cyp2d6"]) == {"cyp2d6": star_table["cyp2d6"]}
+
+def test_parse_haplotype():
+    haplotype = parse_haplotype("*36+*10x2")
+    assert haplotype.components == (("*36", 1), ("*10", 2))
+    assert parse_haplotype("*36+*10x2") is haplotype
+    assert sort_star_names(["*4", "*3x2", "*DEL", "*3"]) == [
+        "*3", "*3x2", "*4", "*DEL"]
+
+def test_read_table_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(pypgx.sglib, "TABLE_INDEX_DIR", str(tmp_path / "idx"))
+    table = tmp_path / "star_table.txt"
+    table.write_text("gene\tname\na\t*1\nb\t*1\n")
+    assert read_table_index(str(table))["genes"]["b"] == [[15, 20]]
+    assert sorted(os.listdir(tmp_path)) == ["idx", "star_table.txt"]
+    assert [x[-4:] for x in os.listdir(tmp_path / "idx")] == [".idx"]
+    table.write_text("gene\tname\nb\t*1\n")
+    assert read_table_index(str(table))["genes"]["b"] == [[10, 15]]
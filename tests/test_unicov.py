@@ -0,0 +1,16 @@
+import numpy as np
+
+from pypgx.unicov import uniformity, _make_pieces
+
+def test_uniformity():
+    counts = np.array([[3, 2, 1], [4, 4, 4]])
+    result = uniformity(counts, [4, 4])
+    assert result.tolist() == [[75.0, 50.0, 25.0], [100.0, 100.0, 100.0]]
+
+def test_make_pieces():
+    intervals = [("chr22", 100, 200), ("chr12", 1, 10)]
+    genes = [("a", "22", 150, 300), ("b", "22", 180, 190)]
+    pieces, owners = _make_pieces(intervals, genes)
+    assert pieces == [("chr22", 100, 149), ("chr22", 150, 179),
+        ("chr22", 180, 190), ("chr22", 191, 200), ("chr12", 1, 10)]
+    assert owners == [(0, []), (0, [0]), (0, [0, 1]), (0, [0]), (1, [])]